@@ -0,0 +1,157 @@
+"""
+Failover and hedged requests across AI providers.
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+
+import openai
+
+from ai_scheduler import ai_scheduler
+from config_manager import config_manager
+
+# Latencies kept per provider for the hedge threshold
+LATENCY_SAMPLES = 200
+# Fewer samples than this and AI_HEDGE_MIN_DELAY is used on its own
+MIN_LATENCY_SAMPLES = 20
+
+
+class AIFailover:
+    """
+    Sends a request to a list of candidate providers, primary first.
+
+    A candidate is a (provider, client, model) tuple. If a provider still fails after
+    the scheduler's retries, the request moves on to the next one. In async calls with
+    AI_HEDGE_REQUESTS set, a duplicate request also goes to the next provider once the
+    current one has taken longer than AI_HEDGE_PERCENTILE of its recent latencies; the
+    first answer wins and the other request is cancelled. Sync calls only fail over,
+    since a blocking request cannot be cancelled once sent.
+    """
+
+    def __init__(self):
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def _record_latency(self, provider, latency):
+        with self._lock:
+            self._latencies.setdefault(provider, deque(maxlen=LATENCY_SAMPLES)).append(latency)
+
+    def hedge_delay(self, provider):
+        """Seconds to wait for a provider before hedging to the next one."""
+        min_delay = config_manager.get('AI_HEDGE_MIN_DELAY', 1.0)
+        with self._lock:
+            samples = sorted(self._latencies.get(provider, ()))
+        if len(samples) < MIN_LATENCY_SAMPLES:
+            return min_delay
+        percentile = min(100.0, max(0.0, config_manager.get('AI_HEDGE_PERCENTILE', 95.0)))
+        index = min(len(samples) - 1, int(len(samples) * percentile / 100))
+        return max(min_delay, samples[index])
+
+    @staticmethod
+    def _candidate_request(model, request, refit):
+        """The request for one candidate, re-fitted when its model differs from the primary's."""
+        if refit is not None and model != request.get('model'):
+            return dict(request, **refit(model))
+        return dict(request, model=model)
+
+    def _attempt(self, candidate, request, refit=None):
+        provider, client, model = candidate
+        request = self._candidate_request(model, request, refit)
+
+        # Only time spent on the wire counts, not waiting for a slot or backing off between retries
+        def send():
+            started = time.monotonic()
+            result = client.chat.completions.create(**request)
+            self._record_latency(provider, time.monotonic() - started)
+            return result
+
+        return ai_scheduler.run(provider, request, send)
+
+    async def _attempt_async(self, candidate, request, refit=None):
+        provider, client, model = candidate
+        request = self._candidate_request(model, request, refit)
+
+        async def send():
+            started = time.monotonic()
+            try:
+                result = await client.chat.completions.create(**request)
+            except asyncio.CancelledError:
+                # Lost a hedge race; it took at least this long, which keeps the percentile honest
+                self._record_latency(provider, time.monotonic() - started)
+                raise
+            self._record_latency(provider, time.monotonic() - started)
+            return result
+
+        return await ai_scheduler.run_async(provider, request, send)
+
+    def run(self, candidates, request, refit=None):
+        """
+        Send a chat completion request, failing over between candidates.
+
+        Args:
+            candidates: (provider, client, model) tuples, primary first.
+            request: The chat completion arguments; 'model' is replaced per candidate.
+            refit: Optional callable returning the arguments rebuilt for another model.
+                Prompts fitted to the primary model's token budget are re-fitted with it
+                for a candidate that uses a different model.
+
+        Returns:
+            The first successful response.
+
+        Raises:
+            openai.APIError: The last provider's error if every provider failed.
+        """
+        last_error = None
+        for index, candidate in enumerate(candidates):
+            try:
+                return self._attempt(candidate, request, refit)
+            except openai.APIError as e:
+                last_error = e
+                if index + 1 < len(candidates):
+                    print(f"[INFO] {candidate[0]} request failed ({type(e).__name__}), failing over to {candidates[index + 1][0]}")
+        raise last_error
+
+    async def run_async(self, candidates, request, refit=None):
+        """Async version of run, which also hedges slow requests when AI_HEDGE_REQUESTS is set."""
+        if len(candidates) == 1:
+            return await self._attempt_async(candidates[0], request, refit)
+
+        hedging = config_manager.get('AI_HEDGE_REQUESTS', False)
+        remaining = list(candidates)
+        pending = {}
+        last_error = None
+        start_next = True
+        try:
+            while True:
+                if start_next and remaining:
+                    candidate = remaining.pop(0)
+                    pending[asyncio.ensure_future(self._attempt_async(candidate, request, refit))] = candidate[0]
+                    latest_provider = candidate[0]
+                start_next = False
+                if not pending:
+                    raise last_error
+
+                timeout = self.hedge_delay(latest_provider) if hedging and remaining else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    print(f"[INFO] {latest_provider} is slow, hedging with {remaining[0][0]}")
+                    start_next = True
+                    continue
+                for task in done:
+                    provider = pending.pop(task)
+                    try:
+                        return task.result()
+                    except openai.APIError as e:
+                        last_error = e
+                        if remaining:
+                            print(f"[INFO] {provider} request failed ({type(e).__name__}), failing over to {remaining[0][0]}")
+                # A request failed: move on to the next provider without waiting
+                start_next = True
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+# Global instance
+ai_failover = AIFailover()
@@ -0,0 +1,406 @@
+"""
+Rate limiting, retries and adaptive concurrency for AI provider requests.
+"""
+import asyncio
+import json
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import openai
+
+from config_manager import config_manager
+from token_budget import count_tokens, MESSAGE_OVERHEAD_TOKENS
+
+# Errors worth retrying: 429s, timeouts, dropped connections and 5xx responses
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+# Weight of the newest sample in the latency average
+LATENCY_SMOOTHING = 0.2
+
+
+class _ModelLimiter:
+    """
+    Token buckets and the adaptive concurrency limit of one provider/model.
+
+    Both buckets hold at most one minute's allowance and refill continuously. The
+    concurrency limit follows AIMD: it is halved on a 429, grows by about one slot per
+    round of successful requests, and shrinks slightly when latency rises well above
+    the best latency seen, since that means requests are queueing at the provider.
+    """
+
+    def __init__(self, max_concurrency):
+        now = time.monotonic()
+        self.requests_per_minute = 0
+        self.tokens_per_minute = 0
+        self.request_bucket = 0.0
+        self.token_bucket = 0.0
+        self.refilled_at = now
+        self.max_concurrency = max_concurrency
+        self.concurrency_limit = float(max_concurrency)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.decreased_at = 0.0
+        self.latency = None
+        self.best_latency = None
+
+    def configure(self, requests_per_minute, tokens_per_minute, max_concurrency):
+        if requests_per_minute != self.requests_per_minute:
+            self.requests_per_minute = requests_per_minute
+            self.request_bucket = float(requests_per_minute)
+        if tokens_per_minute != self.tokens_per_minute:
+            self.tokens_per_minute = tokens_per_minute
+            self.token_bucket = float(tokens_per_minute)
+        if max_concurrency != self.max_concurrency:
+            self.max_concurrency = max_concurrency
+            self.concurrency_limit = min(self.concurrency_limit, float(max_concurrency))
+
+    def _refill(self, now):
+        elapsed = now - self.refilled_at
+        self.refilled_at = now
+        if self.requests_per_minute:
+            self.request_bucket = min(self.requests_per_minute, self.request_bucket + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self.token_bucket = min(self.tokens_per_minute, self.token_bucket + elapsed * self.tokens_per_minute / 60)
+
+    def try_acquire(self, tokens):
+        """
+        Take a slot and the budget for one request.
+
+        Returns 0 on success, the seconds to wait before trying again, or None when
+        every slot is taken and only a release can free one.
+        """
+        now = time.monotonic()
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.in_flight >= max(1, int(self.concurrency_limit)):
+            return None
+        if self.requests_per_minute and self.request_bucket < 1:
+            return (1 - self.request_bucket) * 60 / self.requests_per_minute
+        # A request larger than the whole bucket only waits for a full bucket
+        tokens = min(tokens, self.tokens_per_minute) if self.tokens_per_minute else 0
+        if tokens and self.token_bucket < tokens:
+            return (tokens - self.token_bucket) * 60 / self.tokens_per_minute
+        self.request_bucket -= 1
+        self.token_bucket -= tokens
+        self.in_flight += 1
+        return 0
+
+    def release(self, reserved_tokens, used_tokens=None, latency=None, rate_limited=False, retry_after=None):
+        now = time.monotonic()
+        self.in_flight = max(0, self.in_flight - 1)
+        if used_tokens is not None and self.tokens_per_minute:
+            # Most responses are shorter than max_tokens; give back what was not used
+            self.token_bucket = min(self.tokens_per_minute, self.token_bucket + max(0, reserved_tokens - used_tokens))
+
+        if rate_limited:
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+            self.request_bucket = min(self.request_bucket, 0.0)
+            # Requests already in flight often fail together; count that as one signal
+            if now - self.decreased_at > (self.latency or 1.0):
+                self.concurrency_limit = max(1.0, self.concurrency_limit / 2)
+                self.decreased_at = now
+            return
+
+        if latency is None:
+            return
+        self.latency = latency if self.latency is None else (1 - LATENCY_SMOOTHING) * self.latency + LATENCY_SMOOTHING * latency
+        # Let the baseline drift up slowly, so one lucky request does not set it forever
+        self.best_latency = self.latency if self.best_latency is None else min(self.best_latency * 1.01, self.latency)
+        if self.latency > 2 * self.best_latency and now - self.decreased_at > self.latency:
+            self.concurrency_limit = max(1.0, self.concurrency_limit * 0.9)
+            self.decreased_at = now
+        else:
+            self.concurrency_limit = min(float(self.max_concurrency), self.concurrency_limit + 1 / self.concurrency_limit)
+
+
+class _ReleasingStream:
+    """
+    A streamed response that holds its concurrency slot until the stream is exhausted
+    or closed, instead of until the first bytes arrived.
+    """
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def _finish(self, exhausted=False, error=None):
+        if not self._released:
+            self._released = True
+            self._release(exhausted, error)
+
+    def __iter__(self):
+        try:
+            for chunk in self._stream:
+                yield chunk
+        except GeneratorExit:
+            self._finish()
+            raise
+        except BaseException as e:
+            self._finish(error=e)
+            raise
+        self._finish(exhausted=True)
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._finish()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _AsyncReleasingStream(_ReleasingStream):
+    """Async version of _ReleasingStream."""
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                yield chunk
+        except GeneratorExit:
+            self._finish()
+            raise
+        except BaseException as e:
+            self._finish(error=e)
+            raise
+        self._finish(exhausted=True)
+
+    async def close(self):
+        try:
+            await self._stream.close()
+        finally:
+            self._finish()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+class AIScheduler:
+    """
+    Sends every AI request through per-provider/per-model rate limits.
+
+    Requests wait for room in the requests-per-minute and tokens-per-minute buckets
+    (AI_RATE_LIMIT_RPM / AI_RATE_LIMIT_TPM, overridable per model with AI_RATE_LIMITS)
+    and for a concurrency slot. 429s, timeouts, connection errors and 5xx responses are
+    retried up to AI_MAX_RETRIES times, after the provider's Retry-After or a jittered
+    exponential backoff. The SDK clients are created with max_retries=0 so retries are
+    only made here.
+    """
+
+    def __init__(self):
+        self._limiters = {}
+        self._lock = threading.Lock()
+        # Notified whenever a request releases its slot
+        self._slot_freed = threading.Condition(self._lock)
+        # (event loop, asyncio.Event) pairs of async requests waiting for a slot
+        self._async_waiters = set()
+        self._model_limits_source = None
+        self._model_limits = {}
+
+    def _get_model_limits(self):
+        source = config_manager.get('AI_RATE_LIMITS') or ''
+        if source != self._model_limits_source:
+            self._model_limits_source = source
+            try:
+                self._model_limits = json.loads(source) if source else {}
+            except json.JSONDecodeError as e:
+                print(f"[ERROR] AI_RATE_LIMITS is not valid JSON, ignoring it: {e}")
+                self._model_limits = {}
+        return self._model_limits
+
+    def _limiter(self, provider, model):
+        limits = self._get_model_limits().get(model) or {}
+        max_concurrency = max(1, int(limits.get('concurrency', config_manager.get('AI_MAX_CONCURRENCY', 16))))
+        limiter = self._limiters.get((provider, model))
+        if limiter is None:
+            limiter = self._limiters[(provider, model)] = _ModelLimiter(max_concurrency)
+        limiter.configure(
+            int(limits.get('rpm', config_manager.get('AI_RATE_LIMIT_RPM', 0))),
+            int(limits.get('tpm', config_manager.get('AI_RATE_LIMIT_TPM', 0))),
+            max_concurrency
+        )
+        return limiter
+
+    @staticmethod
+    def estimate_tokens(request):
+        """The tokens a chat completion request may use: its prompt plus max_tokens."""
+        model = request.get('model')
+        prompt_tokens = sum(
+            count_tokens(message.get('content') or '', model) + MESSAGE_OVERHEAD_TOKENS
+            for message in request.get('messages', [])
+        )
+        return prompt_tokens + (request.get('max_tokens') or 0)
+
+    @staticmethod
+    def _retry_after(error):
+        response = getattr(error, 'response', None)
+        if response is None:
+            return None
+        headers = response.headers
+        try:
+            if headers.get('retry-after-ms'):
+                return float(headers['retry-after-ms']) / 1000
+            value = headers.get('retry-after')
+            if not value:
+                return None
+            try:
+                return float(value)
+            except ValueError:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _backoff(attempt):
+        base = config_manager.get('AI_RETRY_BASE_DELAY', 0.5)
+        cap = config_manager.get('AI_RETRY_MAX_DELAY', 30.0)
+        return random.uniform(0, min(cap, base * 2 ** attempt))
+
+    @staticmethod
+    def _used_tokens(result):
+        usage = getattr(result, 'usage', None)
+        return getattr(usage, 'total_tokens', None) if usage else None
+
+    def _acquire(self, provider, model, tokens):
+        """Wait for a slot and the budget of one request."""
+        with self._slot_freed:
+            wait = self._limiter(provider, model).try_acquire(tokens)
+            while wait != 0:
+                # Returns early when a slot is released; None waits for that alone
+                self._slot_freed.wait(wait)
+                wait = self._limiter(provider, model).try_acquire(tokens)
+
+    async def _acquire_async(self, provider, model, tokens):
+        """Async version of _acquire."""
+        while True:
+            waiter = (asyncio.get_running_loop(), asyncio.Event())
+            with self._lock:
+                wait = self._limiter(provider, model).try_acquire(tokens)
+                if wait == 0:
+                    return
+                # Registered under the lock, so a release cannot slip in unnoticed
+                self._async_waiters.add(waiter)
+            try:
+                await asyncio.wait_for(waiter[1].wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._lock:
+                    self._async_waiters.discard(waiter)
+
+    def _release(self, provider, model, tokens, result=None, started=None, error=None):
+        """Give a request's slot back; started is None when there is no latency to record."""
+        with self._lock:
+            limiter = self._limiter(provider, model)
+            if isinstance(error, openai.RateLimitError):
+                limiter.release(tokens, rate_limited=True, retry_after=self._retry_after(error))
+            elif error is not None or started is None:
+                limiter.release(tokens)
+            else:
+                limiter.release(tokens, self._used_tokens(result), time.monotonic() - started)
+            self._slot_freed.notify_all()
+            async_waiters = list(self._async_waiters)
+        for loop, event in async_waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The waiter's event loop has already closed
+                pass
+
+    def _stream_release(self, provider, model, tokens, started):
+        def release(exhausted, error):
+            # A stream closed early says nothing about the provider's latency
+            self._release(provider, model, tokens, started=started if exhausted else None, error=error)
+        return release
+
+    def _retry_delay(self, error, attempt):
+        if isinstance(error, openai.RateLimitError):
+            retry_after = self._retry_after(error)
+            if retry_after is not None:
+                # Jitter keeps requests that were rejected together from retrying together
+                return retry_after + random.uniform(0, 0.1 * retry_after + 0.05)
+        return self._backoff(attempt)
+
+    def run(self, provider, request, send):
+        """
+        Send a request within the limits of its provider and model.
+
+        Args:
+            provider: The AI provider name, e.g. 'openai'.
+            request: The chat completion arguments; used for the model and token estimate.
+            send: A callable that sends the request and returns the response.
+
+        Returns:
+            The response of send(). A streamed response (request 'stream' set) keeps its
+            slot until it is exhausted or closed.
+
+        Raises:
+            The last error if every attempt failed, or any non-retryable error at once.
+        """
+        model = request.get('model')
+        tokens = self.estimate_tokens(request)
+        max_retries = config_manager.get('AI_MAX_RETRIES', 3)
+        for attempt in range(max_retries + 1):
+            self._acquire(provider, model, tokens)
+            started = time.monotonic()
+            try:
+                result = send()
+            except RETRYABLE_ERRORS as e:
+                self._release(provider, model, tokens, error=e)
+                if attempt == max_retries:
+                    raise
+                delay = self._retry_delay(e, attempt)
+                print(f"[INFO] {provider} request failed ({type(e).__name__}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            except BaseException as e:
+                self._release(provider, model, tokens, error=e)
+                raise
+            if request.get('stream'):
+                return _ReleasingStream(result, self._stream_release(provider, model, tokens, started))
+            self._release(provider, model, tokens, result=result, started=started)
+            return result
+
+    async def run_async(self, provider, request, send):
+        """Async version of run; send returns an awaitable."""
+        model = request.get('model')
+        tokens = self.estimate_tokens(request)
+        max_retries = config_manager.get('AI_MAX_RETRIES', 3)
+        for attempt in range(max_retries + 1):
+            await self._acquire_async(provider, model, tokens)
+            started = time.monotonic()
+            try:
+                result = await send()
+            except RETRYABLE_ERRORS as e:
+                self._release(provider, model, tokens, error=e)
+                if attempt == max_retries:
+                    raise
+                delay = self._retry_delay(e, attempt)
+                print(f"[INFO] {provider} request failed ({type(e).__name__}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            except BaseException as e:
+                self._release(provider, model, tokens, error=e)
+                raise
+            if request.get('stream'):
+                return _AsyncReleasingStream(result, self._stream_release(provider, model, tokens, started))
+            self._release(provider, model, tokens, result=result, started=started)
+            return result
+
+
+# Global instance
+ai_scheduler = AIScheduler()
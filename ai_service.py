@@ -2,11 +2,20 @@
 AI Service for processing email content.
 """
 import openai
+import asyncio
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from pydantic import ValidationError
 # import anthropic # Uncomment if you plan to use Anthropic
 
-from config_manager import config_manager
+from config_manager import config_manager, FAILOVER_ONLY_PROVIDERS
+from analysis_models import ComprehensiveAnalysis
+from token_budget import count_tokens, fit_body, truncate_to_tokens
+from text_preprocessing import HTML_PATTERN, clean_email_text
+from streaming_json import BatchReportStreamParser
+from ai_failover import ai_failover
 
 # Use the config manager for dynamic configuration
 def get_ai_config(key, default=None):
@@ -41,6 +50,105 @@ AI_TEMPERATURE = get_ai_config('AI_TEMPERATURE', 0.5)
 AI_MAX_TOKENS = get_ai_config('AI_MAX_TOKENS', 250)
 AI_OUTPUT_LANGUAGE = get_ai_config('AI_OUTPUT_LANGUAGE', 'Chinese')
 
+# Model setting and default of each provider that can serve a request
+PROVIDER_MODELS = {
+    'openai': ('OPENAI_MODEL', 'gpt-4o-mini'),
+    'openrouter': ('OPENROUTER_MODEL', 'openai/gpt-4o-mini'),
+    'custom': ('CUSTOM_MODEL', 'gpt-4o-mini'),
+}
+
+def _failover_candidates(client, model: str, asynchronous: bool) -> list:
+    """The configured provider followed by the AI_FAILOVER_PROVIDERS that have a client."""
+    candidates = [(get_ai_config('AI_PROVIDER', 'openai'), client, model)]
+    prefix = 'async_' if asynchronous else ''
+    for ai_provider in config_manager.get_failover_providers():
+        failover_client = config_manager.get_ai_client(f'{prefix}{ai_provider}_client')
+        if failover_client and ai_provider in PROVIDER_MODELS:
+            model_setting, default_model = PROVIDER_MODELS[ai_provider]
+            candidates.append((ai_provider, failover_client, get_ai_config(model_setting, default_model)))
+    return candidates
+
+def _create_completion(client, **request):
+    """
+    Sends a chat completion request through the rate limiter of the configured provider.
+
+    Every AI request in this module goes through here (or _create_completion_async),
+    so provider limits, retries, failover and hedging are handled in one place.
+    """
+    return ai_failover.run(_failover_candidates(client, request['model'], False), request)
+
+async def _create_completion_async(client, **request):
+    """Async version of _create_completion."""
+    return await ai_failover.run_async(_failover_candidates(client, request['model'], True), request)
+
+def _create_fitted_completion(client, model: str, build_request, **extra):
+    """
+    Sends a request whose prompt is fitted to the model's token budget.
+
+    build_request(model) returns the chat completion arguments for a model. It is called
+    again for a fallback provider with a different model, so the prompt is re-fitted to
+    that model's budget instead of reusing the primary's. extra (e.g. stream=True) is
+    added to every request.
+    """
+    request = dict(build_request(model), **extra)
+    return ai_failover.run(_failover_candidates(client, model, False), request, build_request)
+
+async def _create_fitted_completion_async(client, model: str, build_request, **extra):
+    """Async version of _create_fitted_completion."""
+    request = dict(build_request(model), **extra)
+    return await ai_failover.run_async(_failover_candidates(client, model, True), request, build_request)
+
+def _get_provider_client(asynchronous: bool = False):
+    """
+    Returns the client and model of the configured AI provider.
+
+    Args:
+        asynchronous: Return the AsyncOpenAI client instead of the blocking one.
+
+    Returns:
+        An (ai_provider, client, model, error) tuple; error is None when the client is usable.
+    """
+    ai_provider = get_ai_config('AI_PROVIDER', 'openai')
+    prefix = 'async_' if asynchronous else ''
+    if ai_provider == 'openai':
+        client = config_manager.get_ai_client(f'{prefix}openai_client')
+        model = get_ai_config('OPENAI_MODEL', 'gpt-4o-mini')
+    elif ai_provider == 'openrouter':
+        client = config_manager.get_ai_client(f'{prefix}openrouter_client')
+        model = get_ai_config('OPENROUTER_MODEL', 'openai/gpt-4o-mini')
+    elif ai_provider in FAILOVER_ONLY_PROVIDERS:
+        return ai_provider, None, None, f"[ERROR] AI_PROVIDER '{ai_provider}' can only be used in AI_FAILOVER_PROVIDERS."
+    else:
+        return ai_provider, None, None, f"[ERROR] Unsupported AI_PROVIDER: {ai_provider}"
+    if not client:
+        return ai_provider, None, model, f"[ERROR] {ai_provider} client not initialized. Please check your API key."
+    return ai_provider, client, model, None
+
+def _summary_request(subject: str, body: str, model: str) -> dict:
+    """Builds the chat completion arguments for an email summary."""
+    ai_output_language = get_ai_config('AI_OUTPUT_LANGUAGE', 'Chinese')
+    ai_max_tokens = get_ai_config('AI_MAX_TOKENS', 250)
+    ai_temperature = get_ai_config('AI_TEMPERATURE', 0.5)
+
+    system_prompt = f"You are an efficient assistant that summarizes emails. The summary should be concise and in {ai_output_language}. Extract key information and any required actions."
+    user_prompt_prefix = f"Subject: {subject}\n\nBody:\n"
+    # Truncate body to the model's input token budget, preserving the start of the email
+    truncated_body = fit_body(body, system_prompt, user_prompt_prefix, model, ai_max_tokens)
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt_prefix + truncated_body}
+        ],
+        "temperature": ai_temperature,
+        "max_tokens": ai_max_tokens,
+    }
+
+def _summary_from_response(response) -> str:
+    if response.choices:
+        return response.choices[0].message.content.strip()
+    return "[ERROR] No summary received from AI."
+
 def summarize_email_with_openai(subject: str, body: str) -> str:
     """
     Summarizes an email using the OpenAI API.
@@ -56,34 +164,11 @@ def summarize_email_with_openai(subject: str, body: str) -> str:
     if not openai_client:
         return "[ERROR] OpenAI client not initialized. Please check your OPENAI_API_KEY."
 
-    # Get current configuration values
-    ai_output_language = get_ai_config('AI_OUTPUT_LANGUAGE', 'Chinese')
-    openai_model = get_ai_config('OPENAI_MODEL', 'gpt-4o-mini')
-    ai_max_tokens = get_ai_config('AI_MAX_TOKENS', 250)
-    ai_temperature = get_ai_config('AI_TEMPERATURE', 0.5)
-
-    # Truncate body to avoid exceeding token limits, preserving the start of the email
-    # A safe limit, considering token usage for prompt and response
-    max_body_length = 8000 
-    truncated_body = body[:max_body_length] #
-
     try:
-        system_prompt = f"You are an efficient assistant that summarizes emails. The summary should be concise and in {ai_output_language}. Extract key information and any required actions."
-        user_prompt = f"Subject: {subject}\n\nBody:\n{truncated_body}"
-
-        response = openai_client.chat.completions.create(
-            model=openai_model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=ai_temperature,
-            max_tokens=ai_max_tokens,
+        response = _create_fitted_completion(
+            openai_client, get_ai_config('OPENAI_MODEL', 'gpt-4o-mini'), partial(_summary_request, subject, body)
         )
-        if response.choices:
-            return response.choices[0].message.content.strip()
-        else:
-            return "[ERROR] No summary received from AI."
+        return _summary_from_response(response)
 
     except openai.APIError as e:
         return f"[ERROR] OpenAI API error: {e}"
@@ -105,39 +190,341 @@ def summarize_email_with_openrouter(subject: str, body: str) -> str:
     if not openrouter_client:
         return "[ERROR] OpenRouter client not initialized. Please check your OPENROUTER_API_KEY."
 
-    # Get current configuration values
-    ai_output_language = get_ai_config('AI_OUTPUT_LANGUAGE', 'Chinese')
-    openrouter_model = get_ai_config('OPENROUTER_MODEL', 'openai/gpt-4o-mini')
-    ai_max_tokens = get_ai_config('AI_MAX_TOKENS', 250)
-    ai_temperature = get_ai_config('AI_TEMPERATURE', 0.5)
+    try:
+        response = _create_fitted_completion(
+            openrouter_client, get_ai_config('OPENROUTER_MODEL', 'openai/gpt-4o-mini'), partial(_summary_request, subject, body)
+        )
+        return _summary_from_response(response)
 
-    # Truncate body to avoid exceeding token limits, preserving the start of the email
-    # A safe limit, considering token usage for prompt and response
-    max_body_length = 8000 
-    truncated_body = body[:max_body_length] #
+    except openai.APIError as e:
+        return f"[ERROR] OpenRouter API error: {e}"
+    except Exception as e:
+        return f"[ERROR] An unexpected error occurred: {e}"
+
+def _load_batch_report_prompt(ai_output_language: str):
+    """
+    Loads the batch report system prompt from batch_summary_prompt.md.
 
+    Returns:
+        A (system_prompt, error) tuple; error is None on success, otherwise an error dictionary.
+    """
+    # Read the prompt template from the file
+    prompt_file_path = os.path.join(os.path.dirname(__file__), 'batch_summary_prompt.md')
+    if os.path.exists(prompt_file_path):
+        try:
+            with open(prompt_file_path, 'r', encoding='utf-8') as f:
+                prompt_template = f.read()
+            # Replace the placeholder with the actual language
+            system_prompt = prompt_template.format(AI_OUTPUT_LANGUAGE=ai_output_language)
+        except FileNotFoundError:
+            return None, {"error": f"[ERROR] Prompt file not found at {prompt_file_path}"}
+        except UnicodeDecodeError as e:
+            return None, {"error": f"[ERROR] Error decoding prompt file: {e}"}
+        except KeyError as e:
+            return None, {"error": f"[ERROR] Missing placeholder in prompt template: {e}"}
+        except Exception as e:
+            return None, {"error": f"[ERROR] Error processing prompt template: {e}"}
+    else:
+        # Fallback to a simple prompt if the file is not found
+        system_prompt = f"You are an expert email analyst. Create a structured, categorized report in valid JSON format in {ai_output_language}."
+    return system_prompt, None
+
+def _batch_report_request(email_entries: list, system_prompt: str, model: str) -> dict:
+    """Builds the chat completion arguments for a batch report written in a single call."""
+    user_prompt = f"Here is the list of email data to analyze and report on:\n\n{json.dumps(email_entries, indent=2, ensure_ascii=False)}"
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ],
+        "temperature": get_ai_config('AI_TEMPERATURE', 0.5),
+        "max_tokens": get_ai_config('AI_MAX_TOKENS', 250),
+    }
+
+def _parse_batch_report_json(raw_response_content: str) -> dict:
+    """
+    Parses a batch report returned by the AI, tolerating code fences and common JSON mistakes.
+
+    Returns:
+        The report dictionary, or a dictionary with an 'error' key.
+    """
+    parser = BatchReportStreamParser()
+    parser.feed(raw_response_content)
+    report = parser.result()
+    if report is None:
+        return {"error": f"[ERROR] Failed to parse AI response as JSON. Raw response: {raw_response_content[:1000]}..."}
+    return report
+
+@lru_cache(maxsize=1024)
+def _clean_body(body):
+    if HTML_PATTERN.search(body):
+        return clean_email_text(body_html=body)
+    return clean_email_text(body_plain=body)
+
+def prepare_body_for_ai(body):
+    """
+    Returns the text of a body (HTML or plain) to send to the AI.
+
+    Results are cached in memory, so analyzing the same email several times only
+    cleans it once. Set AI_CLEAN_BODY=false to send bodies unchanged.
+    """
+    if not body or not get_ai_config('AI_CLEAN_BODY', True):
+        return body
+    return _clean_body(body)
+
+def prepare_email_for_ai(email_data):
+    """
+    Returns the text of a parsed email to send to the AI.
+
+    Emails parsed by EmailClient carry the cleaned text in 'body_text', which saves
+    cleaning them again; with AI_CLEAN_BODY=false the body is sent unchanged.
+    """
+    if not get_ai_config('AI_CLEAN_BODY', True):
+        return email_data.get('body')
+    return email_data.get('body_text') or prepare_body_for_ai(email_data.get('body'))
+
+def analyze_email_for_batch(email: dict) -> dict:
+    """
+    Builds the per-email entry for a batch report prompt.
+
+    Failures are contained here so one bad email cannot sink the whole batch;
+    the entry then carries neutral defaults.
+    """
+    body = prepare_email_for_ai(email)
+    try:
+        comprehensive_analysis = analyze_email_comprehensive(
+            subject=email['subject'],
+            body=body,
+            from_addr=email['from'],
+            body_is_clean=True
+        )
+    except Exception as e:
+        comprehensive_analysis = {"error": f"[ERROR] Failed to analyze email {email.get('id')}: {e}"}
+    return _batch_entry(email, body, comprehensive_analysis)
+
+def _batch_entry(email: dict, body: str, comprehensive_analysis: dict) -> dict:
+    # Much shorter than a single-email budget, since many previews share one prompt
+    truncated_body = truncate_to_tokens(body, get_ai_config('BATCH_PREVIEW_TOKENS', 500), _current_model())
+    priority_analysis = comprehensive_analysis.get('priority_analysis') or {}
+    calendar_events = comprehensive_analysis.get('calendar_events') or {}
+
+    return {
+        "id": email['id'],
+        "from": email['from'],
+        "subject": email['subject'],
+        "body_preview": truncated_body,
+        "priority_score": priority_analysis.get('priority_score', 5),
+        "urgency_level": priority_analysis.get('urgency_level', '中'),
+        "priority_reasoning": priority_analysis.get('reasoning', ''),
+        "has_calendar_events": calendar_events.get('has_events', False),
+        "calendar_events": calendar_events.get('events', [])
+    }
+
+def analyze_emails_for_batch(emails: list) -> list:
+    """
+    Runs the per-email analysis of a batch report on a thread pool.
+
+    At most BATCH_ANALYSIS_WORKERS emails are analyzed at once, so a batch takes
+    roughly as long as its slowest emails instead of the sum of all of them.
+
+    Args:
+        emails: A list of dictionaries, each containing 'id', 'from', 'subject', and 'body' keys.
+
+    Returns:
+        The prompt entries, in the same order as the input emails.
+    """
+    max_workers = max(1, min(get_ai_config('BATCH_ANALYSIS_WORKERS', 8), len(emails)))
+    if max_workers == 1:
+        return [analyze_email_for_batch(email) for email in emails]
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='batch-analysis') as executor:
+        return list(executor.map(analyze_email_for_batch, emails))
+
+def _current_model() -> str:
+    """Returns the model name of the configured AI provider."""
+    if get_ai_config('AI_PROVIDER', 'openai') == 'openrouter':
+        return get_ai_config('OPENROUTER_MODEL', 'openai/gpt-4o-mini')
+    return get_ai_config('OPENAI_MODEL', 'gpt-4o-mini')
+
+def _use_hierarchical_report(email_entries: list) -> bool:
+    """Decides whether a batch report should be built with the map-reduce path."""
+    mode = get_ai_config('BATCH_REPORT_MODE', 'auto')
+    if mode == 'hierarchical':
+        return True
+    if mode != 'auto':
+        return False
+    prompt = json.dumps(email_entries, indent=2, ensure_ascii=False)
+    return count_tokens(prompt, _current_model()) > get_ai_config('BATCH_CHUNK_TOKENS', 6000)
+
+def _chunk_report_entries(email_entries: list, token_budget: int, model: str) -> list:
+    """Packs email entries, in order, into chunks whose prompts stay within token_budget."""
+    chunks = []
+    current_chunk = []
+    current_tokens = 0
+    for entry in email_entries:
+        entry_tokens = count_tokens(json.dumps(entry, indent=2, ensure_ascii=False), model)
+        if current_chunk and current_tokens + entry_tokens > token_budget:
+            chunks.append(current_chunk)
+            current_chunk = []
+            current_tokens = 0
+        current_chunk.append(entry)
+        current_tokens += entry_tokens
+    if current_chunk:
+        chunks.append(current_chunk)
+    return chunks
+
+def _request_partial_report(client, model: str, system_prompt: str, email_entries: list) -> dict:
+    """Map step: asks the AI for a categorized report covering one chunk of emails."""
     try:
-        system_prompt = f"You are an efficient assistant that summarizes emails. The summary should be concise and in {ai_output_language}. Extract key information and any required actions."
-        user_prompt = f"Subject: {subject}\n\nBody:\n{truncated_body}"
+        response = _create_completion(client, **_batch_report_request(email_entries, system_prompt, model))
+    except openai.APIError as e:
+        return {"error": f"[ERROR] AI API error: {e}"}
+    except Exception as e:
+        return {"error": f"[ERROR] An unexpected error occurred in batch processing: {e}"}
+    if not response.choices:
+        return {"error": "[ERROR] No report received from AI."}
+    return _parse_batch_report_json(response.choices[0].message.content.strip())
+
+def _fallback_partial_report(email_entries: list) -> dict:
+    """Stands in for a chunk whose partial report failed, so its emails still appear in the result."""
+    return {
+        "categories": [{
+            "name": "Uncategorized",
+            "emails": [
+                {
+                    "id": entry["id"],
+                    "from": entry["from"],
+                    "subject": entry["subject"],
+                    "summary": entry["body_preview"][:200],
+                    "priority_score": entry["priority_score"],
+                    "urgency_level": entry["urgency_level"],
+                    "priority_reasoning": entry["priority_reasoning"],
+                    "has_calendar_events": entry["has_calendar_events"],
+                    "calendar_events": entry["calendar_events"]
+                }
+                for entry in email_entries
+            ]
+        }]
+    }
+
+def _request_category_mapping(client, model: str, category_names: list) -> dict:
+    """
+    Reduce step: asks the AI to unify category names chosen independently per chunk.
+
+    Only the names are sent, so this request stays small however large the batch is.
 
-        response = openrouter_client.chat.completions.create(
-            model=openrouter_model,
+    Returns:
+        A dictionary mapping each original name to its merged name. Names the AI
+        leaves out map to themselves.
+    """
+    mapping = {name: name for name in category_names}
+    if len(category_names) < 2:
+        return mapping
+
+    ai_output_language = get_ai_config('AI_OUTPUT_LANGUAGE', 'Chinese')
+    system_prompt = (
+        "You merge email category names produced independently for different parts of one mailbox. "
+        f"Group names that mean the same thing and pick one name per group, in {ai_output_language}. "
+        "Aim for 3-7 final categories. Return only a JSON object mapping every input name to its final name."
+    )
+    try:
+        response = _create_completion(
+            client,
+            model=model,
             messages=[
                 {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
+                {"role": "user", "content": json.dumps(category_names, ensure_ascii=False)}
             ],
-            temperature=ai_temperature,
-            max_tokens=ai_max_tokens,
+            temperature=0,
+            max_tokens=max(200, 20 * len(category_names)),
         )
-        if response.choices:
-            return response.choices[0].message.content.strip()
-        else:
-            return "[ERROR] No summary received from AI."
-
-    except openai.APIError as e:
-        return f"[ERROR] OpenRouter API error: {e}"
+        merged = json.loads(response.choices[0].message.content.strip()) if response.choices else {}
     except Exception as e:
-        return f"[ERROR] An unexpected error occurred: {e}"
+        print(f"[INFO] Could not merge category names, keeping them as they are: {e}")
+        return mapping
+
+    if isinstance(merged, dict):
+        mapping.update({name: str(merged[name]) for name in category_names if merged.get(name)})
+    return mapping
+
+def _merge_partial_reports(partial_reports: list, mapping: dict) -> dict:
+    """Combines partial reports into the single 'categories' / 'calendar_summary' structure."""
+    categories = {}
+    seen_ids = set()
+    upcoming_meetings = []
+    for report in partial_reports:
+        for category in report.get('categories', []):
+            name = mapping.get(category.get('name'), category.get('name') or 'Uncategorized')
+            merged_emails = categories.setdefault(name, [])
+            for email_entry in category.get('emails', []):
+                # Keep each email once, even if the AI put it in two categories
+                if email_entry.get('id') in seen_ids:
+                    continue
+                seen_ids.add(email_entry.get('id'))
+                merged_emails.append(email_entry)
+        upcoming_meetings.extend((report.get('calendar_summary') or {}).get('upcoming_meetings', []))
+
+    merged_categories = []
+    for name, category_emails in categories.items():
+        category_emails.sort(key=lambda entry: entry.get('priority_score') or 0, reverse=True)
+        merged_categories.append({"name": name, "emails": category_emails})
+    # Categories holding the most urgent emails come first
+    merged_categories.sort(key=lambda category: max([entry.get('priority_score') or 0 for entry in category['emails']] or [0]), reverse=True)
+
+    emails_with_events = [
+        entry.get('id')
+        for category in merged_categories
+        for entry in category['emails']
+        if entry.get('has_calendar_events')
+    ]
+    total_events = sum(len(entry.get('calendar_events') or []) for category in merged_categories for entry in category['emails'])
+    return {
+        "categories": merged_categories,
+        "calendar_summary": {
+            "total_events": total_events,
+            "emails_with_events": emails_with_events,
+            "upcoming_meetings": upcoming_meetings
+        }
+    }
+
+def generate_hierarchical_batch_report(client, model: str, system_prompt: str, email_entries: list) -> dict:
+    """
+    Builds a batch report for an arbitrarily large batch with a map-reduce approach.
+
+    Emails are packed into chunks of about BATCH_CHUNK_TOKENS tokens and a partial
+    categorized report is requested for each chunk in parallel. The category names of
+    the partial reports are then unified in one small request and the reports merged
+    into the same structure a single-call report has.
+
+    Args:
+        client: The OpenAI-compatible client to use.
+        model: The model name.
+        system_prompt: The batch report system prompt.
+        email_entries: The per-email prompt entries from analyze_emails_for_batch.
+
+    Returns:
+        A dictionary containing the structured report, or an error message.
+    """
+    chunks = _chunk_report_entries(email_entries, get_ai_config('BATCH_CHUNK_TOKENS', 6000), model)
+    max_workers = max(1, min(get_ai_config('BATCH_ANALYSIS_WORKERS', 8), len(chunks)))
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='batch-report') as executor:
+        partial_reports = list(executor.map(lambda chunk: _request_partial_report(client, model, system_prompt, chunk), chunks))
+
+    failed = [report for report in partial_reports if "error" in report]
+    if len(failed) == len(partial_reports):
+        return failed[0]
+    for index, report in enumerate(partial_reports):
+        if "error" in report:
+            print(f"[INFO] Partial report {index + 1}/{len(chunks)} failed, listing its emails uncategorized: {report['error']}")
+            partial_reports[index] = _fallback_partial_report(chunks[index])
+
+    category_names = []
+    for report in partial_reports:
+        for category in report.get('categories', []):
+            if category.get('name') and category['name'] not in category_names:
+                category_names.append(category['name'])
+    mapping = _request_category_mapping(client, model, category_names)
+    return _merge_partial_reports(partial_reports, mapping)
 
 def generate_batch_summary_report_with_openai(emails: list) -> dict:
     """
@@ -156,38 +543,8 @@ def generate_batch_summary_report_with_openai(emails: list) -> dict:
     if not emails:
         return {"error": "[INFO] No emails to summarize."}
 
-    # Prepare email data for the prompt, truncating bodies to save tokens
-    max_body_length_for_batch = 2000 # Shorter truncation for batch processing
-    email_summaries_for_prompt = []
-    
-    # Process each email to include priority and calendar analysis
-    for email in emails:
-        truncated_body = email['body'][:max_body_length_for_batch]
-        
-        # Get comprehensive analysis for each email
-        comprehensive_analysis = analyze_email_comprehensive(
-            subject=email['subject'],
-            body=email['body'],
-            from_addr=email['from']
-        )
-        
-        # Extract priority information
-        priority_analysis = comprehensive_analysis.get('priority_analysis', {})
-        calendar_events = comprehensive_analysis.get('calendar_events', {})
-        
-        email_data = {
-            "id": email['id'],
-            "from": email['from'],
-            "subject": email['subject'],
-            "body_preview": truncated_body,
-            "priority_score": priority_analysis.get('priority_score', 5),
-            "urgency_level": priority_analysis.get('urgency_level', '中'),
-            "priority_reasoning": priority_analysis.get('reasoning', ''),
-            "has_calendar_events": calendar_events.get('has_events', False),
-            "calendar_events": calendar_events.get('events', [])
-        }
-        
-        email_summaries_for_prompt.append(email_data)
+    # Analyze every email (priority and calendar) with bounded concurrency
+    email_summaries_for_prompt = analyze_emails_for_batch(emails)
     
     # Sort emails by priority score (highest first)
     email_summaries_for_prompt.sort(key=lambda x: x['priority_score'], reverse=True)
@@ -196,106 +553,23 @@ def generate_batch_summary_report_with_openai(emails: list) -> dict:
         # Get current configuration values
         ai_output_language = get_ai_config('AI_OUTPUT_LANGUAGE', 'Chinese')
         openai_model = get_ai_config('OPENAI_MODEL', 'gpt-4o-mini')
-        ai_max_tokens = get_ai_config('AI_MAX_TOKENS', 250)
-        ai_temperature = get_ai_config('AI_TEMPERATURE', 0.5)
 
         # Read the prompt template from the file
-        prompt_file_path = os.path.join(os.path.dirname(__file__), 'batch_summary_prompt.md')
-        if os.path.exists(prompt_file_path):
-            try:
-                with open(prompt_file_path, 'r', encoding='utf-8') as f:
-                    prompt_template = f.read()
-                # Replace the placeholder with the actual language
-                system_prompt = prompt_template.format(AI_OUTPUT_LANGUAGE=ai_output_language)
-            except FileNotFoundError:
-                return {"error": f"[ERROR] Prompt file not found at {prompt_file_path}"}
-            except UnicodeDecodeError as e:
-                return {"error": f"[ERROR] Error decoding prompt file: {e}"}
-            except KeyError as e:
-                return {"error": f"[ERROR] Missing placeholder in prompt template: {e}"}
-            except Exception as e:
-                return {"error": f"[ERROR] Error processing prompt template: {e}"}
-        else:
-            # Fallback to a simple prompt if the file is not found
-            system_prompt = f"You are an expert email analyst. Create a structured, categorized report in valid JSON format in {ai_output_language}."
-            
-        user_prompt = f"Here is the list of email data to analyze and report on:\n\n{json.dumps(email_summaries_for_prompt, indent=2, ensure_ascii=False)}"
+        system_prompt, prompt_error = _load_batch_report_prompt(ai_output_language)
+        if prompt_error:
+            return prompt_error
 
-        # Use a reasonable limit for batch reports to avoid token limit issues
-        # max_output_tokens = min(100000, AI_MAX_TOKENS)
-        
-        response = openai_client.chat.completions.create(
-            model=openai_model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=ai_temperature,
-            max_tokens=ai_max_tokens, # Reasonable limit for batch reports
+        # Large batches are reported chunk by chunk and merged
+        if _use_hierarchical_report(email_summaries_for_prompt):
+            return generate_hierarchical_batch_report(openai_client, openai_model, system_prompt, email_summaries_for_prompt)
+            
+        response = _create_completion(
+            openai_client, **_batch_report_request(email_summaries_for_prompt, system_prompt, openai_model)
         )
         
         if response.choices:
             raw_response_content = response.choices[0].message.content.strip()
-            # Attempt to parse the AI's response as JSON
-            # The AI is instructed to return valid JSON, but we should be robust to minor formatting issues.
-            try:
-                # Sometimes AI adds ```json ... ``` wrapper or other text
-                # Try to extract JSON object from the response
-                import re
-                
-                # Remove any markdown code blocks
-                cleaned_response = re.sub(r'```json\s*', '', raw_response_content)
-                cleaned_response = re.sub(r'```\s*$', '', cleaned_response)
-                
-                # Look for a JSON object in the response
-                # This regex looks for a top-level JSON object
-                json_match = re.search(r'\{.*\}', cleaned_response, re.DOTALL)
-                if json_match:
-                    json_content = json_match.group(0)
-                    
-                    # Try to fix common JSON issues
-                    # 1. Fix trailing commas in arrays and objects
-                    json_content = re.sub(r',\s*([}\]])', r'\1', json_content)
-                    
-                    # 2. Ensure proper comma separation between array/object elements
-                    # This is a more complex fix - we'll try to add missing commas
-                    # Split by lines and check for missing commas
-                    lines = json_content.split('\n')
-                    fixed_lines = []
-                    
-                    for i, line in enumerate(lines):
-                        stripped_line = line.strip()
-                        fixed_lines.append(line)
-                        
-                        # Check if this line ends with } or ] and the next line starts with {
-                        if i < len(lines) - 1:
-                            next_line = lines[i + 1].strip()
-                            if (stripped_line.endswith('}') or stripped_line.endswith(']')) and \
-                               (next_line.startswith('{') or next_line.startswith('[')):
-                                # Add comma if missing
-                                if not stripped_line.endswith(',') and not stripped_line.endswith(',}') and not stripped_line.endswith(',]'):
-                                    fixed_lines[-1] = line.rstrip() + ','
-                    
-                    json_content = '\n'.join(fixed_lines)
-                    
-                    # Try to parse the fixed JSON
-                    report_data = json.loads(json_content)
-                    return report_data
-                else:
-                    return {"error": f"[ERROR] No valid JSON object found in AI response. Raw response: {raw_response_content[:500]}..."}
-                    
-            except json.JSONDecodeError as je:
-                # If JSON parsing still fails, try a more aggressive approach
-                try:
-                    # Try to extract just the categories array and reconstruct the JSON
-                    categories_match = re.search(r'"categories"\s*:\s*\[(.*?)\]', raw_response_content, re.DOTALL)
-                    if categories_match:
-                        # Return a minimal valid structure
-                        return {"categories": []}
-                    else:
-                        return {"error": f"[ERROR] Failed to parse AI response as JSON: {je}. Raw response: {raw_response_content[:1000]}..."}
-                except Exception:
-                    return {"error": f"[ERROR] Failed to parse AI response as JSON: {je}. Raw response: {raw_response_content[:1000]}..."}
+            return _parse_batch_report_json(raw_response_content)
         else:
             return {"error": "[ERROR] No report received from AI."}
 
@@ -321,38 +595,8 @@ def generate_batch_summary_report_with_openrouter(emails: list) -> dict:
     if not emails:
         return {"error": "[INFO] No emails to summarize."}
 
-    # Prepare email data for the prompt, truncating bodies to save tokens
-    max_body_length_for_batch = 2000 # Shorter truncation for batch processing
-    email_summaries_for_prompt = []
-    
-    # Process each email to include priority and calendar analysis
-    for email in emails:
-        truncated_body = email['body'][:max_body_length_for_batch]
-        
-        # Get comprehensive analysis for each email
-        comprehensive_analysis = analyze_email_comprehensive(
-            subject=email['subject'],
-            body=email['body'],
-            from_addr=email['from']
-        )
-        
-        # Extract priority information
-        priority_analysis = comprehensive_analysis.get('priority_analysis', {})
-        calendar_events = comprehensive_analysis.get('calendar_events', {})
-        
-        email_data = {
-            "id": email['id'],
-            "from": email['from'],
-            "subject": email['subject'],
-            "body_preview": truncated_body,
-            "priority_score": priority_analysis.get('priority_score', 5),
-            "urgency_level": priority_analysis.get('urgency_level', '中'),
-            "priority_reasoning": priority_analysis.get('reasoning', ''),
-            "has_calendar_events": calendar_events.get('has_events', False),
-            "calendar_events": calendar_events.get('events', [])
-        }
-        
-        email_summaries_for_prompt.append(email_data)
+    # Analyze every email (priority and calendar) with bounded concurrency
+    email_summaries_for_prompt = analyze_emails_for_batch(emails)
     
     # Sort emails by priority score (highest first)
     email_summaries_for_prompt.sort(key=lambda x: x['priority_score'], reverse=True)
@@ -361,107 +605,25 @@ def generate_batch_summary_report_with_openrouter(emails: list) -> dict:
         # Get current configuration values
         ai_output_language = get_ai_config('AI_OUTPUT_LANGUAGE', 'Chinese')
         openrouter_model = get_ai_config('OPENROUTER_MODEL', 'openai/gpt-4o-mini')
-        ai_max_tokens = get_ai_config('AI_MAX_TOKENS', 250)
-        ai_temperature = get_ai_config('AI_TEMPERATURE', 0.5)
 
         # Read the prompt template from the file
-        prompt_file_path = os.path.join(os.path.dirname(__file__), 'batch_summary_prompt.md')
-        if os.path.exists(prompt_file_path):
-            try:
-                with open(prompt_file_path, 'r', encoding='utf-8') as f:
-                    prompt_template = f.read()
-                # Replace the placeholder with the actual language
-                system_prompt = prompt_template.format(AI_OUTPUT_LANGUAGE=ai_output_language)
-            except FileNotFoundError:
-                return {"error": f"[ERROR] Prompt file not found at {prompt_file_path}"}
-            except UnicodeDecodeError as e:
-                return {"error": f"[ERROR] Error decoding prompt file: {e}"}
-            except KeyError as e:
-                return {"error": f"[ERROR] Missing placeholder in prompt template: {e}"}
-            except Exception as e:
-                return {"error": f"[ERROR] Error processing prompt template: {e}"}
-        else:
-            # Fallback to a simple prompt if the file is not found
-            system_prompt = f"You are an expert email analyst. Create a structured, categorized report in valid JSON format in {ai_output_language}."
-            
-        user_prompt = f"Here is the list of email data to analyze and report on:\n\n{json.dumps(email_summaries_for_prompt, indent=2, ensure_ascii=False)}"
+        system_prompt, prompt_error = _load_batch_report_prompt(ai_output_language)
+        if prompt_error:
+            return prompt_error
 
+        # Large batches are reported chunk by chunk and merged
+        if _use_hierarchical_report(email_summaries_for_prompt):
+            return generate_hierarchical_batch_report(openrouter_client, openrouter_model, system_prompt, email_summaries_for_prompt)
+            
+        request = _batch_report_request(email_summaries_for_prompt, system_prompt, openrouter_model)
         # OpenRouter has context length limits, so we need to be more conservative
         # Most OpenRouter models have a max context of ~1M tokens, so we limit output to 50k
-        max_output_tokens = min(50000, ai_max_tokens)
-        
-        response = openrouter_client.chat.completions.create(
-            model=openrouter_model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=ai_temperature,
-            max_tokens=max_output_tokens, # Conservative limit for OpenRouter
-        )
+        request['max_tokens'] = min(50000, request['max_tokens'])
+        response = _create_completion(openrouter_client, **request)
         
         if response.choices:
             raw_response_content = response.choices[0].message.content.strip()
-            # Attempt to parse the AI's response as JSON
-            # The AI is instructed to return valid JSON, but we should be robust to minor formatting issues.
-            try:
-                # Sometimes AI adds ```json ... ``` wrapper or other text
-                # Try to extract JSON object from the response
-                import re
-                
-                # Remove any markdown code blocks
-                cleaned_response = re.sub(r'```json\s*', '', raw_response_content)
-                cleaned_response = re.sub(r'```\s*$', '', cleaned_response)
-                
-                # Look for a JSON object in the response
-                # This regex looks for a top-level JSON object
-                json_match = re.search(r'\{.*\}', cleaned_response, re.DOTALL)
-                if json_match:
-                    json_content = json_match.group(0)
-                    
-                    # Try to fix common JSON issues
-                    # 1. Fix trailing commas in arrays and objects
-                    json_content = re.sub(r',\s*([}\]])', r'\1', json_content)
-                    
-                    # 2. Ensure proper comma separation between array/object elements
-                    # This is a more complex fix - we'll try to add missing commas
-                    # Split by lines and check for missing commas
-                    lines = json_content.split('\n')
-                    fixed_lines = []
-                    
-                    for i, line in enumerate(lines):
-                        stripped_line = line.strip()
-                        fixed_lines.append(line)
-                        
-                        # Check if this line ends with } or ] and the next line starts with {
-                        if i < len(lines) - 1:
-                            next_line = lines[i + 1].strip()
-                            if (stripped_line.endswith('}') or stripped_line.endswith(']')) and \
-                               (next_line.startswith('{') or next_line.startswith('[')):
-                                # Add comma if missing
-                                if not stripped_line.endswith(',') and not stripped_line.endswith(',}') and not stripped_line.endswith(',]'):
-                                    fixed_lines[-1] = line.rstrip() + ','
-                    
-                    json_content = '\n'.join(fixed_lines)
-                    
-                    # Try to parse the fixed JSON
-                    report_data = json.loads(json_content)
-                    return report_data
-                else:
-                    return {"error": f"[ERROR] No valid JSON object found in AI response. Raw response: {raw_response_content[:500]}..."}
-                    
-            except json.JSONDecodeError as je:
-                # If JSON parsing still fails, try a more aggressive approach
-                try:
-                    # Try to extract just the categories array and reconstruct the JSON
-                    categories_match = re.search(r'"categories"\s*:\s*\[(.*?)\]', raw_response_content, re.DOTALL)
-                    if categories_match:
-                        # Return a minimal valid structure
-                        return {"categories": []}
-                    else:
-                        return {"error": f"[ERROR] Failed to parse AI response as JSON: {je}. Raw response: {raw_response_content[:1000]}..."}
-                except Exception:
-                    return {"error": f"[ERROR] Failed to parse AI response as JSON: {je}. Raw response: {raw_response_content[:1000]}..."}
+            return _parse_batch_report_json(raw_response_content)
         else:
             return {"error": "[ERROR] No report received from AI."}
 
@@ -483,6 +645,10 @@ def summarize_email(subject: str, body: str) -> str:
     """
     Dispatches the summarization request to the configured AI provider.
     """
+    return _summarize_clean_email(subject, prepare_body_for_ai(body))
+
+def _summarize_clean_email(subject: str, body: str) -> str:
+    # body has already been through prepare_body_for_ai
     ai_provider = get_ai_config('AI_PROVIDER', 'openai')
     if ai_provider == 'openai':
         return summarize_email_with_openai(subject, body)
@@ -493,41 +659,62 @@ def summarize_email(subject: str, body: str) -> str:
     else:
         return f"[ERROR] Unsupported AI_PROVIDER: {ai_provider}"
 
-def analyze_email_priority_with_openai(subject: str, body: str, from_addr: str) -> dict:
+def summarize_email_stream(subject: str, body: str, cancel_event=None):
     """
-    Analyzes email priority and urgency using OpenAI API.
-    
+    Streams a summary from the configured AI provider as it is generated.
+
     Args:
         subject: The subject of the email.
         body: The body content of the email.
-        from_addr: The sender's email address.
-    
-    Returns:
-        A dictionary containing priority score (1-10), urgency level, and reasoning.
+        cancel_event: Optional threading.Event; once set, the provider stream is closed
+            so an abandoned request stops generating tokens.
+
+    Yields:
+        Pieces of the summary text. On failure a single string starting with
+        "[ERROR]" is yielded instead.
     """
-    openai_client = get_openai_client()
-    if not openai_client:
-        return {"error": "[ERROR] OpenAI client not initialized. Please check your OPENAI_API_KEY."}
+    ai_provider, client, model, error = _get_provider_client()
+    if error:
+        yield error
+        return
+
+    try:
+        stream = _create_fitted_completion(
+            client, model, partial(_summary_request, subject, prepare_body_for_ai(body)), stream=True
+        )
+    except openai.APIError as e:
+        yield f"[ERROR] {ai_provider} API error: {e}"
+        return
+    except Exception as e:
+        yield f"[ERROR] An unexpected error occurred: {e}"
+        return
+
+    try:
+        for chunk in stream:
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    except openai.APIError as e:
+        yield f"[ERROR] {ai_provider} API error: {e}"
+    finally:
+        # Closing the HTTP response tells the provider to stop generating
+        stream.close()
 
-    # Get current configuration values
+def _priority_request(subject: str, body: str, from_addr: str, model: str) -> dict:
+    """Builds the chat completion arguments for a priority analysis."""
     ai_output_language = get_ai_config('AI_OUTPUT_LANGUAGE', 'Chinese')
-    openai_model = get_ai_config('OPENAI_MODEL', 'gpt-4o-mini')
     ai_temperature = get_ai_config('AI_TEMPERATURE', 0.3)  # Lower temperature for more consistent scoring
 
-    # Truncate body to avoid exceeding token limits
-    max_body_length = 6000
-    truncated_body = body[:max_body_length]
-
-    try:
-        system_prompt = f"""你是一个智能邮件助手，专门分析邮件的重要性和紧急程度。请用{ai_output_language}分析邮件并提供优先级评估。
+    system_prompt = f"""你是一个智能邮件助手，专门分析邮件的重要性和紧急程度。请用{ai_output_language}分析邮件并提供优先级评估。
 
 请以JSON格式返回分析结果：
 {{
-    "priority_score": <1-10的数字，10表示最紧急>,
-    "urgency_level": "<低/中/高/紧急>",
-    "reasoning": "<简要说明优先级评估的原因>",
-    "action_required": <true/false，是否需要立即行动>,
-    "estimated_response_time": "<立即/1小时内/1天内/1周内/不急>"
+"priority_score": <1-10的数字，10表示最紧急>,
+"urgency_level": "<低/中/高/紧急>",
+"reasoning": "<简要说明优先级评估的原因>",
+"action_required": <true/false，是否需要立即行动>,
+"estimated_response_time": "<立即/1小时内/1天内/1周内/不急>"
 }}
 
 考虑以下因素：
@@ -536,39 +723,125 @@ def analyze_email_priority_with_openai(subject: str, body: str, from_addr: str)
 - 内容类型（会议邀请、截止日期、问题、通知）
 - 时间敏感性
 - 是否需要行动"""
-        
-        user_prompt = f"发件人: {from_addr}\n主题: {subject}\n\n正文:\n{truncated_body}"
 
-        response = openai_client.chat.completions.create(
-            model=openai_model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=ai_temperature,
-            max_tokens=300
-        )
+    user_prompt_prefix = f"发件人: {from_addr}\n主题: {subject}\n\n正文:\n"
+    # Truncate body to the model's input token budget
+    truncated_body = fit_body(body, system_prompt, user_prompt_prefix, model, 300)
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt_prefix + truncated_body}
+        ],
+        "temperature": ai_temperature,
+        "max_tokens": 300,
+    }
 
-        result_text = response.choices[0].message.content.strip()
-        
-        # Try to parse JSON response
-        try:
-            import json
-            result = json.loads(result_text)
-            return result
-        except json.JSONDecodeError:
-            # Fallback if JSON parsing fails
-            return {
-                "priority_score": 5,
-                "urgency_level": "中",
-                "reasoning": result_text,
-                "action_required": False,
-                "estimated_response_time": "1天内"
-            }
+def _priority_from_response(response) -> dict:
+    result_text = response.choices[0].message.content.strip()
+
+    # Try to parse JSON response
+    try:
+        return json.loads(result_text)
+    except json.JSONDecodeError:
+        # Fallback if JSON parsing fails
+        return {
+            "priority_score": 5,
+            "urgency_level": "中",
+            "reasoning": result_text,
+            "action_required": False,
+            "estimated_response_time": "1天内"
+        }
+
+def analyze_email_priority_with_openai(subject: str, body: str, from_addr: str) -> dict:
+    """
+    Analyzes email priority and urgency using OpenAI API.
+    
+    Args:
+        subject: The subject of the email.
+        body: The body content of the email.
+        from_addr: The sender's email address.
+    
+    Returns:
+        A dictionary containing priority score (1-10), urgency level, and reasoning.
+    """
+    openai_client = get_openai_client()
+    if not openai_client:
+        return {"error": "[ERROR] OpenAI client not initialized. Please check your OPENAI_API_KEY."}
+
+    try:
+        response = _create_fitted_completion(
+            openai_client, get_ai_config('OPENAI_MODEL', 'gpt-4o-mini'), partial(_priority_request, subject, body, from_addr)
+        )
+        return _priority_from_response(response)
 
     except Exception as e:
         return {"error": f"[ERROR] Failed to analyze email priority: {str(e)}"}
 
+def _calendar_request(subject: str, body: str, from_addr: str, model: str) -> dict:
+    """Builds the chat completion arguments for calendar event extraction."""
+    ai_output_language = get_ai_config('AI_OUTPUT_LANGUAGE', 'Chinese')
+    ai_temperature = get_ai_config('AI_TEMPERATURE', 0.2)  # Lower temperature for more accurate extraction
+
+    system_prompt = f"""你是一个智能日程助手，专门从邮件中提取会议和活动信息。请用{ai_output_language}分析邮件内容并提取任何日程、会议或约会信息。
+
+请以JSON格式返回结果：
+{{
+"has_events": <true/false>,
+"events": [
+    {{
+        "title": "<活动标题>",
+        "date": "<YYYY-MM-DD格式或相对日期如'明天'>",
+        "time": "<HH:MM或时间范围>",
+        "location": "<地点或'线上'或'待定'>",
+        "attendees": ["<如果提到的话，参会者邮箱地址>"],
+        "description": "<简要描述>",
+        "meeting_link": "<如果有的话，Zoom/Teams/Meet链接>",
+        "event_type": "<会议/约会/截止日期/提醒>"
+    }}
+],
+"action_items": ["<提到的任何行动项目>"],
+"rsvp_required": <true/false>
+}}
+
+寻找以下内容：
+- 会议邀请
+- 约会安排
+- 活动通知
+- 截止日期提醒
+- 日程链接（Zoom、Teams、Google Meet）
+- 日期和时间信息
+- 地点详情"""
+
+    user_prompt_prefix = f"发件人: {from_addr}\n主题: {subject}\n\n正文:\n"
+    # Truncate body to the model's input token budget
+    truncated_body = fit_body(body, system_prompt, user_prompt_prefix, model, 500)
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt_prefix + truncated_body}
+        ],
+        "temperature": ai_temperature,
+        "max_tokens": 500,
+    }
+
+def _calendar_from_response(response) -> dict:
+    result_text = response.choices[0].message.content.strip()
+
+    # Try to parse JSON response
+    try:
+        return json.loads(result_text)
+    except json.JSONDecodeError:
+        # Fallback if JSON parsing fails
+        return {
+            "has_events": False,
+            "events": [],
+            "action_items": [],
+            "rsvp_required": False,
+            "raw_response": result_text
+        }
+
 def extract_calendar_events_with_openai(subject: str, body: str, from_addr: str) -> dict:
     """
     Extracts calendar events and meeting information from email using OpenAI API.
@@ -585,20 +858,37 @@ def extract_calendar_events_with_openai(subject: str, body: str, from_addr: str)
     if not openai_client:
         return {"error": "[ERROR] OpenAI client not initialized. Please check your OPENAI_API_KEY."}
 
-    # Get current configuration values
-    ai_output_language = get_ai_config('AI_OUTPUT_LANGUAGE', 'Chinese')
-    openai_model = get_ai_config('OPENAI_MODEL', 'gpt-4o-mini')
-    ai_temperature = get_ai_config('AI_TEMPERATURE', 0.2)  # Lower temperature for more accurate extraction
+    try:
+        response = _create_fitted_completion(
+            openai_client, get_ai_config('OPENAI_MODEL', 'gpt-4o-mini'), partial(_calendar_request, subject, body, from_addr)
+        )
+        return _calendar_from_response(response)
 
-    # Truncate body to avoid exceeding token limits
-    max_body_length = 8000
-    truncated_body = body[:max_body_length]
+    except Exception as e:
+        return {"error": f"[ERROR] Failed to extract calendar events: {str(e)}"}
 
-    try:
-        system_prompt = f"""你是一个智能日程助手，专门从邮件中提取会议和活动信息。请用{ai_output_language}分析邮件内容并提取任何日程、会议或约会信息。
+def _comprehensive_request(subject: str, body: str, from_addr: str, model: str) -> dict:
+    """Builds the chat completion arguments for the single-call comprehensive analysis."""
+    ai_output_language = get_ai_config('AI_OUTPUT_LANGUAGE', 'Chinese')
+    ai_max_tokens = get_ai_config('AI_MAX_TOKENS', 250)
+    ai_temperature = get_ai_config('AI_TEMPERATURE', 0.3)
 
-请以JSON格式返回结果：
+    system_prompt = f"""你是一个智能邮件助手。请用{ai_output_language}一次性完成以下三项分析：
+1. 简明扼要地总结邮件，提取关键信息和需要采取的行动；
+2. 评估邮件的重要性和紧急程度；
+3. 提取邮件中的会议、约会、活动和截止日期信息。
+
+只返回一个JSON对象，格式如下：
 {{
+"summary": "<邮件摘要>",
+"priority_analysis": {{
+    "priority_score": <1-10的数字，10表示最紧急>,
+    "urgency_level": "<低/中/高/紧急>",
+    "reasoning": "<简要说明优先级评估的原因>",
+    "action_required": <true/false，是否需要立即行动>,
+    "estimated_response_time": "<立即/1小时内/1天内/1周内/不急>"
+}},
+"calendar_events": {{
     "has_events": <true/false>,
     "events": [
         {{
@@ -608,68 +898,105 @@ def extract_calendar_events_with_openai(subject: str, body: str, from_addr: str)
             "location": "<地点或'线上'或'待定'>",
             "attendees": ["<如果提到的话，参会者邮箱地址>"],
             "description": "<简要描述>",
-            "meeting_link": "<如果有的话，Zoom/Teams/Meet链接>",
+            "meeting_link": "<Zoom/Teams/Meet链接，没有则为null>",
             "event_type": "<会议/约会/截止日期/提醒>"
         }}
     ],
     "action_items": ["<提到的任何行动项目>"],
     "rsvp_required": <true/false>
 }}
+}}
 
-寻找以下内容：
-- 会议邀请
-- 约会安排
-- 活动通知
-- 截止日期提醒
-- 日程链接（Zoom、Teams、Google Meet）
-- 日期和时间信息
-- 地点详情"""
-        
-        user_prompt = f"发件人: {from_addr}\n主题: {subject}\n\n正文:\n{truncated_body}"
+评估优先级时考虑发件人重要性、紧急关键词、内容类型、时间敏感性以及是否需要行动。没有日程信息时 events 为空数组。"""
 
-        response = openai_client.chat.completions.create(
-            model=openai_model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=ai_temperature,
-            max_tokens=500
-        )
+    user_prompt_prefix = f"发件人: {from_addr}\n主题: {subject}\n\n正文:\n"
+    # Room for the summary plus the priority (300) and calendar (500) budgets
+    max_output_tokens = ai_max_tokens + 800
+    truncated_body = fit_body(body, system_prompt, user_prompt_prefix, model, max_output_tokens)
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt_prefix + truncated_body}
+        ],
+        "temperature": ai_temperature,
+        "max_tokens": max_output_tokens,
+        "response_format": {"type": "json_object"},
+    }
 
-        result_text = response.choices[0].message.content.strip()
-        
-        # Try to parse JSON response
-        try:
-            import json
-            result = json.loads(result_text)
-            return result
-        except json.JSONDecodeError:
-            # Fallback if JSON parsing fails
-            return {
-                "has_events": False,
-                "events": [],
-                "action_items": [],
-                "rsvp_required": False,
-                "raw_response": result_text
-            }
+def _comprehensive_from_response(response) -> dict:
+    if not response.choices:
+        return {"error": "[ERROR] No analysis received from AI."}
+    try:
+        result = ComprehensiveAnalysis.model_validate_json(response.choices[0].message.content.strip())
+    except ValidationError as e:
+        return {"error": f"[ERROR] AI response did not match the analysis schema: {e}"}
+    return result.model_dump()
+
+def analyze_email_comprehensive_single_call(subject: str, body: str, from_addr: str) -> dict:
+    """
+    Produces the summary, priority analysis and calendar events in one structured-output request.
+
+    The response is validated against ComprehensiveAnalysis, so callers get exactly the
+    shape the three separate requests would have produced.
 
+    Args:
+        subject: The subject of the email.
+        body: The body content of the email.
+        from_addr: The sender's email address.
+
+    Returns:
+        A dictionary with 'summary', 'priority_analysis' and 'calendar_events', or a
+        dictionary with an 'error' key if the request or validation failed.
+    """
+    ai_provider, client, model, error = _get_provider_client()
+    if error:
+        return {"error": error}
+
+    try:
+        response = _create_fitted_completion(client, model, partial(_comprehensive_request, subject, body, from_addr))
+        return _comprehensive_from_response(response)
+
+    except openai.APIError as e:
+        return {"error": f"[ERROR] {ai_provider} API error: {e}"}
     except Exception as e:
-        return {"error": f"[ERROR] Failed to extract calendar events: {str(e)}"}
+        return {"error": f"[ERROR] An unexpected error occurred: {e}"}
 
-def analyze_email_comprehensive(subject: str, body: str, from_addr: str) -> dict:
+def _summary_only_analysis(summary: str) -> dict:
+    """The analysis returned for providers without priority and calendar support."""
+    return {
+        "summary": summary,
+        "priority_analysis": {"priority_score": 5, "urgency_level": "中", "reasoning": "此AI提供商暂不支持优先级分析"},
+        "calendar_events": {"has_events": False, "events": []}
+    }
+
+def analyze_email_comprehensive(subject: str, body: str, from_addr: str, body_is_clean: bool = False) -> dict:
     """
     Performs comprehensive email analysis including summary, priority, and calendar extraction.
+
+    With COMPREHENSIVE_ANALYSIS_MODE=single (the default) everything is requested in one
+    structured call; if that call fails or its output does not validate, the separate
+    summary, priority and calendar requests are used instead.
     
     Args:
         subject: The subject of the email.
         body: The body content of the email.
         from_addr: The sender's email address.
+        body_is_clean: The body was already prepared with prepare_body_for_ai.
     
     Returns:
         A dictionary containing summary, priority analysis, and calendar events.
     """
+    # HTML, quoted history and signatures only cost tokens
+    if not body_is_clean:
+        body = prepare_body_for_ai(body)
     ai_provider = get_ai_config('AI_PROVIDER', 'openai')
+
+    if get_ai_config('COMPREHENSIVE_ANALYSIS_MODE', 'single') == 'single' and ai_provider in ('openai', 'openrouter'):
+        analysis = analyze_email_comprehensive_single_call(subject, body, from_addr)
+        if "error" not in analysis:
+            return analysis
+        print(f"[INFO] Single-call analysis failed, falling back to separate requests: {analysis['error']}")
     
     if ai_provider == 'openai':
         # Get summary
@@ -688,11 +1015,7 @@ def analyze_email_comprehensive(subject: str, body: str, from_addr: str) -> dict
         }
     else:
         # For other providers, return basic summary for now
-        return {
-            "summary": summarize_email(subject, body),
-            "priority_analysis": {"priority_score": 5, "urgency_level": "中", "reasoning": "此AI提供商暂不支持优先级分析"},
-            "calendar_events": {"has_events": False, "events": []}
-        }
+        return _summary_only_analysis(_summarize_clean_email(subject, body))
 
 def generate_batch_summary_report(emails: list) -> dict:
     """
@@ -707,4 +1030,276 @@ def generate_batch_summary_report(emails: list) -> dict:
     #     # Implementation for Anthropic would go here
     #     pass
     else:
-        return {"error": f"[ERROR] Unsupported AI_PROVIDER for batch summary: {ai_provider}"}
\ No newline at end of file
+        return {"error": f"[ERROR] Unsupported AI_PROVIDER for batch summary: {ai_provider}"}
+
+def generate_batch_report_from_entries(email_entries: list) -> dict:
+    """
+    Writes the batch report for emails that were already analyzed with analyze_email_for_batch.
+
+    Used by the background batch jobs, which analyze and persist emails one by one.
+
+    Args:
+        email_entries: The prompt entries produced by analyze_email_for_batch.
+
+    Returns:
+        A dictionary containing the structured report, or an error message.
+    """
+    ai_provider, client, model, error = _get_provider_client()
+    if error:
+        return {"error": error}
+    if not email_entries:
+        return {"error": "[INFO] No emails to summarize."}
+
+    email_summaries_for_prompt = sorted(email_entries, key=lambda x: x['priority_score'], reverse=True)
+    system_prompt, prompt_error = _load_batch_report_prompt(get_ai_config('AI_OUTPUT_LANGUAGE', 'Chinese'))
+    if prompt_error:
+        return prompt_error
+
+    try:
+        if _use_hierarchical_report(email_summaries_for_prompt):
+            return generate_hierarchical_batch_report(client, model, system_prompt, email_summaries_for_prompt)
+
+        response = _create_completion(client, **_batch_report_request(email_summaries_for_prompt, system_prompt, model))
+
+        if response.choices:
+            return _parse_batch_report_json(response.choices[0].message.content.strip())
+        return {"error": "[ERROR] No report received from AI."}
+
+    except openai.APIError as e:
+        return {"error": f"[ERROR] {ai_provider} API error: {e}"}
+    except Exception as e:
+        return {"error": f"[ERROR] An unexpected error occurred in batch processing: {e}"}
+
+def generate_batch_summary_report_stream(emails: list):
+    """
+    Generates a batch summary report, yielding each category as soon as the AI finishes it.
+
+    Args:
+        emails: A list of dictionaries, each containing 'id', 'from', 'subject', and 'body' keys.
+
+    Yields:
+        (event, payload) tuples: ('category', category_dict) for every completed category,
+        then ('report', report_dict) with the whole report, or ('error', message).
+    """
+    ai_provider, client, model, error = _get_provider_client()
+    if error:
+        yield 'error', error
+        return
+    if not emails:
+        yield 'error', "[INFO] No emails to summarize."
+        return
+
+    email_summaries_for_prompt = analyze_emails_for_batch(emails)
+    email_summaries_for_prompt.sort(key=lambda x: x['priority_score'], reverse=True)
+
+    system_prompt, prompt_error = _load_batch_report_prompt(get_ai_config('AI_OUTPUT_LANGUAGE', 'Chinese'))
+    if prompt_error:
+        yield 'error', prompt_error['error']
+        return
+
+    if _use_hierarchical_report(email_summaries_for_prompt):
+        # Partial reports are merged at the end, so categories only exist once it is done
+        report = generate_hierarchical_batch_report(client, model, system_prompt, email_summaries_for_prompt)
+        if "error" in report:
+            yield 'error', report['error']
+            return
+        for category in report.get('categories', []):
+            yield 'category', category
+        yield 'report', report
+        return
+
+    try:
+        stream = _create_completion(
+            client, stream=True, **_batch_report_request(email_summaries_for_prompt, system_prompt, model)
+        )
+    except openai.APIError as e:
+        yield 'error', f"[ERROR] {ai_provider} API error: {e}"
+        return
+    except Exception as e:
+        yield 'error', f"[ERROR] An unexpected error occurred in batch processing: {e}"
+        return
+
+    parser = BatchReportStreamParser()
+    try:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                for category in parser.feed(chunk.choices[0].delta.content):
+                    yield 'category', category
+    except openai.APIError as e:
+        yield 'error', f"[ERROR] {ai_provider} API error: {e}"
+        return
+    finally:
+        # Also runs when the consumer stops early, so the provider stops generating
+        stream.close()
+
+    report = parser.result()
+    if report is None:
+        yield 'error', "[ERROR] No valid JSON object found in AI response."
+        return
+    yield 'report', report
+
+# --- Async counterparts for the API server ---
+# These use the AsyncOpenAI clients so a request waiting on the provider does not hold
+# a worker thread. The sync functions above remain for main.py and the streaming routes.
+
+async def summarize_email_async(subject: str, body: str, body_is_clean: bool = False) -> str:
+    """
+    Async version of summarize_email.
+
+    Args:
+        subject: The subject of the email.
+        body: The body content of the email.
+        body_is_clean: The body was already prepared with prepare_body_for_ai.
+
+    Returns:
+        A string containing the summary of the email, or an error message.
+    """
+    if not body_is_clean:
+        body = prepare_body_for_ai(body)
+    ai_provider, client, model, error = _get_provider_client(asynchronous=True)
+    if error:
+        return error
+
+    try:
+        response = await _create_fitted_completion_async(client, model, partial(_summary_request, subject, body))
+        return _summary_from_response(response)
+
+    except openai.APIError as e:
+        return f"[ERROR] {ai_provider} API error: {e}"
+    except Exception as e:
+        return f"[ERROR] An unexpected error occurred: {e}"
+
+async def _request_json_async(client, model: str, build_request, from_response, error_message: str) -> dict:
+    try:
+        response = await _create_fitted_completion_async(client, model, build_request)
+        return from_response(response)
+    except Exception as e:
+        return {"error": f"{error_message}: {str(e)}"}
+
+async def analyze_email_comprehensive_async(subject: str, body: str, from_addr: str, body_is_clean: bool = False) -> dict:
+    """
+    Async version of analyze_email_comprehensive.
+
+    When the single structured call is unavailable or fails, the summary, priority and
+    calendar requests are sent concurrently instead of one after another.
+
+    Args:
+        subject: The subject of the email.
+        body: The body content of the email.
+        from_addr: The sender's email address.
+        body_is_clean: The body was already prepared with prepare_body_for_ai.
+
+    Returns:
+        A dictionary containing summary, priority analysis, and calendar events.
+    """
+    if not body_is_clean:
+        body = prepare_body_for_ai(body)
+    ai_provider, client, model, error = _get_provider_client(asynchronous=True)
+    if error:
+        return _summary_only_analysis(error)
+
+    if get_ai_config('COMPREHENSIVE_ANALYSIS_MODE', 'single') == 'single':
+        analysis = await _request_json_async(
+            client, model, partial(_comprehensive_request, subject, body, from_addr),
+            _comprehensive_from_response, f"[ERROR] {ai_provider} API error"
+        )
+        if "error" not in analysis:
+            return analysis
+        print(f"[INFO] Single-call analysis failed, falling back to separate requests: {analysis['error']}")
+
+    if ai_provider != 'openai':
+        # Same as analyze_email_comprehensive: other providers only get a summary
+        return _summary_only_analysis(await summarize_email_async(subject, body, body_is_clean=True))
+
+    summary, priority_analysis, calendar_events = await asyncio.gather(
+        summarize_email_async(subject, body, body_is_clean=True),
+        _request_json_async(
+            client, model, partial(_priority_request, subject, body, from_addr),
+            _priority_from_response, "[ERROR] Failed to analyze email priority"
+        ),
+        _request_json_async(
+            client, model, partial(_calendar_request, subject, body, from_addr),
+            _calendar_from_response, "[ERROR] Failed to extract calendar events"
+        ),
+    )
+    return {
+        "summary": summary,
+        "priority_analysis": priority_analysis,
+        "calendar_events": calendar_events
+    }
+
+async def analyze_emails_for_batch_async(emails: list) -> list:
+    """
+    Async version of analyze_emails_for_batch.
+
+    At most BATCH_ANALYSIS_WORKERS emails are analyzed at once.
+
+    Args:
+        emails: A list of dictionaries, each containing 'id', 'from', 'subject', and 'body' keys.
+
+    Returns:
+        The prompt entries, in the same order as the input emails.
+    """
+    semaphore = asyncio.Semaphore(max(1, get_ai_config('BATCH_ANALYSIS_WORKERS', 8)))
+
+    async def analyze(email):
+        body = prepare_email_for_ai(email)
+        async with semaphore:
+            try:
+                comprehensive_analysis = await analyze_email_comprehensive_async(
+                    subject=email['subject'],
+                    body=body,
+                    from_addr=email['from'],
+                    body_is_clean=True
+                )
+            except Exception as e:
+                comprehensive_analysis = {"error": f"[ERROR] Failed to analyze email {email.get('id')}: {e}"}
+        return _batch_entry(email, body, comprehensive_analysis)
+
+    return list(await asyncio.gather(*(analyze(email) for email in emails)))
+
+async def generate_batch_summary_report_async(emails: list) -> dict:
+    """
+    Async version of generate_batch_summary_report.
+
+    Args:
+        emails: A list of dictionaries, each containing 'id', 'from', 'subject', and 'body' keys.
+
+    Returns:
+        A dictionary containing the structured report, or an error message.
+    """
+    ai_provider, client, model, error = _get_provider_client(asynchronous=True)
+    if error:
+        return {"error": error}
+    if not emails:
+        return {"error": "[INFO] No emails to summarize."}
+
+    email_summaries_for_prompt = await analyze_emails_for_batch_async(emails)
+    email_summaries_for_prompt.sort(key=lambda x: x['priority_score'], reverse=True)
+
+    system_prompt, prompt_error = _load_batch_report_prompt(get_ai_config('AI_OUTPUT_LANGUAGE', 'Chinese'))
+    if prompt_error:
+        return prompt_error
+
+    if _use_hierarchical_report(email_summaries_for_prompt):
+        # The map-reduce path is rare and request-heavy; run it on the sync clients
+        _, sync_client, _, error = _get_provider_client()
+        if error:
+            return {"error": error}
+        return await asyncio.get_running_loop().run_in_executor(
+            None, generate_hierarchical_batch_report, sync_client, model, system_prompt, email_summaries_for_prompt
+        )
+
+    try:
+        response = await _create_completion_async(
+            client, **_batch_report_request(email_summaries_for_prompt, system_prompt, model)
+        )
+
+        if response.choices:
+            return _parse_batch_report_json(response.choices[0].message.content.strip())
+        return {"error": "[ERROR] No report received from AI."}
+
+    except openai.APIError as e:
+        return {"error": f"[ERROR] {ai_provider} API error: {e}"}
+    except Exception as e:
+        return {"error": f"[ERROR] An unexpected error occurred in batch processing: {e}"}
@@ -0,0 +1,252 @@
+"""
+Shared HTTP transport for AI provider clients.
+"""
+import asyncio
+import logging
+import threading
+from urllib.parse import urlsplit
+
+try:
+    import httpx
+except ImportError:  # Newer openai releases are built on httpx2
+    import httpx2 as httpx
+
+try:
+    import h2  # noqa: F401  (HTTP/2 support for httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class _PoolUsage:
+    """
+    Counts the requests running on one pooled client, so that a client replaced by a
+    configuration reload is closed as soon as its last request finishes.
+    """
+
+    def __init__(self):
+        self.client = None
+        self.in_flight = 0
+        self.retired = False
+        self.loop = None
+        self._lock = threading.Lock()
+
+    def started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def finished(self):
+        """Count a finished request. Returns True if the client should now be closed."""
+        with self._lock:
+            self.in_flight -= 1
+            return self.retired and self.in_flight == 0
+
+    def retire(self):
+        """Mark the client replaced. Returns True if it is idle and should be closed now."""
+        with self._lock:
+            self.retired = True
+            return self.in_flight == 0
+
+
+class _TrackedStream(httpx.SyncByteStream):
+    def __init__(self, stream, usage):
+        self._stream = stream
+        self._usage = usage
+        self._closed = False
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            if not self._closed:
+                self._closed = True
+                if self._usage.finished():
+                    self._usage.client.close()
+
+
+class _AsyncTrackedStream(httpx.AsyncByteStream):
+    def __init__(self, stream, usage):
+        self._stream = stream
+        self._usage = usage
+        self._closed = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._closed:
+                self._closed = True
+                if self._usage.finished():
+                    await self._usage.client.aclose()
+
+
+class _TrackedTransport(httpx.HTTPTransport):
+    """An HTTPTransport that reports running requests to a _PoolUsage."""
+
+    def __init__(self, usage, **kwargs):
+        super().__init__(**kwargs)
+        self._usage = usage
+
+    def handle_request(self, request):
+        self._usage.started()
+        try:
+            response = super().handle_request(request)
+        except BaseException:
+            if self._usage.finished():
+                self._usage.client.close()
+            raise
+        # The request counts as running until its body has been read or closed
+        response.stream = _TrackedStream(response.stream, self._usage)
+        return response
+
+
+class _AsyncTrackedTransport(httpx.AsyncHTTPTransport):
+    """Async version of _TrackedTransport."""
+
+    def __init__(self, usage, **kwargs):
+        super().__init__(**kwargs)
+        self._usage = usage
+
+    async def handle_async_request(self, request):
+        self._usage.loop = asyncio.get_running_loop()
+        self._usage.started()
+        try:
+            response = await super().handle_async_request(request)
+        except BaseException:
+            if self._usage.finished():
+                await self._usage.client.aclose()
+            raise
+        response.stream = _AsyncTrackedStream(response.stream, self._usage)
+        return response
+
+
+class AITransport:
+    """
+    Hands out one pooled HTTP client per provider host.
+
+    Every SDK client talking to the same scheme/host/port (OpenAI, OpenRouter, or any
+    other httpx-based SDK such as Anthropic's) shares the same connection pool, so
+    concurrent requests reuse warm TLS connections instead of opening new ones. Clients
+    survive configuration reloads and are only replaced when the transport settings
+    themselves change; a replaced client is closed once its running requests finish.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._async_clients = {}
+        self._retired = []
+        self._lock = threading.Lock()
+        self._http2_warned = False
+
+    def _settings(self, config):
+        http2 = bool(config.get('AI_HTTP2', False))
+        if http2 and not HTTP2_AVAILABLE:
+            if not self._http2_warned:
+                self._http2_warned = True
+                logging.warning("AI_HTTP2 is enabled but the 'h2' package is not installed; using HTTP/1.1.")
+            http2 = False
+        return (
+            config.get('AI_HTTP_MAX_CONNECTIONS', 100),
+            config.get('AI_HTTP_MAX_KEEPALIVE', 20),
+            config.get('AI_HTTP_KEEPALIVE_EXPIRY', 30.0),
+            config.get('AI_CONNECT_TIMEOUT', 5.0),
+            config.get('AI_READ_TIMEOUT', 120.0),
+            http2,
+        )
+
+    @staticmethod
+    def _origin(base_url):
+        parts = urlsplit(base_url or 'https://api.openai.com/v1')
+        return f"{parts.scheme}://{parts.netloc}".lower()
+
+    @staticmethod
+    def timeout(config):
+        """The httpx.Timeout built from AI_CONNECT_TIMEOUT and AI_READ_TIMEOUT."""
+        return httpx.Timeout(config.get('AI_READ_TIMEOUT', 120.0), connect=config.get('AI_CONNECT_TIMEOUT', 5.0))
+
+    def _get_client(self, clients, client_class, transport_class, base_url, config):
+        origin = self._origin(base_url)
+        settings = self._settings(config)
+        with self._lock:
+            entry = clients.get(origin)
+            if entry and entry[0] == settings:
+                return entry[1]
+            if entry:
+                self._retire(entry[1], entry[2])
+
+            max_connections, max_keepalive, keepalive_expiry, connect_timeout, read_timeout, http2 = settings
+            usage = _PoolUsage()
+            client = client_class(
+                transport=transport_class(
+                    usage,
+                    limits=httpx.Limits(
+                        max_connections=max_connections,
+                        max_keepalive_connections=max_keepalive,
+                        keepalive_expiry=keepalive_expiry
+                    ),
+                    http2=http2,
+                ),
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                follow_redirects=True,
+            )
+            usage.client = client
+            clients[origin] = (settings, client, usage)
+            print(f"[INFO] Created shared {client_class.__name__} pool for {origin} (max {max_connections} connections, HTTP/2: {http2})")
+            return client
+
+    def _retire(self, client, usage):
+        """Close a replaced client now if it is idle, otherwise after its last request."""
+        self._retired = [retired for retired in self._retired if not retired.is_closed]
+        if not usage.retire():
+            # Kept until then, so close_all can still reach it
+            self._retired.append(client)
+            return
+        if isinstance(client, httpx.AsyncClient):
+            # Only the event loop that used an async client can close it
+            if usage.loop is not None and not usage.loop.is_closed():
+                usage.loop.call_soon_threadsafe(lambda: asyncio.ensure_future(client.aclose()))
+        else:
+            client.close()
+
+    def get_http_client(self, base_url, config):
+        """
+        Return the shared httpx.Client for the host of base_url.
+
+        Args:
+            base_url: The provider API base URL.
+            config: The configuration mapping holding the AI_HTTP_* settings.
+        """
+        return self._get_client(self._clients, httpx.Client, _TrackedTransport, base_url, config)
+
+    def get_async_http_client(self, base_url, config):
+        """Return the shared httpx.AsyncClient for the host of base_url; see get_http_client."""
+        return self._get_client(self._async_clients, httpx.AsyncClient, _AsyncTrackedTransport, base_url, config)
+
+    async def close_all(self):
+        """Close every pooled HTTP client, sync and async."""
+        with self._lock:
+            clients = [entry[1] for entry in self._clients.values()]
+            clients += [entry[1] for entry in self._async_clients.values()]
+            clients += [client for client in self._retired if not client.is_closed]
+            self._clients = {}
+            self._async_clients = {}
+            self._retired = []
+        for client in clients:
+            try:
+                if isinstance(client, httpx.AsyncClient):
+                    await client.aclose()
+                else:
+                    client.close()
+            except Exception:
+                pass
+
+
+# Global instance
+ai_transport = AITransport()
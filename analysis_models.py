@@ -0,0 +1,35 @@
+"""
+Pydantic schemas for AI analysis results, shared by the API and the AI service.
+"""
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+
+class PriorityAnalysis(BaseModel):
+    priority_score: int
+    urgency_level: str
+    reasoning: str
+    action_required: bool
+    estimated_response_time: str
+
+class CalendarEvent(BaseModel):
+    title: str
+    date: str
+    time: str
+    location: str
+    attendees: List[str]
+    description: str
+    meeting_link: Optional[str]
+    event_type: str
+
+class CalendarEvents(BaseModel):
+    has_events: bool
+    events: List[CalendarEvent]
+    action_items: List[str]
+    rsvp_required: bool
+
+class ComprehensiveAnalysis(BaseModel):
+    summary: str
+    priority_analysis: PriorityAnalysis
+    calendar_events: CalendarEvents
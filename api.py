@@ -1,14 +1,28 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 from pydantic import BaseModel, Field, RootModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Literal
+import json
 import os
-from dotenv import load_dotenv, set_key
+import threading
+from dotenv import set_key
 
 # Import your existing modules
-from email_client import EmailClient
-from ai_service import summarize_email, generate_batch_summary_report, analyze_email_comprehensive
+from email_client import EmailClient, shutdown_parse_pool
+from fetch_orchestrator import fetch_all_sources, fetch_source_email_body
+from analysis_models import PriorityAnalysis, CalendarEvents, ComprehensiveAnalysis
+from ai_service import (
+    summarize_email_async, summarize_email_stream, generate_batch_summary_report_async,
+    generate_batch_summary_report_stream, analyze_email_comprehensive_async
+)
 from config_manager import config_manager
+from imap_pool import imap_pool
+from ai_transport import ai_transport
+from mail_watcher import start_watchers, stop_watchers
+from message_store import message_store
+from batch_jobs import batch_job_queue
 
 # --- Pydantic Models ---
 
@@ -36,6 +50,11 @@ class AppConfig(BaseModel):
     AI_MAX_TOKENS: int = Field(250, title="AI Max Tokens")
     LOG_LEVEL: str = Field("INFO", title="Log Level")
 
+class Attachment(BaseModel):
+    name: Optional[str] = None
+    size: int = 0
+    type: str
+
 class Email(BaseModel):
     id: str
     from_: str = Field(..., alias='from')
@@ -45,6 +64,9 @@ class Email(BaseModel):
     reply_to: Optional[str] = Field(None, alias='reply_to')
     subject: str
     body: str
+    body_text: Optional[str] = None
+    attachments: List[Attachment] = []
+    source: Optional[str] = None
 
 class AnalyzeRequest(BaseModel):
     subject: str
@@ -58,33 +80,8 @@ class ComprehensiveAnalyzeRequest(BaseModel):
     body: str
     from_addr: str = Field(..., alias='from')
 
-class PriorityAnalysis(BaseModel):
-    priority_score: int
-    urgency_level: str
-    reasoning: str
-    action_required: bool
-    estimated_response_time: str
-
-class CalendarEvent(BaseModel):
-    title: str
-    date: str
-    time: str
-    location: str
-    attendees: List[str]
-    description: str
-    meeting_link: Optional[str]
-    event_type: str
-
-class CalendarEvents(BaseModel):
-    has_events: bool
-    events: List[CalendarEvent]
-    action_items: List[str]
-    rsvp_required: bool
-
-class ComprehensiveAnalyzeResponse(BaseModel):
-    summary: str
-    priority_analysis: PriorityAnalysis
-    calendar_events: CalendarEvents
+class ComprehensiveAnalyzeResponse(ComprehensiveAnalysis):
+    pass
 
 class BatchSummarizeWithDataRequest(BaseModel):
     emails: List[Email]
@@ -96,6 +93,18 @@ class BatchSummarizeWithDataRequest(BaseModel):
 class BatchSummarizeResponse(RootModel[Dict[str, Any]]):
     pass
 
+class BatchJobResponse(BaseModel):
+    id: str
+    source: str
+    status: str  # queued, fetching, analyzing, reporting, completed or failed
+    created_at: float
+    updated_at: float
+    total: Optional[int] = None
+    completed: int = 0
+    report: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    entries: List[Dict[str, Any]] = []
+
 # --- FastAPI App Initialization ---
 app = FastAPI()
 
@@ -107,16 +116,40 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+@app.on_event("startup")
+def start_mail_watchers():
+    """Start the IMAP IDLE watchers when WATCHER_ENABLED is set."""
+    if config_manager.get('WATCHER_ENABLED', False):
+        start_watchers()
+
+@app.on_event("startup")
+def start_batch_jobs():
+    """Start the batch job worker, resuming jobs interrupted by the last shutdown."""
+    batch_job_queue.start()
+
+@app.on_event("shutdown")
+def close_imap_pool():
+    """Stop the watchers and batch jobs, log out pooled IMAP connections and stop parser processes when the server stops."""
+    stop_watchers()
+    batch_job_queue.stop()
+    imap_pool.close_all()
+    shutdown_parse_pool()
+
+@app.on_event("shutdown")
+async def close_ai_transport():
+    """Close the pooled AI provider connections when the server stops."""
+    await ai_transport.close_all()
+
 # --- Helper Functions ---
 DOTENV_PATH = os.path.join(os.path.dirname(__file__), '.env')
 
 def reload_config():
-    """Reloads the configuration from the .env file."""
-    load_dotenv(dotenv_path=DOTENV_PATH, override=True)
-    # Use ConfigManager's reload method for hot-swappable configuration
-    config_manager.reload_config()
+    """Reloads the configuration if the .env file changed since it was last loaded."""
+    # Cheap when nothing changed: a stat() call, no file reads or new AI clients
+    config_manager.reload_if_changed()
 
 # --- API Endpoints ---
 @app.get("/")
@@ -129,7 +162,7 @@ def save_configuration(config: AppConfig):
         for key, value in config.model_dump().items():
             value_str = str(value) if value is not None else ""
             set_key(DOTENV_PATH, key, value_str)
-        reload_config() # Reload config after saving
+        config_manager.reload_config() # Reload config after saving
         return {"message": "Configuration saved successfully."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -154,50 +187,211 @@ def get_configuration():
         raise HTTPException(status_code=500, detail=error_detail)
 
 @app.get("/api/emails", response_model=List[Email])
-def get_emails():
-    """Connects to the email server and fetches emails."""
+def get_emails(
+    response: Response,
+    headers_only: bool = False,
+    before_uid: Optional[int] = Query(None, ge=1),
+    limit: Optional[int] = Query(None, ge=1, le=500)
+):
+    """
+    Connects to the email server and fetches emails.
+
+    With headers_only=true only sender, subject and date are returned; bodies can be
+    loaded one at a time from /api/emails/{email_id}/body.
+
+    Passing before_uid and/or limit switches to cursor pagination: the page holds the
+    newest `limit` matching emails older than before_uid, and the X-Next-Cursor response
+    header carries the before_uid for the next page (empty when there are no more).
+    """
     reload_config() # Ensure latest config is used
     client = EmailClient()
     if not client.connect():
         raise HTTPException(status_code=500, detail="Could not connect to email server.")
     
     try:
-        emails = client.fetch_emails()
+        if before_uid is None and limit is None:
+            return client.fetch_emails(headers_only=headers_only)
+        emails, next_cursor = client.fetch_email_page(before_uid=before_uid, limit=limit, headers_only=headers_only)
+        response.headers["X-Next-Cursor"] = str(next_cursor) if next_cursor else ""
         return emails
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred while fetching emails: {e}")
     finally:
         client.close()
 
+@app.get("/api/emails/all", response_model=List[Email])
+def get_emails_from_all_sources(headers_only: bool = False):
+    """
+    Fetches from every configured account and mailbox concurrently.
+
+    Results are merged newest first by date and tagged with their source mailbox. UIDs
+    are only unique per mailbox, so ids have the form '<account>/<mailbox>:<uid>'.
+    """
+    reload_config() # Ensure latest config is used
+    try:
+        return fetch_all_sources(headers_only=headers_only)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred while fetching emails: {e}")
+
+@app.get("/api/emails/stream")
+def stream_emails(
+    stream_format: Literal["ndjson", "sse"] = Query("ndjson", alias="format"),
+    headers_only: bool = False
+):
+    """
+    Streams emails one at a time as they are fetched and parsed.
+
+    format=ndjson writes one JSON email per line; format=sse sends each email as a
+    Server-Sent Event followed by a final `end` event. Emails have the same shape as
+    /api/emails. Failures, including a failed connection, are sent in the stream as an
+    {"error": "..."} item (an `error` event with SSE).
+    """
+    reload_config() # Ensure latest config is used
+
+    def encode(payload, event=None):
+        data = json.dumps(payload, ensure_ascii=False)
+        if stream_format == "sse":
+            prefix = f"event: {event}\n" if event else ""
+            return f"{prefix}data: {data}\n\n"
+        return f"{data}\n"
+
+    def generate():
+        # Connected here rather than in the route, so a client that disconnects before
+        # the response starts never checks out a pooled connection
+        client = EmailClient()
+        if not client.connect():
+            yield encode({"error": "Could not connect to email server."}, event="error")
+            return
+        try:
+            for email in client.iter_emails(headers_only=headers_only):
+                yield encode(Email.model_validate(email).model_dump(by_alias=True))
+            if stream_format == "sse":
+                yield encode({}, event="end")
+        except Exception as e:
+            error = {"error": f"An error occurred while fetching emails: {e}"}
+            yield encode(error, event="error")
+        finally:
+            client.close()
+
+    media_type = "text/event-stream" if stream_format == "sse" else "application/x-ndjson"
+    return StreamingResponse(generate(), media_type=media_type, headers={"Cache-Control": "no-cache"})
+
+@app.get("/api/emails/{email_id:path}/body", response_model=Email)
+def get_email_body(email_id: str):
+    """
+    Fetches and parses a single email body on demand. Bodies are cached after the first load.
+
+    email_id is a UID of the configured mailbox, or an '<account>/<mailbox>:<uid>' id as
+    returned by /api/emails/all.
+    """
+    reload_config() # Ensure latest config is used
+    if ':' in email_id:
+        try:
+            email = fetch_source_email_body(email_id)
+        except ConnectionError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"An error occurred while fetching email {email_id}: {e}")
+        if email is None:
+            raise HTTPException(status_code=404, detail=f"Email {email_id} not found.")
+        return email
+
+    if not email_id.isdigit():
+        raise HTTPException(status_code=404, detail=f"Email {email_id} not found.")
+    uid = int(email_id)
+    client = EmailClient()
+    if not client.connect():
+        raise HTTPException(status_code=500, detail="Could not connect to email server.")
+
+    try:
+        email = client.fetch_email_body(uid)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred while fetching email {uid}: {e}")
+    finally:
+        client.close()
+
+    if email is None:
+        raise HTTPException(status_code=404, detail=f"Email {uid} not found.")
+    return email
+
+@app.get("/api/watcher/results")
+def get_watcher_results(limit: int = Query(50, ge=1, le=500)):
+    """Returns the most recent analyses produced by the mail watcher, newest first."""
+    try:
+        return message_store.get_recent_analyses(limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred while reading watcher results: {e}")
+
 @app.post("/api/analyze/summarize", response_model=AnalyzeResponse)
-def analyze_email_summary(request: AnalyzeRequest):
+async def analyze_email_summary(request: AnalyzeRequest):
     """Receives email content and returns an AI-generated summary."""
-    reload_config() # Ensure AI service uses latest config
+    await run_in_threadpool(reload_config) # Ensure AI service uses latest config
     try:
-        summary = summarize_email(subject=request.subject, body=request.body)
+        summary = await summarize_email_async(subject=request.subject, body=request.body)
         if summary.startswith("[ERROR]"):
             raise HTTPException(status_code=500, detail=summary)
         return AnalyzeResponse(summary=summary)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred during analysis: {e}")
 
+@app.post("/api/analyze/summarize/stream")
+async def analyze_email_summary_stream(request: AnalyzeRequest, http_request: Request):
+    """
+    Streams an AI-generated summary as Server-Sent Events while it is generated.
+
+    Each event carries a {"delta": "..."} piece of text; a final `end` event carries the
+    complete summary, or an `error` event the failure. If the client disconnects the
+    provider stream is closed so no more tokens are generated.
+    """
+    await run_in_threadpool(reload_config) # Ensure AI service uses latest config
+    cancel_event = threading.Event()
+    chunks = summarize_email_stream(subject=request.subject, body=request.body, cancel_event=cancel_event)
+
+    def encode(payload, event=None):
+        prefix = f"event: {event}\n" if event else ""
+        return f"{prefix}data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    async def generate():
+        summary = ""
+        try:
+            async for delta in iterate_in_threadpool(chunks):
+                if await http_request.is_disconnected():
+                    break
+                if delta.startswith("[ERROR]"):
+                    yield encode({"error": delta}, event="error")
+                    return
+                summary += delta
+                yield encode({"delta": delta})
+            else:
+                yield encode({"summary": summary}, event="end")
+        finally:
+            cancel_event.set()
+            try:
+                chunks.close()
+            except ValueError:
+                # Still running in the worker thread; cancel_event stops it at the next token
+                pass
+
+    return StreamingResponse(generate(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 @app.post("/api/batch-summarize", response_model=BatchSummarizeResponse)
-def batch_summarize_emails():
+async def batch_summarize_emails():
     """
     Fetches emails and generates a batch summary report.
     """
-    reload_config() # Ensure latest config is used
+    await run_in_threadpool(reload_config) # Ensure latest config is used
     client = EmailClient()
-    if not client.connect():
+    # IMAP is blocking, so it stays off the event loop
+    if not await run_in_threadpool(client.connect):
         raise HTTPException(status_code=500, detail="Could not connect to email server for batch summary.")
     
     try:
-        emails = client.fetch_emails()
+        emails = await run_in_threadpool(client.fetch_emails)
         if not emails:
              # Return an empty but valid structure if no emails
             return BatchSummarizeResponse({"categories": []})
         
-        report = generate_batch_summary_report(emails)
+        report = await generate_batch_summary_report_async(emails)
         
         # Check if the AI service returned an error
         if "error" in report:
@@ -210,14 +404,14 @@ def batch_summarize_emails():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred during batch summarization: {e}")
     finally:
-        client.close()
+        await run_in_threadpool(client.close)
 
 @app.post("/api/batch-summarize-with-data", response_model=BatchSummarizeResponse)
-def batch_summarize_emails_with_data(request: BatchSummarizeWithDataRequest):
+async def batch_summarize_emails_with_data(request: BatchSummarizeWithDataRequest):
     """
     Generates a batch summary report from provided email data.
     """
-    reload_config() # Ensure latest config is used
+    await run_in_threadpool(reload_config) # Ensure latest config is used
     
     try:
         if not request.emails:
@@ -227,7 +421,7 @@ def batch_summarize_emails_with_data(request: BatchSummarizeWithDataRequest):
         # Convert Pydantic models to dictionaries, ensuring the 'from' field is correctly named
         # We need to use by_alias=True to use the alias 'from' instead of 'from_'
         email_dicts = [email.model_dump(by_alias=True) for email in request.emails]
-        report = generate_batch_summary_report(email_dicts)
+        report = await generate_batch_summary_report_async(email_dicts)
         
         # Check if the AI service returned an error
         if "error" in report:
@@ -240,15 +434,128 @@ def batch_summarize_emails_with_data(request: BatchSummarizeWithDataRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred during batch summarization: {e}")
 
+@app.post("/api/batch-summarize-with-data/stream")
+def batch_summarize_emails_with_data_stream(request: BatchSummarizeWithDataRequest):
+    """
+    Generates a batch summary report from provided email data, streamed as Server-Sent Events.
+
+    Each `category` event carries one complete category as soon as the AI has written it;
+    a final `end` event carries the whole report (the same structure as
+    /api/batch-summarize-with-data), or an `error` event the failure.
+    """
+    reload_config() # Ensure latest config is used
+    email_dicts = [email.model_dump(by_alias=True) for email in request.emails]
+
+    def encode(payload, event=None):
+        prefix = f"event: {event}\n" if event else ""
+        return f"{prefix}data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    def generate():
+        if not email_dicts:
+            yield encode({"categories": []}, event="end")
+            return
+        events = generate_batch_summary_report_stream(email_dicts)
+        try:
+            for event, payload in events:
+                if event == "category":
+                    yield encode(payload, event="category")
+                elif event == "report":
+                    yield encode(payload, event="end")
+                else:
+                    yield encode({"error": payload}, event="error")
+        except Exception as e:
+            yield encode({"error": f"An unexpected error occurred during batch summarization: {e}"}, event="error")
+        finally:
+            events.close()
+
+    return StreamingResponse(generate(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.post("/api/batch-summarize/jobs", response_model=BatchJobResponse)
+def create_batch_summary_job():
+    """
+    Queues a batch summary of the mailbox and returns the job immediately.
+
+    Follow the job with GET /api/batch-summarize/jobs/{job_id} or its /events stream.
+    """
+    reload_config() # Ensure latest config is used
+    return batch_job_queue.create_job()
+
+@app.post("/api/batch-summarize-with-data/jobs", response_model=BatchJobResponse)
+def create_batch_summary_job_with_data(request: BatchSummarizeWithDataRequest):
+    """
+    Queues a batch summary of the provided emails and returns the job immediately.
+    """
+    reload_config() # Ensure latest config is used
+    email_dicts = [email.model_dump(by_alias=True) for email in request.emails]
+    return batch_job_queue.create_job(email_dicts)
+
+@app.get("/api/batch-summarize/jobs/{job_id}", response_model=BatchJobResponse)
+def get_batch_summary_job(job_id: str, since: int = Query(0, ge=0)):
+    """
+    Returns a batch job's progress, the emails analyzed so far and, once completed, the report.
+
+    `since` skips the first analyzed emails, so pollers only receive new ones.
+    """
+    job = batch_job_queue.get_job(job_id, since=since)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Batch job {job_id} not found.")
+    return job
+
+@app.get("/api/batch-summarize/jobs/{job_id}/events")
+async def stream_batch_summary_job(job_id: str, last_event_id: Optional[str] = Header(None)):
+    """
+    Streams a batch job's progress as Server-Sent Events.
+
+    A `progress` event is sent whenever the job changes, carrying its status, counts and
+    the newly analyzed emails in `entries`; a final `end` event carries the report, or an
+    `error` event the failure. Reconnecting is safe: the job keeps running server-side,
+    and progress event ids let EventSource resume after the entries it already received.
+    """
+    if await run_in_threadpool(batch_job_queue.get_job, job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Batch job {job_id} not found.")
+
+    def encode(payload, event=None, event_id=None):
+        prefix = f"event: {event}\n" if event else ""
+        if event_id is not None:
+            prefix += f"id: {event_id}\n"
+        return f"{prefix}data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    async def generate():
+        # The id of a progress event is the number of entries sent so far
+        sent = int(last_event_id) if last_event_id and last_event_id.isdigit() else 0
+        last_update = None
+        while True:
+            job = await run_in_threadpool(batch_job_queue.get_job, job_id, since=sent)
+            if job is None:
+                yield encode({"error": f"Batch job {job_id} no longer exists."}, event="error")
+                return
+            report = job.pop('report')
+            if job['entries'] or job['updated_at'] != last_update:
+                sent += len(job['entries'])
+                last_update = job['updated_at']
+                yield encode(job, event="progress", event_id=sent)
+            else:
+                # Lets the server notice clients that went away
+                yield ": keepalive\n\n"
+            if job['status'] == 'completed':
+                yield encode(report, event="end")
+                return
+            if job['status'] == 'failed':
+                yield encode({"error": job['error']}, event="error")
+                return
+            await batch_job_queue.wait_for_change(15)
+
+    return StreamingResponse(generate(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 @app.post("/api/analyze/comprehensive", response_model=ComprehensiveAnalyzeResponse)
-def analyze_email_comprehensive_endpoint(request: ComprehensiveAnalyzeRequest):
+async def analyze_email_comprehensive_endpoint(request: ComprehensiveAnalyzeRequest):
     """
     Performs comprehensive email analysis including summary, priority scoring, and calendar event extraction.
     """
-    reload_config() # Ensure AI service uses latest config
+    await run_in_threadpool(reload_config) # Ensure AI service uses latest config
     try:
         # Get comprehensive analysis
-        analysis = analyze_email_comprehensive(
+        analysis = await analyze_email_comprehensive_async(
             subject=request.subject, 
             body=request.body, 
             from_addr=request.from_addr
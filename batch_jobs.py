@@ -0,0 +1,332 @@
+"""
+Background batch summarization jobs, persisted in SQLite so they survive restarts.
+"""
+import asyncio
+import json
+import logging
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from ai_service import analyze_email_for_batch, generate_batch_report_from_entries
+from config_manager import config_manager
+from email_client import EmailClient
+
+FINISHED_STATUSES = ('completed', 'failed')
+
+
+class BatchJobQueue:
+    """
+    Runs batch summary reports outside the HTTP request that asked for them.
+
+    A job is created with its emails (or fetches them from the mailbox first), then
+    every email is analyzed and its entry stored as soon as it is ready, and finally
+    the report is written from the stored entries. Because progress is saved per email,
+    a job interrupted by a server restart resumes with the emails that are still missing.
+    Jobs run one at a time on a single worker thread; the emails of a job are analyzed
+    BATCH_ANALYSIS_WORKERS at a time.
+    """
+
+    def __init__(self, db_path=None):
+        self._db_path = db_path
+        self._db_path_in_use = None
+        self._conn = None
+        self._lock = threading.Lock()
+        # (event loop, asyncio.Event) pairs of progress streams waiting for a job to change
+        self._waiters = set()
+        self._waiters_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._stop_event = threading.Event()
+        self._worker = None
+
+    def _connection(self):
+        db_path = self._db_path or config_manager.get('BATCH_JOB_STORE_PATH')
+        if not db_path:
+            db_path = os.path.join(os.path.dirname(__file__), 'batch_jobs.db')
+        if self._conn is None or db_path != self._db_path_in_use:
+            if self._conn is not None:
+                self._conn.close()
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._db_path_in_use = db_path
+            self._create_tables()
+        return self._conn
+
+    def _create_tables(self):
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS batch_jobs (
+                id TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                total INTEGER,
+                completed INTEGER NOT NULL DEFAULT 0,
+                report TEXT,
+                error TEXT
+            );
+            CREATE TABLE IF NOT EXISTS batch_job_items (
+                job_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                email TEXT NOT NULL,
+                entry TEXT,
+                completed_at REAL,
+                PRIMARY KEY (job_id, position)
+            );
+        """)
+        self._conn.commit()
+
+    def _notify(self):
+        with self._waiters_lock:
+            waiters = list(self._waiters)
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The waiter's event loop has already closed
+                pass
+
+    def _update_job(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        with self._lock:
+            conn = self._connection()
+            conn.execute(f"UPDATE batch_jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+            conn.commit()
+        self._notify()
+
+    def _save_items(self, job_id, emails):
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "INSERT OR REPLACE INTO batch_job_items (job_id, position, email) VALUES (?, ?, ?)",
+                [(job_id, position, json.dumps(email, ensure_ascii=False)) for position, email in enumerate(emails)]
+            )
+            conn.execute("UPDATE batch_jobs SET total = ?, updated_at = ? WHERE id = ?", (len(emails), time.time(), job_id))
+            conn.commit()
+
+    def _save_entry(self, job_id, position, entry):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "UPDATE batch_job_items SET entry = ?, completed_at = ? WHERE job_id = ? AND position = ?",
+                (json.dumps(entry, ensure_ascii=False), time.time(), job_id, position)
+            )
+            conn.execute(
+                "UPDATE batch_jobs SET completed = completed + 1, updated_at = ? WHERE id = ?",
+                (time.time(), job_id)
+            )
+            conn.commit()
+        self._notify()
+
+    def create_job(self, emails=None):
+        """
+        Queue a batch summary job.
+
+        Args:
+            emails: The emails to report on, as dictionaries with 'id', 'from', 'subject'
+                and 'body' keys. None fetches them from the mailbox when the job starts.
+
+        Returns:
+            The new job, as returned by get_job.
+        """
+        # Started first, so the new job is not also picked up as an unfinished one
+        self.start()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT INTO batch_jobs (id, source, status, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?)",
+                (job_id, 'mailbox' if emails is None else 'data', now, now)
+            )
+            conn.commit()
+        if emails is not None:
+            self._save_items(job_id, emails)
+        self._queue.put(job_id)
+        return self.get_job(job_id)
+
+    def get_job(self, job_id, since=0):
+        """
+        Return a job's status and results, or None if it does not exist.
+
+        Args:
+            job_id: The job id.
+            since: Only include analyzed emails completed after the first `since` ones,
+                so pollers can fetch just what is new.
+
+        Returns:
+            A dict with 'id', 'status', 'total', 'completed', 'error', 'report' and
+            'entries' (the per-email analyses, in completion order).
+        """
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT id, source, status, created_at, updated_at, total, completed, report, error "
+                "FROM batch_jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            entries = conn.execute(
+                "SELECT entry FROM batch_job_items WHERE job_id = ? AND entry IS NOT NULL "
+                "ORDER BY completed_at, position LIMIT -1 OFFSET ?",
+                (job_id, max(0, since))
+            ).fetchall()
+        return {
+            'id': row[0],
+            'source': row[1],
+            'status': row[2],
+            'created_at': row[3],
+            'updated_at': row[4],
+            'total': row[5],
+            'completed': row[6],
+            'report': json.loads(row[7]) if row[7] else None,
+            'error': row[8],
+            'entries': [json.loads(entry[0]) for entry in entries],
+        }
+
+    async def wait_for_change(self, timeout):
+        """Wait until any job changes or the timeout expires, without blocking the event loop."""
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._waiters_lock:
+            self._waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._waiters_lock:
+                self._waiters.discard(waiter)
+
+    def start(self):
+        """
+        Start the worker and requeue jobs left unfinished by a previous run.
+
+        Raises:
+            RuntimeError: If a stopped worker is still finishing its job; requeueing now
+                would run that job twice.
+        """
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                if self._stop_event.is_set():
+                    raise RuntimeError("The previous batch job worker is still finishing its current job.")
+                return
+            self._stop_event.clear()
+            # Unfinished jobs are requeued from the database below
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            conn = self._connection()
+            retention = config_manager.get('BATCH_JOB_RETENTION_HOURS', 168) * 3600
+            placeholders = ','.join('?' * len(FINISHED_STATUSES))
+            conn.execute(
+                f"DELETE FROM batch_job_items WHERE job_id IN (SELECT id FROM batch_jobs "
+                f"WHERE status IN ({placeholders}) AND updated_at < ?)",
+                (*FINISHED_STATUSES, time.time() - retention)
+            )
+            conn.execute(
+                f"DELETE FROM batch_jobs WHERE status IN ({placeholders}) AND updated_at < ?",
+                (*FINISHED_STATUSES, time.time() - retention)
+            )
+            conn.commit()
+            unfinished = conn.execute(
+                f"SELECT id FROM batch_jobs WHERE status NOT IN ({placeholders}) ORDER BY created_at",
+                FINISHED_STATUSES
+            ).fetchall()
+            for (job_id,) in unfinished:
+                self._queue.put(job_id)
+            self._worker = threading.Thread(target=self._run, name='batch-jobs', daemon=True)
+            self._worker.start()
+        if unfinished:
+            logging.info(f"Resuming {len(unfinished)} unfinished batch job(s).")
+
+    def stop(self, timeout=10):
+        """
+        Stop the worker; the running job is resumed on the next start.
+
+        If the worker does not finish within timeout its thread is kept, so start()
+        can tell that the job it is running is still in progress.
+        """
+        self._stop_event.set()
+        self._queue.put(None)
+        if self._worker is not None:
+            self._worker.join(timeout)
+            if self._worker.is_alive():
+                logging.warning("Batch job worker did not stop within the timeout; it will exit after its current job.")
+            else:
+                self._worker = None
+        self._notify()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            job_id = self._queue.get()
+            if job_id is None:
+                continue
+            try:
+                self._process(job_id)
+            except Exception as e:
+                logging.error(f"Batch job {job_id} failed: {e}")
+                self._update_job(job_id, status='failed', error=f"An unexpected error occurred during batch summarization: {e}")
+
+    def _process(self, job_id):
+        job = self.get_job(job_id)
+        if job is None or job['status'] in FINISHED_STATUSES:
+            return
+
+        if job['total'] is None:
+            self._update_job(job_id, status='fetching')
+            client = EmailClient()
+            if not client.connect():
+                self._update_job(job_id, status='failed', error="Could not connect to email server for batch summary.")
+                return
+            try:
+                emails = client.fetch_emails()
+            finally:
+                client.close()
+            self._save_items(job_id, emails or [])
+            if not emails:
+                self._update_job(job_id, status='completed', report=json.dumps({"categories": []}))
+                return
+
+        with self._lock:
+            pending = self._connection().execute(
+                "SELECT position, email FROM batch_job_items WHERE job_id = ? AND entry IS NULL ORDER BY position",
+                (job_id,)
+            ).fetchall()
+        self._update_job(job_id, status='analyzing')
+        if pending:
+            max_workers = max(1, min(config_manager.get('BATCH_ANALYSIS_WORKERS', 8), len(pending)))
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='batch-job') as executor:
+                futures = {
+                    executor.submit(analyze_email_for_batch, json.loads(email)): position
+                    for position, email in pending
+                }
+                for future in as_completed(futures):
+                    self._save_entry(job_id, futures[future], future.result())
+                    if self._stop_event.is_set():
+                        # Shutting down: the remaining emails are analyzed when the job resumes
+                        if sys.version_info >= (3, 9):
+                            executor.shutdown(wait=False, cancel_futures=True)
+                        else:
+                            for pending_future in futures:
+                                pending_future.cancel()
+                        return
+
+        self._update_job(job_id, status='reporting')
+        with self._lock:
+            entries = [json.loads(row[0]) for row in self._connection().execute(
+                "SELECT entry FROM batch_job_items WHERE job_id = ? ORDER BY position", (job_id,)
+            ).fetchall()]
+        report = generate_batch_report_from_entries(entries)
+        if "error" in report:
+            self._update_job(job_id, status='failed', error=report['error'])
+        else:
+            self._update_job(job_id, status='completed', report=json.dumps(report, ensure_ascii=False))
+
+
+# Global instance
+batch_job_queue = BatchJobQueue()
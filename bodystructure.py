@@ -0,0 +1,151 @@
+"""
+Parser for IMAP BODYSTRUCTURE responses (RFC 3501, section 7.4.2).
+"""
+import re
+
+TOKEN_PATTERN = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|\{(\d+)\}|([^\s()"]+))')
+LITERAL_PLACEHOLDER = re.compile(rb'\{(\d+)\}$')
+
+
+class BodyPart:
+    """A single leaf part of a message, addressed by its IMAP section number."""
+
+    def __init__(self, section, content_type, params, encoding, size, disposition=None, disposition_params=None):
+        self.section = section
+        self.content_type = content_type
+        self.params = params
+        self.encoding = encoding
+        self.size = size
+        self.disposition = disposition
+        self.disposition_params = disposition_params or {}
+
+    @property
+    def charset(self):
+        return self.params.get('charset')
+
+    @property
+    def filename(self):
+        return self.disposition_params.get('filename') or self.params.get('name')
+
+    @property
+    def is_attachment(self):
+        if self.disposition == 'attachment':
+            return True
+        return not self.content_type.startswith('text/') or (self.disposition == 'inline' and bool(self.filename))
+
+
+def _flatten(data):
+    """
+    Join an imaplib response (bytes and (header, literal) tuples) into one buffer.
+
+    Literals are swapped for quoted-string placeholders so the tokenizer never has
+    to deal with raw {n} octet counts.
+    """
+    literals = []
+    buffer = b''
+    for item in data:
+        if isinstance(item, tuple):
+            header, literal = item
+            buffer += LITERAL_PLACEHOLDER.sub(f'{{{len(literals)}}}'.encode(), header)
+            literals.append(literal)
+        elif item:
+            buffer += item
+    return buffer, literals
+
+
+def _tokenize(buffer, literals):
+    position = 0
+    while position < len(buffer):
+        match = TOKEN_PATTERN.match(buffer, position)
+        if not match or match.end() == position:
+            break
+        position = match.end()
+        open_paren, close_paren, quoted, literal_index, atom = match.groups()
+        if open_paren:
+            yield '('
+        elif close_paren:
+            yield ')'
+        elif quoted is not None:
+            yield re.sub(rb'\\(.)', rb'\1', quoted).decode('utf-8', errors='replace')
+        elif literal_index is not None:
+            yield literals[int(literal_index)].decode('utf-8', errors='replace')
+        else:
+            yield None if atom.upper() == b'NIL' else atom.decode('utf-8', errors='replace')
+
+
+def _parse_list(tokens):
+    """Build nested Python lists from the token stream, starting after an opening '('."""
+    result = []
+    for token in tokens:
+        if token == '(':
+            result.append(_parse_list(tokens))
+        elif token == ')':
+            return result
+        else:
+            result.append(token)
+    return result
+
+
+def _params_to_dict(params):
+    if not isinstance(params, list):
+        return {}
+    return {str(params[i]).lower(): params[i + 1] for i in range(0, len(params) - 1, 2) if params[i] is not None}
+
+
+def _walk(node, section, parts):
+    if node and isinstance(node[0], list):
+        # Multipart: child bodies followed by the subtype and extension data
+        index = 1
+        for child in node:
+            if not isinstance(child, list):
+                break
+            _walk(child, f"{section}.{index}" if section else str(index), parts)
+            index += 1
+        return
+
+    content_type = f"{(node[0] or 'application')}/{(node[1] or 'octet-stream')}".lower()
+    params = _params_to_dict(node[2] if len(node) > 2 else None)
+    encoding = (node[5] or '7bit').lower() if len(node) > 5 else '7bit'
+    try:
+        size = int(node[6]) if len(node) > 6 and node[6] is not None else 0
+    except (TypeError, ValueError):
+        size = 0
+
+    # Extension data position depends on the body type
+    if content_type.startswith('text/'):
+        extension_start = 8
+    elif content_type == 'message/rfc822':
+        extension_start = 10
+    else:
+        extension_start = 7
+    disposition = None
+    disposition_params = {}
+    disposition_index = extension_start + 1
+    if len(node) > disposition_index and isinstance(node[disposition_index], list) and node[disposition_index]:
+        disposition = (node[disposition_index][0] or '').lower() or None
+        if len(node[disposition_index]) > 1:
+            disposition_params = _params_to_dict(node[disposition_index][1])
+
+    parts.append(BodyPart(section or '1', content_type, params, encoding, size, disposition, disposition_params))
+
+
+def parse_bodystructure(data):
+    """
+    Parse the BODYSTRUCTURE item of a FETCH response.
+
+    Args:
+        data: The response data from imaplib for a single message.
+
+    Returns:
+        A list of BodyPart leaves, in section order. Empty if no BODYSTRUCTURE was found.
+    """
+    buffer, literals = _flatten(data)
+    marker = buffer.upper().find(b'BODYSTRUCTURE')
+    if marker < 0:
+        return []
+    tokens = _tokenize(buffer[marker + len(b'BODYSTRUCTURE'):], literals)
+    if next(tokens, None) != '(':
+        return []
+    parts = []
+    _walk(_parse_list(tokens), '', parts)
+    return parts
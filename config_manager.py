@@ -1,10 +1,23 @@
 """Dynamic Configuration Manager for hot-swappable configuration updates."""
+import hashlib
 import os
 import threading
+from types import MappingProxyType
 from typing import Dict, Any, Optional
 from dotenv import load_dotenv
 import openai
 
+from ai_transport import ai_transport
+
+# Providers reached through the OpenAI SDK: name -> (label, API key setting, base URL setting)
+OPENAI_COMPATIBLE_PROVIDERS = {
+    'openai': ('OpenAI', 'OPENAI_API_KEY', 'OPENAI_BASE_URL'),
+    'openrouter': ('OpenRouter', 'OPENROUTER_API_KEY', 'OPENROUTER_BASE_URL'),
+    'custom': ('Custom', 'CUSTOM_API_KEY', 'CUSTOM_BASE_URL'),
+}
+# Providers that can only be listed in AI_FAILOVER_PROVIDERS, not used as AI_PROVIDER
+FAILOVER_ONLY_PROVIDERS = ('custom',)
+
 class ConfigManager:
     """
     Singleton configuration manager that supports hot-swappable configuration updates.
@@ -22,12 +35,20 @@ class ConfigManager:
     def __init__(self):
         if not hasattr(self, 'initialized'):
             self.initialized = True
-            self._config = {}
+            self._config = MappingProxyType({})
             self._ai_clients = {
                 'openai_client': None,
                 'openrouter_client': None,
-                'anthropic_client': None
+                'anthropic_client': None,
+                'async_openai_client': None,
+                'async_openrouter_client': None,
+                'custom_client': None,
+                'async_custom_client': None
             }
+            self._dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
+            self._env_stat = None
+            self._env_hash = None
+            self._ai_client_settings = None
             self.load_config()
             self.initialize_ai_clients()
     
@@ -48,14 +69,29 @@ class ConfigManager:
         value = os.getenv(name, str(default)).lower()
         return value in ['true', '1', 't', 'y', 'yes']
     
+    def _read_env_file(self):
+        """Return the (mtime, size) stat and content hash of the .env file, or (None, None) if it is missing."""
+        try:
+            stat = os.stat(self._dotenv_path)
+            with open(self._dotenv_path, 'rb') as f:
+                content_hash = hashlib.sha256(f.read()).hexdigest()
+        except OSError:
+            return None, None
+        return (stat.st_mtime_ns, stat.st_size), content_hash
+
     def load_config(self):
-        """Load configuration from environment variables."""
+        """
+        Load configuration from environment variables.
+
+        The result replaces the current snapshot in one assignment, so readers never
+        see a half-updated configuration and need no lock.
+        """
         # Load environment variables from .env file
-        dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
-        load_dotenv(dotenv_path=dotenv_path, override=True)
+        self._env_stat, self._env_hash = self._read_env_file()
+        load_dotenv(dotenv_path=self._dotenv_path, override=True)
         
         # Email Account Settings
-        self._config.update({
+        self._config = MappingProxyType({
             'IMAP_SERVER': self.get_config("IMAP_SERVER", "imap.example.com"),
             'IMAP_PORT': self.get_config("IMAP_PORT", 993, int),
             'EMAIL_ADDRESS': self.get_config("EMAIL_ADDRESS"),
@@ -63,9 +99,30 @@ class ConfigManager:
             
             # Email Fetching Rules
             'IMAP_MAILBOX': self.get_config("IMAP_MAILBOX", "INBOX"),
+            'IMAP_MAILBOXES': self.get_config("IMAP_MAILBOXES"),
+            'IMAP_ACCOUNTS_FILE': self.get_config("IMAP_ACCOUNTS_FILE"),
+            'FETCH_WORKERS': self.get_config("FETCH_WORKERS", 4, int),
             'FETCH_CRITERIA': self.get_config("FETCH_CRITERIA", "UNSEEN"),
             'FETCH_LIMIT': self.get_config("FETCH_LIMIT", 10, int),
             'FETCH_DAYS': self.get_config("FETCH_DAYS", 0, int),
+            'FETCH_BATCH_SIZE': self.get_config("FETCH_BATCH_SIZE", 50, int),
+            'FETCH_BODY_MODE': self.get_config("FETCH_BODY_MODE", "full"),
+            'FETCH_PART_MAX_BYTES': self.get_config("FETCH_PART_MAX_BYTES", 0, int),
+            'PARSE_WORKERS': self.get_config("PARSE_WORKERS", 0, int),
+            'PARSE_POOL_MIN_BATCH': self.get_config("PARSE_POOL_MIN_BATCH", 20, int),
+            'INCREMENTAL_SYNC': self.get_bool_config("INCREMENTAL_SYNC", False),
+            'MESSAGE_STORE_PATH': self.get_config("MESSAGE_STORE_PATH"),
+            
+            # IMAP Connection Pool
+            'IMAP_POOL_SIZE': self.get_config("IMAP_POOL_SIZE", 4, int),
+            'IMAP_POOL_KEEPALIVE': self.get_config("IMAP_POOL_KEEPALIVE", 60, int),
+            'IMAP_POOL_MAX_IDLE': self.get_config("IMAP_POOL_MAX_IDLE", 600, int),
+            'IMAP_POOL_TIMEOUT': self.get_config("IMAP_POOL_TIMEOUT", 30, int),
+            
+            # Mail Watcher (IMAP IDLE)
+            'WATCHER_ENABLED': self.get_bool_config("WATCHER_ENABLED", False),
+            'WATCHER_IDLE_TIMEOUT': self.get_config("WATCHER_IDLE_TIMEOUT", 1500, int),
+            'WATCHER_POLL_INTERVAL': self.get_config("WATCHER_POLL_INTERVAL", 60, int),
             
             # Email Actions
             'MARK_AS_READ': self.get_bool_config("MARK_AS_READ", True),
@@ -79,59 +136,170 @@ class ConfigManager:
             'OPENAI_BASE_URL': self.get_config("OPENAI_BASE_URL", "https://api.openai.com/v1"),
             'OPENROUTER_BASE_URL': self.get_config("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
             
+            # Failover and Hedged Requests
+            'AI_FAILOVER_PROVIDERS': self.get_config("AI_FAILOVER_PROVIDERS", ""),
+            'CUSTOM_API_KEY': self.get_config("CUSTOM_API_KEY"),
+            'CUSTOM_BASE_URL': self.get_config("CUSTOM_BASE_URL"),
+            'CUSTOM_MODEL': self.get_config("CUSTOM_MODEL", "gpt-4o-mini"),
+            'AI_HEDGE_REQUESTS': self.get_bool_config("AI_HEDGE_REQUESTS", False),
+            'AI_HEDGE_PERCENTILE': self.get_config("AI_HEDGE_PERCENTILE", 95.0, float),
+            'AI_HEDGE_MIN_DELAY': self.get_config("AI_HEDGE_MIN_DELAY", 1.0, float),
+            
             # AI Behavior Settings
             'OPENAI_MODEL': self.get_config("OPENAI_MODEL", "gpt-4o-mini"),
             'OPENROUTER_MODEL': self.get_config("OPENROUTER_MODEL", "openai/gpt-4o-mini"),
             'AI_OUTPUT_LANGUAGE': self.get_config("AI_OUTPUT_LANGUAGE", "Chinese"),
             'AI_TEMPERATURE': self.get_config("AI_TEMPERATURE", 0.5, float),
             'AI_MAX_TOKENS': self.get_config("AI_MAX_TOKENS", 250, int),
+
+            # AI HTTP Transport Settings
+            'AI_HTTP_MAX_CONNECTIONS': self.get_config("AI_HTTP_MAX_CONNECTIONS", 100, int),
+            'AI_HTTP_MAX_KEEPALIVE': self.get_config("AI_HTTP_MAX_KEEPALIVE", 20, int),
+            'AI_HTTP_KEEPALIVE_EXPIRY': self.get_config("AI_HTTP_KEEPALIVE_EXPIRY", 30.0, float),
+            'AI_HTTP2': self.get_bool_config("AI_HTTP2", False),
+            'AI_CONNECT_TIMEOUT': self.get_config("AI_CONNECT_TIMEOUT", 5.0, float),
+            'AI_READ_TIMEOUT': self.get_config("AI_READ_TIMEOUT", 120.0, float),
+            
+            # AI Rate Limits (ai_scheduler)
+            'AI_RATE_LIMIT_RPM': self.get_config("AI_RATE_LIMIT_RPM", 0, int),
+            'AI_RATE_LIMIT_TPM': self.get_config("AI_RATE_LIMIT_TPM", 0, int),
+            'AI_RATE_LIMITS': self.get_config("AI_RATE_LIMITS"),
+            'AI_MAX_CONCURRENCY': self.get_config("AI_MAX_CONCURRENCY", 16, int),
+            'AI_MAX_RETRIES': self.get_config("AI_MAX_RETRIES", 3, int),
+            'AI_RETRY_BASE_DELAY': self.get_config("AI_RETRY_BASE_DELAY", 0.5, float),
+            'AI_RETRY_MAX_DELAY': self.get_config("AI_RETRY_MAX_DELAY", 30.0, float),
+            
+            'AI_CLEAN_BODY': self.get_bool_config("AI_CLEAN_BODY", True),
+            'AI_INPUT_TOKEN_BUDGET': self.get_config("AI_INPUT_TOKEN_BUDGET", 3000, int),
+            'BATCH_PREVIEW_TOKENS': self.get_config("BATCH_PREVIEW_TOKENS", 500, int),
+            'COMPREHENSIVE_ANALYSIS_MODE': self.get_config("COMPREHENSIVE_ANALYSIS_MODE", "single"),
+            'BATCH_ANALYSIS_WORKERS': self.get_config("BATCH_ANALYSIS_WORKERS", 8, int),
+            'BATCH_REPORT_MODE': self.get_config("BATCH_REPORT_MODE", "auto"),
+            'BATCH_CHUNK_TOKENS': self.get_config("BATCH_CHUNK_TOKENS", 6000, int),
+            'BATCH_JOB_STORE_PATH': self.get_config("BATCH_JOB_STORE_PATH"),
+            'BATCH_JOB_RETENTION_HOURS': self.get_config("BATCH_JOB_RETENTION_HOURS", 168, int),
             
             # Application Settings
             'LOG_LEVEL': self.get_config("LOG_LEVEL", "INFO")
         })
     
+    def _get_ai_client_settings(self):
+        """The settings the AI clients are built from; other changes do not require new clients."""
+        return tuple(self._config.get(key) for key in (
+            'AI_PROVIDER', 'OPENAI_API_KEY', 'OPENAI_BASE_URL', 'OPENROUTER_API_KEY', 'OPENROUTER_BASE_URL', 'ANTHROPIC_API_KEY',
+            'AI_HTTP_MAX_CONNECTIONS', 'AI_HTTP_MAX_KEEPALIVE', 'AI_HTTP_KEEPALIVE_EXPIRY', 'AI_HTTP2',
+            'AI_CONNECT_TIMEOUT', 'AI_READ_TIMEOUT', 'AI_FAILOVER_PROVIDERS', 'CUSTOM_API_KEY', 'CUSTOM_BASE_URL'
+        ))
+
     def initialize_ai_clients(self):
         """Initialize AI clients based on current configuration."""
-        # Reset all clients
-        self._ai_clients = {
+        self._ai_client_settings = self._get_ai_client_settings()
+        # Build the new set of clients, then swap it in at once
+        ai_clients = {
             'openai_client': None,
             'openrouter_client': None,
-            'anthropic_client': None
+            'anthropic_client': None,
+            'async_openai_client': None,
+            'async_openrouter_client': None,
+            'custom_client': None,
+            'async_custom_client': None
         }
         
-        ai_provider = self._config.get('AI_PROVIDER', 'openai')
-        
-        if ai_provider == 'openai':
-            openai_api_key = self._config.get('OPENAI_API_KEY')
-            if openai_api_key:
-                openai_base_url = self._config.get('OPENAI_BASE_URL')
-                self._ai_clients['openai_client'] = openai.OpenAI(
-                    api_key=openai_api_key,
-                    base_url=openai_base_url if openai_base_url else None
-                )
-                print(f"[INFO] OpenAI client initialized with base URL: {openai_base_url}")
-            else:
-                print("[ERROR] OPENAI_API_KEY is not set, cannot initialize OpenAI client.")
-        
-        elif ai_provider == 'openrouter':
-            openrouter_api_key = self._config.get('OPENROUTER_API_KEY')
-            if openrouter_api_key:
-                openrouter_base_url = self._config.get('OPENROUTER_BASE_URL')
-                self._ai_clients['openrouter_client'] = openai.OpenAI(
-                    api_key=openrouter_api_key,
-                    base_url=openrouter_base_url
-                )
-                print(f"[INFO] OpenRouter client initialized with base URL: {openrouter_base_url}")
-            else:
-                print("[ERROR] OPENROUTER_API_KEY is not set, cannot initialize OpenRouter client.")
+        # Failover providers get clients too, so they are ready when the primary fails
+        providers = [self._config.get('AI_PROVIDER', 'openai')]
+        if providers[0] in FAILOVER_ONLY_PROVIDERS:
+            print(f"[ERROR] AI_PROVIDER '{providers[0]}' can only be used in AI_FAILOVER_PROVIDERS.")
+            providers = []
+        for ai_provider in providers + self.get_failover_providers():
+            if ai_provider in OPENAI_COMPATIBLE_PROVIDERS:
+                self._create_openai_clients(ai_clients, ai_provider)
+
+        self._ai_clients = ai_clients
     
+    def _create_openai_clients(self, ai_clients, ai_provider):
+        """Create the sync and async clients of a provider that speaks the OpenAI API."""
+        label, api_key_setting, base_url_setting = OPENAI_COMPATIBLE_PROVIDERS[ai_provider]
+        api_key = self._config.get(api_key_setting)
+        if not api_key:
+            print(f"[ERROR] {api_key_setting} is not set, cannot initialize {label} client.")
+            return
+        base_url = self._config.get(base_url_setting)
+        ai_clients[f'{ai_provider}_client'] = openai.OpenAI(
+            api_key=api_key,
+            base_url=base_url if base_url else None,
+            # Shared per-host connection pool, kept across reloads
+            http_client=ai_transport.get_http_client(base_url, self._config),
+            timeout=ai_transport.timeout(self._config),
+            # Retries are made by ai_scheduler, which also honours Retry-After
+            max_retries=0
+        )
+        # Used by the async API endpoints
+        ai_clients[f'async_{ai_provider}_client'] = openai.AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url if base_url else None,
+            http_client=ai_transport.get_async_http_client(base_url, self._config),
+            timeout=ai_transport.timeout(self._config),
+            max_retries=0
+        )
+        print(f"[INFO] {label} client initialized with base URL: {base_url}")
+
+    def get_failover_providers(self):
+        """The providers listed in AI_FAILOVER_PROVIDERS, in order, without the primary AI_PROVIDER."""
+        primary = self._config.get('AI_PROVIDER', 'openai')
+        providers = []
+        for provider in (self._config.get('AI_FAILOVER_PROVIDERS') or '').split(','):
+            provider = provider.strip().lower()
+            if provider and provider != primary and provider not in providers:
+                providers.append(provider)
+        return providers
+
     def reload_config(self):
-        """Reload configuration and reinitialize AI clients."""
+        """
+        Reload configuration, e.g. after the settings were saved.
+
+        AI clients, and with them their HTTP connection pools, are only rebuilt when
+        the provider, API keys or base URLs changed.
+        """
         with self._lock:
             print("[INFO] Reloading configuration...")
             self.load_config()
-            self.initialize_ai_clients()
+            if self._get_ai_client_settings() != self._ai_client_settings:
+                self.initialize_ai_clients()
             print("[INFO] Configuration reloaded successfully")
+
+    def reload_if_changed(self):
+        """
+        Reload configuration only if the .env file changed since it was last loaded.
+
+        The common case costs a single stat() call. The file is re-read only when its
+        mtime or size changed, and configuration only reloaded when its content did.
+
+        Returns:
+            True if the configuration was reloaded.
+        """
+        try:
+            stat = os.stat(self._dotenv_path)
+            env_stat = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            env_stat = None
+        if env_stat == self._env_stat:
+            return False
+
+        with self._lock:
+            current_stat, content_hash = self._read_env_file()
+            if current_stat == self._env_stat:
+                # Another thread already handled this change
+                return False
+            if content_hash == self._env_hash:
+                # Touched but not modified
+                self._env_stat = current_stat
+                return False
+        self.reload_config()
+        return True
+
+    def get_snapshot(self):
+        """Return the current configuration as a read-only mapping that never changes after it is returned."""
+        return self._config
     
     def get(self, key: str, default=None):
         """Get a configuration value."""
@@ -176,6 +344,19 @@ class ConfigManager:
         if ai_provider == 'openrouter' and not self._config.get('OPENROUTER_API_KEY'):
             raise ValueError("AI_PROVIDER is set to 'openrouter', but OPENROUTER_API_KEY is missing.")
 
+        if ai_provider in FAILOVER_ONLY_PROVIDERS:
+            raise ValueError(f"AI_PROVIDER '{ai_provider}' can only be used in AI_FAILOVER_PROVIDERS.")
+
+        for failover_provider in self.get_failover_providers():
+            if failover_provider not in OPENAI_COMPATIBLE_PROVIDERS:
+                raise ValueError(f"AI_FAILOVER_PROVIDERS lists '{failover_provider}', but only "
+                                 f"{', '.join(OPENAI_COMPATIBLE_PROVIDERS)} are supported there.")
+            _, api_key_setting, base_url_setting = OPENAI_COMPATIBLE_PROVIDERS[failover_provider]
+            if not self._config.get(api_key_setting):
+                raise ValueError(f"AI_FAILOVER_PROVIDERS lists '{failover_provider}', but {api_key_setting} is missing.")
+            if failover_provider == 'custom' and not self._config.get(base_url_setting):
+                raise ValueError(f"AI_FAILOVER_PROVIDERS lists 'custom', but {base_url_setting} is missing.")
+
 
 # Global instance
 config_manager = ConfigManager()
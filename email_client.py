@@ -3,18 +3,101 @@ IMAP Email Client to fetch and parse emails.
 """
 import imaplib
 import email
-from email.header import decode_header
+import base64
+import binascii
+import quopri
+import re
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta
 import logging
+import multiprocessing
+import select
+import sys
+import time
+import threading
 
+from bodystructure import parse_bodystructure
 from config_manager import config_manager
+from imap_pool import imap_pool
+from message_store import message_store
+from mime_parsing import parse_headers, parse_raw_message
+from text_preprocessing import clean_email_text
 
 # Configure logging - will be updated dynamically
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+UID_PATTERN = re.compile(rb'UID (\d+)')
+FETCH_START_PATTERN = re.compile(rb'^\d+ \(')
+EXISTS_PATTERN = re.compile(rb'^\* \d+ EXISTS')
+SECTION_PATTERN = re.compile(rb'BODY\[([^\]]*)\](?:<\d+>)? \{\d+\}$')
+HEADER_FIELDS_ITEM = 'BODY.PEEK[HEADER.FIELDS (SUBJECT FROM TO CC DATE REPLY-TO)]'
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+def _get_parse_pool(workers):
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            # spawn rather than fork: the API process is multi-threaded
+            _parse_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        return _parse_pool
+
+
+def shutdown_parse_pool():
+    """Stop the MIME parsing worker processes, if any were started."""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is not None:
+            if sys.version_info >= (3, 9):
+                _parse_pool.shutdown(wait=False, cancel_futures=True)
+            else:
+                # cancel_futures is new in 3.9; queued parses then finish before the workers exit
+                _parse_pool.shutdown(wait=False)
+            _parse_pool = None
+
+
+def parse_raw_messages(items):
+    """
+    Parse raw RFC822 messages into email dictionaries, preserving order.
+
+    Batches of at least PARSE_POOL_MIN_BATCH messages are parsed on a pool of
+    PARSE_WORKERS processes so the CPU work scales with cores and does not hold
+    the GIL; smaller batches, or PARSE_WORKERS=0, are parsed in-process.
+
+    Args:
+        items: A list of (raw bytes, email id) pairs.
+    """
+    workers = config_manager.get('PARSE_WORKERS', 0)
+    min_batch = config_manager.get('PARSE_POOL_MIN_BATCH', 20)
+    if workers <= 0 or len(items) < max(min_batch, 2):
+        return [parse_raw_message(item) for item in items]
+
+    try:
+        chunksize = max(1, len(items) // (workers * 4))
+        return list(_get_parse_pool(workers).map(parse_raw_message, items, chunksize=chunksize))
+    except BrokenProcessPool as e:
+        logging.warning(f"MIME parsing pool failed, parsing in-process: {e}")
+        shutdown_parse_pool()
+        return [parse_raw_message(item) for item in items]
+
 class EmailClient:
-    def __init__(self):
+    def __init__(self, use_pool=True, account=None, mailbox=None):
+        """
+        Args:
+            use_pool: Borrow connections from the shared IMAP pool.
+            account: Optional dict with IMAP_SERVER, IMAP_PORT, EMAIL_ADDRESS and EMAIL_PASSWORD
+                overriding the configured account.
+            mailbox: Optional mailbox overriding IMAP_MAILBOX.
+        """
         self.mail = None
+        self.use_pool = use_pool
+        self.account = account
+        self.mailbox = mailbox
+        self._pooled = None
+        self._known_folders = set()
         self._update_logging_level()
     
     def _update_logging_level(self):
@@ -22,15 +105,36 @@ class EmailClient:
         log_level = config_manager.get('LOG_LEVEL', 'INFO')
         logging.getLogger().setLevel(getattr(logging, log_level.upper()))
 
+    def _account_setting(self, key, default=None):
+        """Read an account setting from the per-client override, falling back to config."""
+        if self.account and self.account.get(key) not in (None, ''):
+            return self.account[key]
+        return config_manager.get(key, default)
+
+    def imap_mailbox(self):
+        """The mailbox this client reads, IMAP_MAILBOX unless overridden."""
+        return self.mailbox or config_manager.get('IMAP_MAILBOX', 'INBOX')
+
     def connect(self):
-        """Connect to the IMAP server and log in."""
+        """Connect to the IMAP server and log in, borrowing a pooled connection when enabled."""
         self._update_logging_level()
+        imap_server = self._account_setting('IMAP_SERVER')
+        imap_port = int(self._account_setting('IMAP_PORT', 993))
+        email_address = self._account_setting('EMAIL_ADDRESS')
+        email_password = self._account_setting('EMAIL_PASSWORD')
+        if self.use_pool:
+            try:
+                self._pooled = imap_pool.checkout((imap_server, imap_port, email_address, email_password))
+                self.mail = self._pooled.mail
+                logging.info("Using pooled connection to the email server.")
+                return True
+            except imaplib.IMAP4.error as e:
+                logging.error(f"Could not connect to email server: {e}")
+                return False
+            except Exception as e:
+                logging.error(f"An unexpected error occurred during connection: {e}")
+                return False
         try:
-            imap_server = config_manager.get('IMAP_SERVER')
-            imap_port = config_manager.get('IMAP_PORT', 993)
-            email_address = config_manager.get('EMAIL_ADDRESS')
-            email_password = config_manager.get('EMAIL_PASSWORD')
-            
             self.mail = imaplib.IMAP4_SSL(imap_server, imap_port)
             self.mail.login(email_address, email_password)
             logging.info("Successfully connected to the email server.")
@@ -42,7 +146,8 @@ class EmailClient:
             logging.error(f"An unexpected error occurred during connection: {e}")
             return False
 
-    def _build_search_criteria(self):
+    @staticmethod
+    def _build_search_criteria():
         """Builds the IMAP search criteria based on config."""
         fetch_criteria = config_manager.get('FETCH_CRITERIA', 'UNSEEN')
         fetch_days = config_manager.get('FETCH_DAYS', 0)
@@ -56,49 +161,104 @@ class EmailClient:
         # IMAP search expects bytes
         return [c.encode('utf-8') for c in criteria]
 
-    def fetch_emails(self):
-        """Fetch emails based on configured criteria."""
+    def _select_mailbox(self, imap_mailbox):
+        """Select a mailbox, returning True on success."""
+        status, _ = self.mail.select(imap_mailbox)
+        if status != 'OK':
+            logging.error(f"Failed to select mailbox '{imap_mailbox}': {status}")
+            return False
+        return True
+
+    def select_mailbox(self):
+        """Select this client's mailbox, returning True on success."""
+        return self._select_mailbox(self.imap_mailbox())
+
+    def search_uids(self, search_criteria):
+        """Run UID SEARCH and return the matching UIDs in ascending order, or None on failure."""
+        logging.info(f"Searching for emails with criteria: {search_criteria}")
+        status, messages = self.mail.uid('SEARCH', None, *search_criteria)
+        if status != 'OK':
+            logging.error(f"Failed to search for emails: {status}")
+            return None
+        return sorted(int(uid) for uid in messages[0].split())
+
+    @staticmethod
+    def _apply_fetch_limit(email_uids, fetch_limit=None):
+        """Apply FETCH_LIMIT (or an explicit limit) to an ascending UID list, keeping the newest messages."""
+        if fetch_limit is None:
+            fetch_limit = config_manager.get('FETCH_LIMIT', 10)
+        return email_uids[-fetch_limit:] if fetch_limit > 0 else email_uids
+
+    def _fetch_and_parse(self, uids):
+        """Fetch and parse the given UIDs, returning emails newest first."""
+        if config_manager.get('FETCH_BODY_MODE', 'full') == 'structure':
+            return self._fetch_and_parse_partial(uids)
+
+        raw_messages = self._fetch_raw_messages(uids, '(UID RFC822)')
+
+        to_parse = []
+        for uid in sorted(uids, reverse=True):
+            raw_message = raw_messages.get(uid)
+            if raw_message is None:
+                logging.warning(f"Failed to fetch email UID {uid}.")
+                continue
+            to_parse.append((raw_message, str(uid)))
+        return parse_raw_messages(to_parse)
+
+    def _fetch_headers(self, uids):
+        """Fetch only the envelope headers for the given UIDs, returning emails newest first with empty bodies."""
+        responses = self._fetch_message_items(uids, f'(UID {HEADER_FIELDS_ITEM})')
+
+        fetched_emails = []
+        for uid in sorted(uids, reverse=True):
+            if uid not in responses:
+                logging.warning(f"Failed to fetch headers for email UID {uid}.")
+                continue
+            literals = self._section_literals(responses[uid])
+            header_bytes = next((value for key, value in literals.items() if key.startswith('HEADER.FIELDS')), b'')
+            parsed_email = parse_headers(email.message_from_bytes(header_bytes), str(uid))
+            parsed_email['body'] = ''
+            parsed_email['attachments'] = []
+            fetched_emails.append(parsed_email)
+        return fetched_emails
+
+    def account_key(self):
+        """Identify the account in the local message store."""
+        return f"{self._account_setting('EMAIL_ADDRESS')}@{self._account_setting('IMAP_SERVER')}"
+
+    def fetch_emails(self, headers_only=False):
+        """
+        Fetch emails based on configured criteria.
+
+        Args:
+            headers_only: Only fetch sender, subject and date; bodies are left empty
+                and can be loaded individually with fetch_email_body().
+        """
         if not self.mail:
             logging.error("Not connected to the email server.")
             return []
 
-        try:
-            imap_mailbox = config_manager.get('IMAP_MAILBOX', 'INBOX')
-            status, _ = self.mail.select(imap_mailbox)
-            if status != 'OK':
-                logging.error(f"Failed to select mailbox '{imap_mailbox}': {status}")
-                return []
+        if config_manager.get('INCREMENTAL_SYNC', False) and not headers_only:
+            return self.sync_emails()
 
-            search_criteria = self._build_search_criteria()
-            logging.info(f"Searching for emails with criteria: {search_criteria}")
-            status, messages = self.mail.search(None, *search_criteria)
-            
-            if status != 'OK':
-                logging.error(f"Failed to search for emails: {status}")
+        try:
+            imap_mailbox = self.imap_mailbox()
+            if not self._select_mailbox(imap_mailbox):
                 return []
 
-            email_ids = messages[0].split()
-            if not email_ids:
-                logging.info("No emails found matching criteria.")
+            email_uids = self.search_uids(self._build_search_criteria())
+            if not email_uids:
+                if email_uids is not None:
+                    logging.info("No emails found matching criteria.")
                 return []
             
             # Apply FETCH_LIMIT, fetching newest first
-            fetch_limit = config_manager.get('FETCH_LIMIT', 10)
-            email_ids_to_fetch = email_ids[-fetch_limit:] if fetch_limit > 0 else email_ids
-            logging.info(f"Found {len(email_ids)} emails, fetching {len(email_ids_to_fetch)}.")
+            email_uids_to_fetch = self._apply_fetch_limit(email_uids)
+            logging.info(f"Found {len(email_uids)} emails, fetching {len(email_uids_to_fetch)}.")
 
-            fetched_emails = []
-            for email_id in reversed(email_ids_to_fetch):
-                status, msg_data = self.mail.fetch(email_id, '(RFC822)')
-                if status == 'OK':
-                    for response_part in msg_data:
-                        if isinstance(response_part, tuple):
-                            msg = email.message_from_bytes(response_part[1])
-                            parsed_email = self._parse_email(msg, email_id.decode())
-                            fetched_emails.append(parsed_email)
-                else:
-                    logging.warning(f"Failed to fetch email ID {email_id.decode()}: {status}")
-            return fetched_emails
+            if headers_only:
+                return self._fetch_headers(email_uids_to_fetch)
+            return self._fetch_and_parse(email_uids_to_fetch)
         except imaplib.IMAP4.error as e:
             logging.error(f"IMAP error during email fetch: {e}")
             return []
@@ -106,116 +266,594 @@ class EmailClient:
             logging.error(f"An unexpected error occurred during email fetch: {e}")
             return []
 
-    def _parse_email(self, msg, email_id):
-        """Parse the email message into a dictionary."""
-        subject, encoding = decode_header(msg['Subject'])[0]
-        if isinstance(subject, bytes):
-            subject = subject.decode(encoding if encoding else 'utf-8', errors='ignore')
-
-        from_header = msg.get('From')
-        to_header = msg.get('To')
-        cc_header = msg.get('Cc')
-        date_header = msg.get('Date')
-        reply_to_header = msg.get('Reply-To')
-        
-        body_plain = ""
-        body_html = ""
+    def iter_emails(self, headers_only=False):
+        """
+        Yield matching emails newest first as soon as each one is parsed.
+
+        UIDs are fetched in chunks that start at one message and double up to
+        FETCH_BATCH_SIZE, so the first email arrives after a single small round trip
+        while later chunks still amortise latency. Only one chunk is held in memory.
+        """
+        if not self.mail:
+            logging.error("Not connected to the email server.")
+            return
 
-        if msg.is_multipart():
-            for part in msg.walk():
-                content_type = part.get_content_type()
-                content_disposition = str(part.get('Content-Disposition'))
+        imap_mailbox = self.imap_mailbox()
+        if not self._select_mailbox(imap_mailbox):
+            return
 
-                if 'attachment' in content_disposition:
-                    continue
+        email_uids = self.search_uids(self._build_search_criteria())
+        if not email_uids:
+            return
+        email_uids_to_fetch = sorted(self._apply_fetch_limit(email_uids), reverse=True)
+        logging.info(f"Found {len(email_uids)} emails, streaming {len(email_uids_to_fetch)}.")
+
+        max_chunk_size = config_manager.get('FETCH_BATCH_SIZE', 50)
+        if max_chunk_size <= 0:
+            max_chunk_size = len(email_uids_to_fetch)
+        chunk_size = 1
+        start = 0
+        while start < len(email_uids_to_fetch):
+            chunk = email_uids_to_fetch[start:start + chunk_size]
+            start += len(chunk)
+            chunk_size = min(chunk_size * 2, max_chunk_size)
+            if headers_only:
+                yield from self._fetch_headers(chunk)
+            else:
+                yield from self._fetch_and_parse(chunk)
+
+    def fetch_email_page(self, before_uid=None, limit=None, headers_only=False):
+        """
+        Fetch one page of matching emails, newest first, using the UID as a cursor.
+
+        Args:
+            before_uid: Only return emails with a UID lower than this; None starts at the newest.
+            limit: Page size. Defaults to FETCH_LIMIT.
+            headers_only: Leave bodies empty, as in fetch_emails().
+
+        Returns:
+            A tuple (emails, next_cursor). next_cursor is the before_uid for the following
+            page, or None when there are no older matching emails.
+        """
+        if not self.mail:
+            logging.error("Not connected to the email server.")
+            return [], None
+
+        try:
+            imap_mailbox = self.imap_mailbox()
+            if not self._select_mailbox(imap_mailbox):
+                return [], None
+
+            email_uids = self.search_uids(self._build_search_criteria())
+            if not email_uids:
+                return [], None
+            if before_uid is not None:
+                email_uids = [uid for uid in email_uids if uid < before_uid]
+
+            page_uids = self._apply_fetch_limit(email_uids, limit)
+            next_cursor = page_uids[0] if page_uids and len(page_uids) < len(email_uids) else None
+            logging.info(f"Fetching page of {len(page_uids)} emails before UID {before_uid}.")
 
-                charset = part.get_content_charset()
-                payload = part.get_payload(decode=True)
-                if not payload:
+            if headers_only:
+                return self._fetch_headers(page_uids), next_cursor
+            if not config_manager.get('INCREMENTAL_SYNC', False):
+                return self._fetch_and_parse(page_uids), next_cursor
+
+            # Pages are immutable per UID, so bodies already in the local store are reused
+            account = self.account_key()
+            self._prepare_message_cache(account, imap_mailbox)
+            cached_uids = message_store.get_cached_uids(account, imap_mailbox, page_uids)
+            missing_uids = [uid for uid in page_uids if uid not in cached_uids]
+            if missing_uids:
+                message_store.save_messages(account, imap_mailbox, self._fetch_and_parse(missing_uids))
+            return message_store.get_messages(account, imap_mailbox, sorted(page_uids, reverse=True)), next_cursor
+        except imaplib.IMAP4.error as e:
+            logging.error(f"IMAP error during email fetch: {e}")
+            return [], None
+        except Exception as e:
+            logging.error(f"An unexpected error occurred during email fetch: {e}")
+            return [], None
+
+    def fetch_email_body(self, uid):
+        """
+        Fetch and parse a single email by UID.
+
+        With INCREMENTAL_SYNC enabled the body is served from, and saved to, the local
+        message store once the mailbox's UIDVALIDITY has been checked.
+
+        Returns:
+            The parsed email dictionary, or None if it could not be fetched.
+        """
+        if not self.mail:
+            logging.error("Not connected to the email server.")
+            return None
+
+        try:
+            imap_mailbox = self.imap_mailbox()
+            if not self._select_mailbox(imap_mailbox):
+                return None
+
+            use_store = config_manager.get('INCREMENTAL_SYNC', False)
+            if use_store:
+                account = self.account_key()
+                self._prepare_message_cache(account, imap_mailbox)
+                cached = message_store.get_messages(account, imap_mailbox, [uid])
+                if cached:
+                    return cached[0]
+
+            fetched_emails = self._fetch_and_parse([uid])
+            if not fetched_emails:
+                return None
+            if use_store:
+                message_store.save_messages(account, imap_mailbox, fetched_emails)
+            return fetched_emails[0]
+        except imaplib.IMAP4.error as e:
+            logging.error(f"IMAP error fetching email UID {uid}: {e}")
+            return None
+        except Exception as e:
+            logging.error(f"An unexpected error occurred fetching email UID {uid}: {e}")
+            return None
+
+    def _enable_condstore(self):
+        """Enable CONDSTORE on the connection if the server advertises it."""
+        if 'CONDSTORE' not in self.mail.capabilities:
+            return False
+        if 'ENABLE' in self.mail.capabilities and self.mail.state == 'AUTH':
+            try:
+                self.mail.enable('CONDSTORE')
+            except imaplib.IMAP4.error as e:
+                logging.debug(f"ENABLE CONDSTORE failed, continuing without it: {e}")
+                return False
+        return True
+
+    def _validated_state(self, account, imap_mailbox, uidvalidity):
+        """
+        Return the stored sync state for the selected mailbox, discarding the local cache
+        first if the UIDVALIDITY from SELECT no longer matches it.
+
+        Returns:
+            The stored state dict, or None if there is none (or it was just discarded).
+        """
+        state = message_store.get_state(account, imap_mailbox)
+        if state and state['uidvalidity'] != uidvalidity:
+            logging.info(f"UIDVALIDITY changed for '{imap_mailbox}', discarding local cache.")
+            message_store.reset_mailbox(account, imap_mailbox)
+            state = None
+        return state
+
+    def _prepare_message_cache(self, account, imap_mailbox):
+        """
+        Validate the local store for the selected mailbox before cached messages are reused.
+
+        A mailbox without stored state gets one recording only its UIDVALIDITY, so messages
+        cached from here can be validated on later reads.
+        """
+        uidvalidity = self._untagged_int('UIDVALIDITY')
+        if self._validated_state(account, imap_mailbox, uidvalidity) is None:
+            message_store.save_state(account, imap_mailbox, {'uidvalidity': uidvalidity})
+
+    def _untagged_int(self, code):
+        """Read an integer response code (e.g. UIDVALIDITY) left over from the last SELECT."""
+        _, data = self.mail.response(code)
+        if data and data[-1] is not None:
+            try:
+                return int(data[-1])
+            except (TypeError, ValueError):
+                return None
+        return None
+
+    def uid_next(self):
+        """The UIDNEXT reported by the last SELECT, or None if the server did not send it."""
+        return self._untagged_int('UIDNEXT')
+
+    def fetch_emails_by_uid(self, uids):
+        """Fetch and parse the given UIDs of the selected mailbox, returning emails newest first."""
+        return self._fetch_and_parse(uids)
+
+    def supports_idle(self):
+        return 'IDLE' in self.mail.capabilities
+
+    def idle(self, timeout, stop_event=None):
+        """
+        Wait in IMAP IDLE (RFC 2177) until the server announces new messages.
+
+        Args:
+            timeout: Seconds after which IDLE is ended anyway; servers drop it after ~30 minutes.
+            stop_event: Optional threading.Event that ends the wait early when set.
+
+        Returns:
+            True if the server sent an EXISTS response, False when the timeout expired or
+            stop_event was set.
+        """
+        mail = self.mail
+        tag = mail._new_tag()
+        mail.send(tag + b' IDLE\r\n')
+
+        # Until DONE, bytes are taken with read1(), which hands over everything imaplib's
+        # reader has buffered, so select() never waits for data that was already received
+        buffer = b''
+        idling = False
+        has_new_mail = False
+        deadline = time.monotonic() + timeout
+        try:
+            while not (idling and (has_new_mail or (stop_event and stop_event.is_set()))):
+                if b'\n' in buffer:
+                    line, buffer = buffer.split(b'\n', 1)
+                    if line.startswith(b'+'):
+                        idling = True
+                    elif line.startswith(tag):
+                        raise imaplib.IMAP4.error(f"IDLE rejected: {line!r}")
+                    elif EXISTS_PATTERN.match(line):
+                        has_new_mail = True
                     continue
-                
-                try:
-                    decoded_payload = payload.decode(charset if charset else 'utf-8', errors='ignore')
-                except (LookupError, UnicodeDecodeError):
-                    decoded_payload = payload.decode('latin-1', errors='ignore') # Fallback encoding
-
-                if content_type == 'text/plain' and not body_plain:
-                    body_plain = decoded_payload
-                elif content_type == 'text/html' and not body_html:
-                    body_html = decoded_payload
-        else:
-            # Not a multipart message, just get the payload
-            charset = msg.get_content_charset()
-            payload = msg.get_payload(decode=True)
+                if idling:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    # Bytes already decrypted by SSL are not visible to select() either
+                    if not getattr(mail.sock, 'pending', lambda: 0)():
+                        readable, _, _ = select.select([mail.sock], [], [], min(remaining, 1.0))
+                        if not readable:
+                            continue
+                data = mail.file.read1(65536)
+                if not data:
+                    raise imaplib.IMAP4.abort("Connection closed during IDLE.")
+                buffer += data
+        finally:
+            if idling:
+                mail.send(b'DONE\r\n')
+                # Read up to and including the tagged completion of IDLE
+                while not (buffer.startswith(tag) and b'\n' in buffer):
+                    if b'\n' in buffer and not buffer.startswith(tag):
+                        buffer = buffer.split(b'\n', 1)[1]
+                        continue
+                    line = mail.readline()
+                    if not line:
+                        raise imaplib.IMAP4.abort("Connection closed while ending IDLE.")
+                    buffer += line
+        return has_new_mail
+
+    def sync_emails(self):
+        """
+        Incrementally sync the configured mailbox against the local message store.
+
+        UIDVALIDITY, UIDNEXT and (with CONDSTORE) HIGHESTMODSEQ from SELECT decide whether
+        the mailbox changed since the last sync. If nothing changed the cached result is
+        served without a SEARCH; otherwise only messages missing from the store are fetched.
+
+        Returns:
+            The matching emails, newest first, in the same shape as fetch_emails().
+        """
+        if not self.mail:
+            logging.error("Not connected to the email server.")
+            return []
+
+        try:
+            imap_mailbox = self.imap_mailbox()
+            account = self.account_key()
+            condstore = self._enable_condstore()
+            if not self._select_mailbox(imap_mailbox):
+                return []
+
+            uidvalidity = self._untagged_int('UIDVALIDITY')
+            uidnext = self._untagged_int('UIDNEXT')
+            highest_modseq = self._untagged_int('HIGHESTMODSEQ') if condstore else None
+
+            search_criteria = self._build_search_criteria()
+            criteria_key = b' '.join(search_criteria).decode('utf-8')
+
+            state = self._validated_state(account, imap_mailbox, uidvalidity)
+
+            unchanged = (
+                state is not None
+                and highest_modseq is not None
+                and uidnext is not None
+                and state['criteria'] == criteria_key
+                and state['uidnext'] == uidnext
+                and state['highest_modseq'] == highest_modseq
+            )
+
+            if unchanged:
+                email_uids = state['matching_uids']
+                logging.info(f"Mailbox '{imap_mailbox}' unchanged since last sync, serving {len(email_uids)} cached emails.")
+            else:
+                email_uids = self.search_uids(search_criteria)
+                if email_uids is None:
+                    return []
+
+            email_uids_to_return = self._apply_fetch_limit(email_uids)
+            cached_uids = message_store.get_cached_uids(account, imap_mailbox, email_uids_to_return)
+            missing_uids = [uid for uid in email_uids_to_return if uid not in cached_uids]
+            if missing_uids:
+                logging.info(f"Fetching {len(missing_uids)} new emails, {len(cached_uids)} served from local store.")
+                message_store.save_messages(account, imap_mailbox, self._fetch_and_parse(missing_uids))
+
+            message_store.save_state(account, imap_mailbox, {
+                'uidvalidity': uidvalidity,
+                'uidnext': uidnext,
+                'last_uid': max(email_uids) if email_uids else (state or {}).get('last_uid'),
+                'highest_modseq': highest_modseq,
+                'criteria': criteria_key,
+                'matching_uids': email_uids,
+            })
+
+            return message_store.get_messages(account, imap_mailbox, sorted(email_uids_to_return, reverse=True))
+        except imaplib.IMAP4.error as e:
+            logging.error(f"IMAP error during email sync: {e}")
+            return []
+        except Exception as e:
+            logging.error(f"An unexpected error occurred during email sync: {e}")
+            return []
+
+    @staticmethod
+    def _build_uid_sequence_set(uids):
+        """Compress a list of UIDs into an IMAP sequence set, e.g. [101, 102, 103, 163] -> '101:103,163'."""
+        ranges = []
+        for uid in sorted(set(uids)):
+            if ranges and uid == ranges[-1][1] + 1:
+                ranges[-1][1] = uid
+            else:
+                ranges.append([uid, uid])
+        return ','.join(str(start) if start == end else f"{start}:{end}" for start, end in ranges)
+
+    @staticmethod
+    def _split_fetch_response(msg_data):
+        """
+        Split a multi-message UID FETCH response into per-message records.
+
+        Returns:
+            A dict mapping each UID to the imaplib response items belonging to it.
+        """
+        groups = []
+        for response_part in msg_data:
+            head = response_part[0] if isinstance(response_part, tuple) else response_part
+            if not head:
+                continue
+            if FETCH_START_PATTERN.match(head) or not groups:
+                groups.append([])
+            groups[-1].append(response_part)
+
+        records = {}
+        for items in groups:
+            # The UID item may come before or after any literal in the response
+            envelope = b' '.join(item[0] if isinstance(item, tuple) else item for item in items)
+            uid_match = UID_PATTERN.search(envelope)
+            if uid_match:
+                records[int(uid_match.group(1))] = items
+        return records
+
+    @staticmethod
+    def _section_literals(items):
+        """Map each BODY[section] in one message's response items to its literal bytes."""
+        literals = {}
+        for item in items:
+            if isinstance(item, tuple):
+                section_match = SECTION_PATTERN.search(item[0])
+                if section_match:
+                    literals[section_match.group(1).decode('utf-8', errors='ignore').upper()] = item[1]
+        return literals
+
+    def _fetch_message_items(self, uids, message_parts):
+        """
+        Run one UID FETCH per FETCH_BATCH_SIZE chunk of uids.
+
+        Returns:
+            A dict mapping each UID to its imaplib response items.
+        """
+        chunk_size = config_manager.get('FETCH_BATCH_SIZE', 50)
+        if chunk_size <= 0:
+            chunk_size = len(uids) or 1
+
+        records = {}
+        for start in range(0, len(uids), chunk_size):
+            sequence_set = self._build_uid_sequence_set(uids[start:start + chunk_size])
+            status, msg_data = self.mail.uid('FETCH', sequence_set, message_parts)
+            if status != 'OK':
+                logging.warning(f"Failed to fetch UIDs {sequence_set}: {status}")
+                continue
+            records.update(self._split_fetch_response(msg_data))
+        return records
+
+    def _fetch_raw_messages(self, uids, message_parts):
+        """
+        Fetch message data for the given UIDs with one UID FETCH per chunk.
+
+        Args:
+            uids: The UIDs to fetch.
+            message_parts: The FETCH data items, e.g. '(UID RFC822)'.
+
+        Returns:
+            A dict mapping each UID to its fetched bytes.
+        """
+        raw_messages = {}
+        for uid, items in self._fetch_message_items(uids, message_parts).items():
+            literal = next((item[1] for item in items if isinstance(item, tuple)), None)
+            if literal is not None:
+                raw_messages[uid] = literal
+        return raw_messages
+
+    @staticmethod
+    def _decode_part(payload, part):
+        """Undo the transfer encoding of a fetched section and decode it to text."""
+        if part.encoding == 'base64':
+            compact = re.sub(rb'\s+', b'', payload)
+            # A byte-capped partial fetch can end mid-quantum
+            compact = compact[:len(compact) - len(compact) % 4]
             try:
-                body_plain = payload.decode(charset if charset else 'utf-8', errors='ignore')
-            except (LookupError, UnicodeDecodeError):
-                body_plain = payload.decode('latin-1', errors='ignore')
+                payload = base64.b64decode(compact)
+            except binascii.Error:
+                payload = b''
+        elif part.encoding == 'quoted-printable':
+            payload = quopri.decodestring(payload)
 
-        # Prioritize HTML, but fall back to plain text for a GUI client
-        body = body_html.strip() if body_html else body_plain.strip()
-        
-        return {
-            'id': email_id,
-            'from': from_header,
-            'to': to_header,
-            'cc': cc_header,
-            'date': date_header,
-            'reply_to': reply_to_header,
-            'subject': subject,
-            'body': body
-        }
+        try:
+            return payload.decode(part.charset if part.charset else 'utf-8', errors='ignore')
+        except (LookupError, UnicodeDecodeError):
+            return payload.decode('latin-1', errors='ignore')
+
+    def _fetch_and_parse_partial(self, uids):
+        """
+        Fetch BODYSTRUCTURE and headers first, then only the text/plain and text/html sections.
+
+        Attachments are never downloaded; their name, size and type come from BODYSTRUCTURE.
+        Sections are capped at FETCH_PART_MAX_BYTES when it is set.
+
+        Returns:
+            Emails newest first, in the same shape as parse_email().
+        """
+        structures = self._fetch_message_items(uids, f'(UID BODYSTRUCTURE {HEADER_FIELDS_ITEM})')
+
+        records = {}
+        for uid, items in structures.items():
+            literals = self._section_literals(items)
+            header_bytes = next((value for key, value in literals.items() if key.startswith('HEADER.FIELDS')), b'')
+            parsed_email = parse_headers(email.message_from_bytes(header_bytes), str(uid))
+
+            text_parts = {}
+            attachments = []
+            for part in parse_bodystructure(items):
+                if part.is_attachment:
+                    attachments.append({'name': part.filename, 'size': part.size, 'type': part.content_type})
+                elif part.content_type in ('text/plain', 'text/html') and part.content_type not in text_parts:
+                    text_parts[part.content_type] = part
+            parsed_email['attachments'] = attachments
+            records[uid] = (parsed_email, text_parts)
+
+        # Messages that need the same sections share a single UID FETCH
+        max_bytes = config_manager.get('FETCH_PART_MAX_BYTES', 0)
+        partial = f'<0.{max_bytes}>' if max_bytes > 0 else ''
+        groups = {}
+        for uid, (_, text_parts) in records.items():
+            sections = tuple(sorted(part.section for part in text_parts.values()))
+            if sections:
+                groups.setdefault(sections, []).append(uid)
+
+        bodies = {}
+        for sections, group_uids in groups.items():
+            section_items = ' '.join(f'BODY.PEEK[{section}]{partial}' for section in sections)
+            for uid, items in self._fetch_message_items(group_uids, f'(UID {section_items})').items():
+                bodies[uid] = self._section_literals(items)
+
+        fetched_emails = []
+        for uid in sorted(uids, reverse=True):
+            if uid not in records:
+                logging.warning(f"Failed to fetch email UID {uid}.")
+                continue
+            parsed_email, text_parts = records[uid]
+            sections = bodies.get(uid, {})
+            decoded = {
+                content_type: self._decode_part(sections.get(part.section, b''), part)
+                for content_type, part in text_parts.items()
+            }
+            body_html = decoded.get('text/html', '')
+            body_plain = decoded.get('text/plain', '')
+            parsed_email['body'] = body_html.strip() if body_html else body_plain.strip()
+            parsed_email['body_text'] = clean_email_text(body_html, body_plain)
+            fetched_emails.append(parsed_email)
+        return fetched_emails
 
     def mark_email_as_read(self, email_id):
         """Marks an email as read (seen)."""
+        self.mark_emails_as_read([email_id])
+
+    def mark_emails_as_read(self, email_ids):
+        """Marks a set of emails as read (seen) with a single UID STORE."""
         if not self.mail:
             logging.error("Not connected to the email server.")
             return
+        if not email_ids:
+            return
+        sequence_set = self._build_uid_sequence_set(int(email_id) for email_id in email_ids)
         try:
-            status, _ = self.mail.store(email_id, '+FLAGS', '\Seen')
+            status, _ = self.mail.uid('STORE', sequence_set, '+FLAGS.SILENT', '(\\Seen)')
             if status == 'OK':
-                logging.info(f"Email ID {email_id} marked as read.")
+                logging.info(f"Email ID(s) {sequence_set} marked as read.")
             else:
-                logging.warning(f"Failed to mark email ID {email_id} as read: {status}")
+                logging.warning(f"Failed to mark email ID(s) {sequence_set} as read: {status}")
         except imaplib.IMAP4.error as e:
-            logging.error(f"IMAP error marking email {email_id} as read: {e}")
+            logging.error(f"IMAP error marking email(s) {sequence_set} as read: {e}")
+
+    def _ensure_folder(self, folder_name):
+        """Create the folder if it does not exist. Results are cached for the lifetime of this client."""
+        if folder_name in self._known_folders:
+            return True
+        status, folders = self.mail.list('', folder_name)
+        if not any(isinstance(f, bytes) and folder_name.encode() in f for f in folders or []):
+            logging.info(f"Folder '{folder_name}' does not exist. Creating...")
+            status, _ = self.mail.create(folder_name)
+            if status != 'OK':
+                logging.error(f"Failed to create folder '{folder_name}': {status}")
+                return False
+            logging.info(f"Folder '{folder_name}' created successfully.")
+        self._known_folders.add(folder_name)
+        return True
 
     def move_email_to_folder(self, email_id, folder_name):
         """Moves an email to a specified folder."""
+        self.move_emails_to_folder([email_id], folder_name)
+
+    def move_emails_to_folder(self, email_ids, folder_name):
+        """
+        Moves a set of emails to a specified folder.
+
+        Uses a single UID MOVE when the server supports it, otherwise one UID COPY,
+        one UID STORE +FLAGS (\\Deleted) and one expunge (UID EXPUNGE with UIDPLUS,
+        so other messages already flagged for deletion are left alone).
+        """
         if not self.mail:
             logging.error("Not connected to the email server.")
             return
+        if not email_ids:
+            return
+        sequence_set = self._build_uid_sequence_set(int(email_id) for email_id in email_ids)
         try:
-            # Check if folder exists, create if not
-            status, _ = self.mail.list('', folder_name)
-            if not any(folder_name.encode() in f for f in _):
-                logging.info(f"Folder '{folder_name}' does not exist. Creating...")
-                status, _ = self.mail.create(folder_name)
-                if status != 'OK':
-                    logging.error(f"Failed to create folder '{folder_name}': {status}")
-                    return
-                logging.info(f"Folder '{folder_name}' created successfully.")
-
-            # Copy email to new folder
-            status, _ = self.mail.copy(email_id, folder_name)
-            if status == 'OK':
-                logging.info(f"Email ID {email_id} copied to '{folder_name}'.")
-                # Mark original for deletion and expunge
-                status, _ = self.mail.store(email_id, '+FLAGS', '\Deleted')
+            if not self._ensure_folder(folder_name):
+                return
+
+            if 'MOVE' in self.mail.capabilities:
+                status, _ = self.mail.uid('MOVE', sequence_set, folder_name)
                 if status == 'OK':
-                    self.mail.expunge()
-                    logging.info(f"Original email ID {email_id} deleted.")
+                    logging.info(f"Email ID(s) {sequence_set} moved to '{folder_name}'.")
                 else:
-                    logging.warning(f"Failed to mark original email ID {email_id} for deletion: {status}")
+                    logging.warning(f"Failed to move email ID(s) {sequence_set} to '{folder_name}': {status}")
+                return
+
+            # Copy emails to new folder
+            status, _ = self.mail.uid('COPY', sequence_set, folder_name)
+            if status != 'OK':
+                logging.warning(f"Failed to copy email ID(s) {sequence_set} to '{folder_name}': {status}")
+                return
+            logging.info(f"Email ID(s) {sequence_set} copied to '{folder_name}'.")
+
+            # Mark originals for deletion and expunge once
+            status, _ = self.mail.uid('STORE', sequence_set, '+FLAGS.SILENT', '(\\Deleted)')
+            if status != 'OK':
+                logging.warning(f"Failed to mark original email ID(s) {sequence_set} for deletion: {status}")
+                return
+            if 'UIDPLUS' in self.mail.capabilities:
+                self.mail.uid('EXPUNGE', sequence_set)
             else:
-                logging.warning(f"Failed to copy email ID {email_id} to '{folder_name}': {status}")
+                self.mail.expunge()
+            logging.info(f"Original email ID(s) {sequence_set} deleted.")
         except imaplib.IMAP4.error as e:
-            logging.error(f"IMAP error moving email {email_id} to {folder_name}: {e}")
+            logging.error(f"IMAP error moving email(s) {sequence_set} to {folder_name}: {e}")
         except Exception as e:
-            logging.error(f"An unexpected error occurred moving email {email_id}: {e}")
+            logging.error(f"An unexpected error occurred moving email(s) {sequence_set}: {e}")
 
     def close(self):
-        """Close the connection to the IMAP server."""
+        """Close the connection to the IMAP server, or return it to the pool."""
+        if self._pooled:
+            discard = False
+            try:
+                if self.mail.state == 'SELECTED':
+                    self.mail.close()
+            except (imaplib.IMAP4.error, OSError) as e:
+                logging.warning(f"Dropping pooled connection after error on close: {e}")
+                discard = True
+            imap_pool.checkin(self._pooled, discard=discard)
+            self._pooled = None
+            self.mail = None
+            return
         if self.mail:
             try:
                 self.mail.close()
@@ -0,0 +1,168 @@
+"""
+Concurrent fetching across several accounts and mailboxes.
+"""
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from config_manager import config_manager
+from email_client import EmailClient
+
+
+DEFAULT_SOURCE_NAME = 'default'
+
+
+def _split_mailboxes(value):
+    if isinstance(value, list):
+        mailboxes = [mailbox for mailbox in value if mailbox]
+    else:
+        mailboxes = [mailbox.strip() for mailbox in (value or '').split(',') if mailbox.strip()]
+    return list(dict.fromkeys(mailboxes))
+
+
+def get_mail_sources():
+    """
+    Build the list of (account, mailbox) sources to fetch from.
+
+    The configured account contributes IMAP_MAILBOXES (or IMAP_MAILBOX when unset).
+    Additional accounts are read from the JSON file at IMAP_ACCOUNTS_FILE, a list of
+    objects with NAME, IMAP_SERVER, IMAP_PORT, EMAIL_ADDRESS, EMAIL_PASSWORD and
+    IMAP_MAILBOXES keys.
+
+    Source names end up in the ids of fetched emails, so they must be stable and
+    unique: the configured account is named after EMAIL_ADDRESS (or 'default'), and an
+    additional account without a NAME or EMAIL_ADDRESS, or whose name is already
+    taken, is logged and skipped.
+
+    Returns:
+        A list of dicts with 'name', 'account' and 'mailbox' keys.
+    """
+    primary_name = config_manager.get('EMAIL_ADDRESS') or DEFAULT_SOURCE_NAME
+    primary_mailboxes = _split_mailboxes(config_manager.get('IMAP_MAILBOXES')) or [config_manager.get('IMAP_MAILBOX', 'INBOX')]
+    sources = [
+        {'name': primary_name, 'account': None, 'mailbox': mailbox}
+        for mailbox in primary_mailboxes
+    ]
+    names = {primary_name}
+
+    accounts_file = config_manager.get('IMAP_ACCOUNTS_FILE')
+    if accounts_file:
+        if not os.path.isabs(accounts_file):
+            accounts_file = os.path.join(os.path.dirname(__file__), accounts_file)
+        try:
+            with open(accounts_file, 'r', encoding='utf-8') as f:
+                extra_accounts = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logging.error(f"Could not read IMAP_ACCOUNTS_FILE '{accounts_file}': {e}")
+            extra_accounts = []
+
+        for account in extra_accounts:
+            mailboxes = _split_mailboxes(account.get('IMAP_MAILBOXES')) or ['INBOX']
+            name = account.get('NAME') or account.get('EMAIL_ADDRESS')
+            if not name:
+                logging.error("Skipping an account in IMAP_ACCOUNTS_FILE without NAME or EMAIL_ADDRESS.")
+                continue
+            if name in names:
+                logging.error(f"Skipping account '{name}' in IMAP_ACCOUNTS_FILE: the name is already used by another account.")
+                continue
+            names.add(name)
+            for mailbox in mailboxes:
+                sources.append({'name': name, 'account': account, 'mailbox': mailbox})
+    return sources
+
+
+def _email_timestamp(email_data):
+    """Sort key for merged results; undated emails go last."""
+    try:
+        parsed = parsedate_to_datetime(email_data.get('date') or '')
+    except (TypeError, ValueError, IndexError):
+        return datetime.min.replace(tzinfo=timezone.utc)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def _source_label(source):
+    return f"{source['name']}/{source['mailbox']}"
+
+
+def _tag_with_source(email_data, source):
+    # UIDs are only unique within one mailbox, so merged ids carry their source
+    label = _source_label(source)
+    email_data['id'] = f"{label}:{email_data['id']}"
+    email_data['source'] = label
+    return email_data
+
+
+def _fetch_source(source, headers_only):
+    client = EmailClient(account=source['account'], mailbox=source['mailbox'])
+    if not client.connect():
+        logging.error(f"Could not connect to email server for source {_source_label(source)}.")
+        return []
+    try:
+        emails = client.fetch_emails(headers_only=headers_only)
+    finally:
+        client.close()
+
+    return [_tag_with_source(email_data, source) for email_data in emails]
+
+
+def fetch_source_email_body(email_id):
+    """
+    Fetch one email body by the id fetch_all_sources gave it.
+
+    Args:
+        email_id: An id of the form '<account>/<mailbox>:<uid>'.
+
+    Returns:
+        The parsed email with the same namespaced id, or None if the source or
+        message does not exist.
+
+    Raises:
+        ConnectionError: If the source's server could not be reached.
+    """
+    label, _, uid = email_id.rpartition(':')
+    if not uid.isdigit():
+        return None
+    source = next((source for source in get_mail_sources() if _source_label(source) == label), None)
+    if source is None:
+        return None
+
+    client = EmailClient(account=source['account'], mailbox=source['mailbox'])
+    if not client.connect():
+        raise ConnectionError(f"Could not connect to email server for source {label}.")
+    try:
+        email_data = client.fetch_email_body(int(uid))
+    finally:
+        client.close()
+    return _tag_with_source(email_data, source) if email_data else None
+
+
+def fetch_all_sources(headers_only=False):
+    """
+    Fetch from every configured account and mailbox concurrently.
+
+    At most FETCH_WORKERS sources are fetched at once. A failing source is logged
+    and skipped so it cannot block the others.
+
+    Returns:
+        All emails merged newest first by Date header, each tagged with a 'source' of
+        the form '<account>/<mailbox>' and an id of the form '<account>/<mailbox>:<uid>'.
+    """
+    sources = get_mail_sources()
+    max_workers = max(1, min(config_manager.get('FETCH_WORKERS', 4), len(sources)))
+
+    merged = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [(source, executor.submit(_fetch_source, source, headers_only)) for source in sources]
+        for source, future in futures:
+            try:
+                merged.extend(future.result())
+            except Exception as e:
+                logging.error(f"Failed to fetch from {_source_label(source)}: {e}")
+
+    merged.sort(key=_email_timestamp, reverse=True)
+    return merged
@@ -1,5 +1,5 @@
 import React, { useState, useEffect } from 'react';
-import { batchSummarizeWithEmails, comprehensiveAnalyzeEmail } from './api';
+import { createBatchSummaryJob, followBatchSummaryJob, comprehensiveAnalyzeEmail, getEmailBody } from './api';
 import { EXPORT_FORMATS, exportReport } from './exportUtils';
 import { batchSummaryCache, analyzedEmailsCache, calendarEventsCache, initializeCache } from './services/cacheService';
 import './App.css'; // Reuse existing styles
@@ -17,6 +17,7 @@ const BatchSummaryReport = ({
 }) => {
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
+  const [jobProgress, setJobProgress] = useState(null);
   const [showExportModal, setShowExportModal] = useState(false);
   const [exportLoading, setExportLoading] = useState(false);
 
@@ -75,8 +76,13 @@ const BatchSummaryReport = ({
       let analyzed = analyzedEmails;
       
       if (analyzedEmails.length === 0 || analyzedEmails.length !== emails.length) {
+        // The inbox list only holds headers, so load the bodies the analysis needs
+        const emailsWithBodies = await Promise.all(emails.map(email => (
+          email.body ? email : getEmailBody(email.id).catch(() => email)
+        )));
+
         // First, analyze all emails for priority and calendar information
-        const emailAnalysisPromises = emails.map(async (email) => {
+        const emailAnalysisPromises = emailsWithBodies.map(async (email) => {
           try {
             const analysis = await comprehensiveAnalyzeEmail(email.subject, email.body, email.from);
             return {
@@ -133,7 +139,12 @@ const BatchSummaryReport = ({
       console.log(`Extracted and cached ${allEvents.length} calendar events`);
       
       // Generate enhanced batch summary report with priority and calendar data
-      const data = await batchSummarizeWithEmails(sortedEmails);
+      // The report runs as a server-side job, so no request is held open while it is written
+      const job = await createBatchSummaryJob(sortedEmails);
+      setJobProgress({ completed: job.completed, total: job.total, status: job.status });
+      const data = await followBatchSummaryJob(job.id, (progress) => {
+        setJobProgress({ completed: progress.completed, total: progress.total, status: progress.status });
+      });
       
       // Handle the new data structure with calendar_summary
       if (data.calendar_summary) {
@@ -184,6 +195,7 @@ const BatchSummaryReport = ({
       setError(err.message);
     } finally {
       setLoading(false);
+      setJobProgress(null);
     }
   };
 
@@ -245,7 +257,10 @@ const BatchSummaryReport = ({
           {error && <p className="error-message">Error: {error}</p>}
           
           {loading && !report && (
-            <p>Generating batch summary report...</p>
+            <p>
+              Generating batch summary report...
+              {jobProgress?.total ? ` (${jobProgress.completed}/${jobProgress.total} emails analyzed)` : ''}
+            </p>
           )}
           
           {emails.length === 0 && !loading && !report && (
@@ -22,8 +22,9 @@ export const saveConfiguration = async (config) => {
   return response.json();
 };
 
-export const getEmails = async () => {
-  const response = await fetch(`${API_BASE_URL}/api/emails`);
+export const getEmails = async (headersOnly = false) => {
+  const query = headersOnly ? '?headers_only=true' : '';
+  const response = await fetch(`${API_BASE_URL}/api/emails${query}`);
   if (!response.ok) {
     const error = await response.json();
     throw new Error(error.detail || 'Failed to fetch emails');
@@ -31,6 +32,16 @@ export const getEmails = async () => {
   return response.json();
 };
 
+// emailId is a UID, or an '<account>/<mailbox>:<uid>' id from /api/emails/all
+export const getEmailBody = async (emailId) => {
+  const response = await fetch(`${API_BASE_URL}/api/emails/${encodeURIComponent(emailId)}/body`);
+  if (!response.ok) {
+    const error = await response.json();
+    throw new Error(error.detail || 'Failed to fetch email body');
+  }
+  return response.json();
+};
+
 export const summarizeEmail = async (subject, body) => {
     const response = await fetch(`${API_BASE_URL}/api/analyze/summarize`, {
         method: 'POST',
@@ -46,6 +57,59 @@ export const summarizeEmail = async (subject, body) => {
     return response.json();
 };
 
+// Reads a Server-Sent Events response, calling onEvent(eventName, payload) for each event.
+const readServerSentEvents = async (response, onEvent) => {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        for (const rawEvent of events) {
+            let eventName = 'message';
+            let data = '';
+            for (const line of rawEvent.split('\n')) {
+                if (line.startsWith('event: ')) eventName = line.slice(7);
+                else if (line.startsWith('data: ')) data += line.slice(6);
+            }
+            if (data) onEvent(eventName, JSON.parse(data));
+        }
+    }
+};
+
+// Streams a summary as it is generated. onDelta receives the summary text so far;
+// pass an AbortSignal to stop the request (the server then stops generating).
+export const summarizeEmailStream = async (subject, body, onDelta, signal) => {
+    const response = await fetch(`${API_BASE_URL}/api/analyze/summarize/stream`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ subject, body }),
+        signal,
+    });
+    if (!response.ok) {
+        const error = await response.json();
+        throw new Error(error.detail || 'Failed to get summary');
+    }
+
+    let summary = '';
+    let result = null;
+    await readServerSentEvents(response, (eventName, payload) => {
+        if (eventName === 'error') throw new Error(payload.error || 'Failed to get summary');
+        if (eventName === 'end') {
+            result = { summary: payload.summary };
+            return;
+        }
+        summary += payload.delta;
+        onDelta(summary);
+    });
+    return result || { summary };
+};
+
 export const batchSummarizeEmails = async () => {
     const response = await fetch(`${API_BASE_URL}/api/batch-summarize`, {
         method: 'POST',
@@ -91,6 +155,85 @@ export const batchSummarizeWithEmails = async (emails) => {
     return response.json();
 };
 
+// Streams a batch report: onCategory is called with each category as soon as it is ready,
+// and the promise resolves with the complete report.
+export const batchSummarizeWithEmailsStream = async (emails, onCategory) => {
+    const response = await fetch(`${API_BASE_URL}/api/batch-summarize-with-data/stream`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ emails }),
+    });
+    if (!response.ok) {
+        let errorDetail = 'Failed to get batch summary';
+        try {
+            const error = await response.json();
+            errorDetail = error.detail || errorDetail;
+        } catch (e) {
+            errorDetail = response.statusText || errorDetail;
+        }
+        throw new Error(errorDetail);
+    }
+
+    const categories = [];
+    let report = null;
+    await readServerSentEvents(response, (eventName, payload) => {
+        if (eventName === 'error') throw new Error(payload.error || 'Failed to get batch summary');
+        if (eventName === 'end') {
+            report = payload;
+            return;
+        }
+        categories.push(payload);
+        onCategory(payload);
+    });
+    return report || { categories };
+};
+
+// Queues a batch report as a background job on the server and returns the job.
+export const createBatchSummaryJob = async (emails) => {
+    const response = await fetch(`${API_BASE_URL}/api/batch-summarize-with-data/jobs`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ emails }),
+    });
+    if (!response.ok) {
+        let errorDetail = 'Failed to start batch summary';
+        try {
+            const error = await response.json();
+            errorDetail = error.detail || errorDetail;
+        } catch (e) {
+            errorDetail = response.statusText || errorDetail;
+        }
+        throw new Error(errorDetail);
+    }
+    return response.json();
+};
+
+// Follows a batch job until it finishes. onProgress receives each progress update
+// ({ status, completed, total, entries }) and the promise resolves with the report.
+// The job keeps running on the server if the page is closed; follow it again by id.
+export const followBatchSummaryJob = (jobId, onProgress) => new Promise((resolve, reject) => {
+    const source = new EventSource(`${API_BASE_URL}/api/batch-summarize/jobs/${jobId}/events`);
+    source.addEventListener('progress', (event) => onProgress(JSON.parse(event.data)));
+    source.addEventListener('end', (event) => {
+        source.close();
+        resolve(JSON.parse(event.data));
+    });
+    source.addEventListener('error', (event) => {
+        // Server-sent error events carry data; connection failures do not, and
+        // EventSource reconnects by itself unless the server refused the stream
+        if (!event.data && source.readyState !== EventSource.CLOSED) {
+            return;
+        }
+        source.close();
+        const payload = event.data ? JSON.parse(event.data) : {};
+        reject(new Error(payload.error || 'Lost connection to the batch summary job'));
+    });
+});
+
 export const comprehensiveAnalyzeEmail = async (subject, body, fromAddr) => {
     const response = await fetch(`${API_BASE_URL}/api/analyze/comprehensive`, {
         method: 'POST',
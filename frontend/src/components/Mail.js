@@ -1,5 +1,5 @@
 import React, { useState, useEffect, useCallback, useLayoutEffect, useRef } from 'react';
-import { getEmails, summarizeEmail, comprehensiveAnalyzeEmail } from '../api';
+import { getEmails, getEmailBody, summarizeEmailStream, comprehensiveAnalyzeEmail } from '../api';
 import { emailCache, initializeCache } from '../services/cacheService';
 
 const Mail = ({ 
@@ -57,7 +57,8 @@ const Mail = ({
     setAnalysisResult('');
     
     try {
-      const data = await getEmails();
+      // 列表只取邮件头，正文在选中邮件时加载
+      const data = await getEmails(true);
       setEmails(data);
       setMessage('Emails fetched successfully.');
       
@@ -70,15 +71,35 @@ const Mail = ({
     }
   };
 
-  const handleSelectEmail = (email) => {
+  // The most recently clicked email, so a slow body load cannot replace a later selection
+  const latestSelectionRef = useRef(null);
+
+  const handleSelectEmail = async (email) => {
+    latestSelectionRef.current = email.id;
     setSelectedEmail(email);
     setAnalysisResult(''); // Clear previous analysis
     setError('');
+
+    // 列表只包含邮件头时，按需加载正文
+    if (!email.body) {
+      try {
+        const fullEmail = await getEmailBody(email.id);
+        setEmails(prevEmails => prevEmails.map(e => (e.id === fullEmail.id ? fullEmail : e)));
+        if (latestSelectionRef.current === email.id) {
+          setSelectedEmail(fullEmail);
+        }
+      } catch (err) {
+        if (latestSelectionRef.current === email.id) {
+          setError(err.message);
+        }
+      }
+    }
   };
 
   // 使用useCallback来优化分析函数
   const analyzeEmail = useCallback(async (email) => {
-    if (!email || emailAnalysisCache[email.id]) return;
+    // Headers-only emails are analyzed once their body has loaded
+    if (!email || !email.body || emailAnalysisCache[email.id]) return;
     
     try {
       const data = await comprehensiveAnalyzeEmail(email.subject, email.body, email.from);
@@ -101,15 +122,37 @@ const Mail = ({
     }
   }, [selectedEmail, analyzeEmail]);
 
+  // 切换邮件或离开页面时取消正在生成的摘要
+  const summaryAbortRef = useRef(null);
+  const selectedEmailId = selectedEmail?.id;
+  useEffect(() => {
+    if (summaryAbortRef.current) {
+      summaryAbortRef.current.abort();
+      summaryAbortRef.current = null;
+      setIsAnalyzing(false);
+    }
+  }, [selectedEmailId]);
+  useEffect(() => () => summaryAbortRef.current && summaryAbortRef.current.abort(), []);
+
   const handleSummarize = () => {
     if (!selectedEmail) return;
+    if (summaryAbortRef.current) summaryAbortRef.current.abort();
+    const controller = new AbortController();
+    summaryAbortRef.current = controller;
     setIsAnalyzing(true);
     setError(null);
     setAnalysisResult('');
-    summarizeEmail(selectedEmail.subject, selectedEmail.body)
+    summarizeEmailStream(selectedEmail.subject, selectedEmail.body, setAnalysisResult, controller.signal)
       .then(data => setAnalysisResult(data.summary))
-      .catch(err => setError(err.message))
-      .finally(() => setIsAnalyzing(false));
+      .catch(err => {
+        if (err.name !== 'AbortError') setError(err.message);
+      })
+      .finally(() => {
+        if (summaryAbortRef.current === controller) {
+          summaryAbortRef.current = null;
+          setIsAnalyzing(false);
+        }
+      });
   };
 
   return (
@@ -0,0 +1,201 @@
+"""
+Pool of long-lived IMAP connections shared across EmailClient instances.
+"""
+import imaplib
+import logging
+import threading
+import time
+
+from config_manager import config_manager
+
+
+class PooledConnection:
+    """An authenticated IMAP connection together with its pool bookkeeping."""
+
+    def __init__(self, key, mail):
+        self.key = key
+        self.mail = mail
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+    def is_alive(self):
+        """Check the connection with a NOOP; returns False if the socket is stale."""
+        try:
+            status, _ = self.mail.noop()
+            return status == 'OK'
+        except (imaplib.IMAP4.error, OSError):
+            return False
+
+    def logout(self):
+        """Log out and drop the socket, ignoring errors from dead connections."""
+        try:
+            self.mail.logout()
+        except (imaplib.IMAP4.error, OSError):
+            pass
+
+
+class IMAPConnectionPool:
+    """
+    Thread-safe pool of IMAP connections keyed by (server, port, account).
+
+    Connections are checked out for the duration of a request and checked back in
+    afterwards instead of being logged out. Idle connections are kept alive with
+    NOOP and health-checked before reuse, and stale sockets are replaced transparently.
+    """
+
+    def __init__(self):
+        self._lock = threading.Condition()
+        self._idle = {}
+        self._in_use = {}
+        self._keepalive_thread = None
+
+    def _settings(self):
+        return {
+            'max_size': config_manager.get('IMAP_POOL_SIZE', 4),
+            'keepalive': config_manager.get('IMAP_POOL_KEEPALIVE', 60),
+            'max_idle': config_manager.get('IMAP_POOL_MAX_IDLE', 600),
+            'timeout': config_manager.get('IMAP_POOL_TIMEOUT', 30),
+        }
+
+    @staticmethod
+    def _current_account():
+        return (
+            config_manager.get('IMAP_SERVER'),
+            config_manager.get('IMAP_PORT', 993),
+            config_manager.get('EMAIL_ADDRESS'),
+            config_manager.get('EMAIL_PASSWORD'),
+        )
+
+    def _open(self, key):
+        imap_server, imap_port, email_address, email_password = key
+        mail = imaplib.IMAP4_SSL(imap_server, imap_port)
+        mail.login(email_address, email_password)
+        logging.info(f"Opened pooled IMAP connection to {imap_server} for {email_address}.")
+        return PooledConnection(key, mail)
+
+    def checkout(self, account=None):
+        """
+        Borrow a logged-in connection for the given account.
+
+        Args:
+            account: A (server, port, address, password) tuple. Defaults to the configured account.
+
+        Returns:
+            A PooledConnection. Raises imaplib.IMAP4.error if no connection could be made.
+        """
+        key = account or self._current_account()
+        settings = self._settings()
+        deadline = time.monotonic() + settings['timeout']
+
+        with self._lock:
+            while True:
+                idle = self._idle.setdefault(key, [])
+                in_use = self._in_use.get(key, 0)
+                if idle or in_use < settings['max_size']:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise imaplib.IMAP4.error(f"Timed out waiting for a pooled IMAP connection to {key[0]}.")
+                self._lock.wait(remaining)
+
+            pooled = idle.pop() if idle else None
+            self._in_use[key] = in_use + 1
+            self._ensure_keepalive_thread()
+
+        try:
+            if pooled is not None:
+                idle_for = time.monotonic() - pooled.last_used
+                if idle_for >= settings['max_idle'] or (idle_for >= settings['keepalive'] and not pooled.is_alive()):
+                    logging.info("Discarding stale pooled IMAP connection, reconnecting.")
+                    pooled.logout()
+                    pooled = None
+            if pooled is None:
+                pooled = self._open(key)
+        except Exception:
+            self._release_slot(key)
+            raise
+
+        pooled.last_used = time.monotonic()
+        return pooled
+
+    def checkin(self, pooled, discard=False):
+        """
+        Return a connection to the pool.
+
+        Args:
+            pooled: The PooledConnection obtained from checkout().
+            discard: Log out instead of keeping the connection, e.g. after a socket error.
+        """
+        if pooled.mail.state not in ('AUTH', 'SELECTED'):
+            discard = True
+
+        if discard:
+            pooled.logout()
+        else:
+            pooled.last_used = time.monotonic()
+
+        with self._lock:
+            if not discard:
+                self._idle.setdefault(pooled.key, []).append(pooled)
+            self._in_use[pooled.key] = max(0, self._in_use.get(pooled.key, 0) - 1)
+            self._lock.notify()
+
+    def _release_slot(self, key):
+        with self._lock:
+            self._in_use[key] = max(0, self._in_use.get(key, 0) - 1)
+            self._lock.notify()
+
+    def _ensure_keepalive_thread(self):
+        if self._keepalive_thread is None or not self._keepalive_thread.is_alive():
+            self._keepalive_thread = threading.Thread(
+                target=self._keepalive_loop, name="imap-pool-keepalive", daemon=True
+            )
+            self._keepalive_thread.start()
+
+    def _keepalive_loop(self):
+        """Run _sweep_idle every IMAP_POOL_KEEPALIVE seconds, following config reloads."""
+        last_sweep = time.monotonic()
+        while True:
+            time.sleep(1)
+            if time.monotonic() - last_sweep >= max(1, self._settings()['keepalive']):
+                self._sweep_idle()
+                last_sweep = time.monotonic()
+
+    def _sweep_idle(self):
+        """NOOP idle connections and evict dead or expired ones."""
+        settings = self._settings()
+        with self._lock:
+            candidates = [(key, pooled) for key, idle in self._idle.items() for pooled in idle]
+            # Checked out while being tested, so checkout() cannot open extra connections meanwhile
+            for key, idle in self._idle.items():
+                self._in_use[key] = self._in_use.get(key, 0) + len(idle)
+                self._idle[key] = []
+
+        survivors = []
+        for key, pooled in candidates:
+            if time.monotonic() - pooled.last_used >= settings['max_idle'] or not pooled.is_alive():
+                logging.debug(f"Evicting idle IMAP connection to {key[0]}.")
+                pooled.logout()
+            else:
+                survivors.append((key, pooled))
+
+        with self._lock:
+            for key, _ in candidates:
+                self._in_use[key] = max(0, self._in_use.get(key, 0) - 1)
+            for key, pooled in survivors:
+                self._idle.setdefault(key, []).append(pooled)
+            self._lock.notify_all()
+
+    def close_all(self):
+        """Log out every idle connection. Connections currently checked out are left alone."""
+        with self._lock:
+            idle = [pooled for connections in self._idle.values() for pooled in connections]
+            self._idle = {}
+        for pooled in idle:
+            pooled.logout()
+        if idle:
+            logging.info(f"Closed {len(idle)} pooled IMAP connection(s).")
+
+
+# Global instance
+imap_pool = IMAPConnectionPool()
@@ -0,0 +1,137 @@
+"""
+Long-running IMAP IDLE watcher that analyzes new mail as soon as it arrives.
+"""
+import imaplib
+import logging
+import threading
+import time
+
+from ai_service import analyze_email_comprehensive, prepare_email_for_ai
+from config_manager import config_manager
+from email_client import EmailClient
+from fetch_orchestrator import get_mail_sources
+from message_store import message_store
+
+
+class MailboxWatcher(threading.Thread):
+    """
+    Holds an IMAP IDLE session on one mailbox.
+
+    New messages are fetched, analyzed with analyze_email_comprehensive and stored in
+    the message store for the API to serve. IDLE is re-issued every WATCHER_IDLE_TIMEOUT
+    seconds (servers drop IDLE after ~30 minutes) and the connection is re-established
+    with exponential backoff after errors. Servers without IDLE are polled with NOOP.
+    """
+
+    def __init__(self, source):
+        super().__init__(name=f"mail-watcher-{source['name']}/{source['mailbox']}", daemon=True)
+        self.source = source
+        self._stop_event = threading.Event()
+        self._client = None
+        self._last_uid = None
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        backoff = 1
+        while not self._stop_event.is_set():
+            try:
+                self._watch()
+                backoff = 1
+            except (imaplib.IMAP4.error, OSError) as e:
+                logging.warning(f"Watcher {self.name} lost its connection: {e}. Reconnecting in {backoff}s.")
+            except Exception as e:
+                logging.error(f"Watcher {self.name} failed unexpectedly: {e}. Restarting in {backoff}s.")
+            finally:
+                if self._client:
+                    self._client.close()
+                    self._client = None
+            self._stop_event.wait(backoff)
+            backoff = min(backoff * 2, 300)
+
+    def _watch(self):
+        # IDLE monopolises the connection, so the watcher keeps its own instead of using the pool
+        self._client = EmailClient(use_pool=False, account=self.source['account'], mailbox=self.source['mailbox'])
+        if not self._client.connect():
+            raise imaplib.IMAP4.error("Could not connect to email server.")
+        if not self._client.select_mailbox():
+            raise imaplib.IMAP4.error("Could not select mailbox.")
+
+        if self._last_uid is None:
+            uidnext = self._client.uid_next()
+            self._last_uid = (uidnext - 1) if uidnext else max(self._client.search_uids([b'ALL']) or [0])
+        else:
+            # Pick up anything that arrived while we were reconnecting
+            self._process_new_mail()
+
+        supports_idle = self._client.supports_idle()
+        logging.info(f"Watcher {self.name} started ({'IDLE' if supports_idle else 'polling'}), last UID {self._last_uid}.")
+
+        idle_timeout = config_manager.get('WATCHER_IDLE_TIMEOUT', 1500)
+        poll_interval = config_manager.get('WATCHER_POLL_INTERVAL', 60)
+        while not self._stop_event.is_set():
+            if supports_idle:
+                self._client.idle(idle_timeout, self._stop_event)
+            else:
+                self._stop_event.wait(poll_interval)
+                self._client.mail.noop()
+            # A cheap UID SEARCH after every cycle also catches EXISTS notifications
+            # that arrived bundled with other responses
+            if not self._stop_event.is_set():
+                self._process_new_mail()
+
+    def _process_new_mail(self):
+        """Fetch messages above the last seen UID, analyze them and store the results."""
+        uids = [uid for uid in self._client.search_uids([b'UID', f'{self._last_uid + 1}:*'.encode()]) or []
+                if uid > self._last_uid]
+        if not uids:
+            return
+
+        logging.info(f"Watcher {self.name} received {len(uids)} new email(s).")
+        account = self._client.account_key()
+        mailbox = self._client.imap_mailbox()
+        emails = self._client.fetch_emails_by_uid(uids)
+        message_store.save_messages(account, mailbox, emails)
+        self._last_uid = max(uids)
+
+        for email_data in emails:
+            analysis = analyze_email_comprehensive(
+                subject=email_data['subject'],
+                body=prepare_email_for_ai(email_data),
+                from_addr=email_data['from'],
+                body_is_clean=True
+            )
+            message_store.save_analysis(account, mailbox, email_data['id'], analysis)
+
+
+_watchers = []
+
+
+def start_watchers():
+    """Start one watcher per configured account/mailbox. Does nothing if already running."""
+    if _watchers:
+        return _watchers
+    for source in get_mail_sources():
+        watcher = MailboxWatcher(source)
+        watcher.start()
+        _watchers.append(watcher)
+    return _watchers
+
+
+def stop_watchers():
+    """Signal all watchers to stop and wait briefly for them to finish."""
+    for watcher in _watchers:
+        watcher.stop()
+    for watcher in _watchers:
+        watcher.join(timeout=5)
+    _watchers.clear()
+
+
+if __name__ == "__main__":
+    start_watchers()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stop_watchers()
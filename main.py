@@ -7,6 +7,7 @@ from rich.panel import Panel
 from rich.text import Text
 
 from email_client import EmailClient
+from imap_pool import imap_pool
 from ai_service import summarize_email
 from config import (
     LOG_LEVEL,
@@ -50,31 +51,37 @@ def main():
             console.print(f"[bold yellow]Found {len(emails_to_process)} emails to process. Processing...[/bold yellow]\n")
             logging.info(f"Found {len(emails_to_process)} emails to process.")
 
-            for email_data in emails_to_process:
-                console.print("--- " * 10)
-                console.print(f"[bold]Processing Email ID:[/bold] {email_data['id']}")
-                console.print(f"[bold]From:[/bold] {email_data['from']}")
-                console.print(f"[bold]Subject:[/bold] {email_data['subject']}")
+            processed_ids = []
 
-                with console.status("[italic blue]Summarizing with AI...[/italic blue]", spinner="dots"):
-                    summary = summarize_email(email_data['subject'], email_data['body'])
-                
-                summary_panel = Panel(
-                    Text(summary, style="white"),
-                    title="[bold green]AI Summary[/bold green]",
-                    border_style="green",
-                    expand=False
-                )
-                console.print(summary_panel)
+            try:
+                for email_data in emails_to_process:
+                    console.print("--- " * 10)
+                    console.print(f"[bold]Processing Email ID:[/bold] {email_data['id']}")
+                    console.print(f"[bold]From:[/bold] {email_data['from']}")
+                    console.print(f"[bold]Subject:[/bold] {email_data['subject']}")
 
-                if MARK_AS_READ:
-                    client.mark_email_as_read(email_data['id'])
+                    with console.status("[italic blue]Summarizing with AI...[/italic blue]", spinner="dots"):
+                        summary = summarize_email(email_data['subject'], email_data['body'])
                 
-                if MOVE_TO_FOLDER_ON_SUCCESS:
-                    client.move_email_to_folder(email_data['id'], MOVE_TO_FOLDER_ON_SUCCESS)
+                    summary_panel = Panel(
+                        Text(summary, style="white"),
+                        title="[bold green]AI Summary[/bold green]",
+                        border_style="green",
+                        expand=False
+                    )
+                    console.print(summary_panel)
+                    processed_ids.append(email_data['id'])
+            finally:
+                # Post-process the emails handled so far in bulk, even if a later one failed
+                if processed_ids and MARK_AS_READ:
+                    client.mark_emails_as_read(processed_ids)
+
+                if processed_ids and MOVE_TO_FOLDER_ON_SUCCESS:
+                    client.move_emails_to_folder(processed_ids, MOVE_TO_FOLDER_ON_SUCCESS)
 
     finally:
         client.close()
+        imap_pool.close_all()
         console.print("[bold cyan]Process finished and disconnected.[/bold cyan]")
         logging.info("Application finished and disconnected.")
 
@@ -0,0 +1,193 @@
+"""
+Local SQLite store for parsed emails and per-mailbox IMAP sync state.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from config_manager import config_manager
+
+
+class MessageStore:
+    """
+    Persists parsed emails keyed by (account, mailbox, uid) together with the
+    UIDVALIDITY / UIDNEXT / HIGHESTMODSEQ state used for incremental syncs.
+    """
+
+    def __init__(self, db_path=None):
+        self._db_path = db_path
+        self._db_path_in_use = None
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        db_path = self._db_path or config_manager.get('MESSAGE_STORE_PATH')
+        if not db_path:
+            db_path = os.path.join(os.path.dirname(__file__), 'message_store.db')
+        if self._conn is None or db_path != self._db_path_in_use:
+            if self._conn is not None:
+                self._conn.close()
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._db_path_in_use = db_path
+            self._create_tables()
+        return self._conn
+
+    def _create_tables(self):
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS mailbox_state (
+                account TEXT NOT NULL,
+                mailbox TEXT NOT NULL,
+                uidvalidity INTEGER,
+                uidnext INTEGER,
+                last_uid INTEGER,
+                highest_modseq INTEGER,
+                criteria TEXT,
+                matching_uids TEXT,
+                PRIMARY KEY (account, mailbox)
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                account TEXT NOT NULL,
+                mailbox TEXT NOT NULL,
+                uid INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (account, mailbox, uid)
+            );
+            CREATE TABLE IF NOT EXISTS analyses (
+                account TEXT NOT NULL,
+                mailbox TEXT NOT NULL,
+                uid INTEGER NOT NULL,
+                analyzed_at REAL NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (account, mailbox, uid)
+            );
+        """)
+        self._conn.commit()
+
+    def get_state(self, account, mailbox):
+        """Return the stored sync state for a mailbox as a dict, or None."""
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT uidvalidity, uidnext, last_uid, highest_modseq, criteria, matching_uids "
+                "FROM mailbox_state WHERE account = ? AND mailbox = ?",
+                (account, mailbox)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            'uidvalidity': row[0],
+            'uidnext': row[1],
+            'last_uid': row[2],
+            'highest_modseq': row[3],
+            'criteria': row[4],
+            'matching_uids': json.loads(row[5]) if row[5] else [],
+        }
+
+    def save_state(self, account, mailbox, state):
+        """Insert or replace the sync state for a mailbox."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO mailbox_state "
+                "(account, mailbox, uidvalidity, uidnext, last_uid, highest_modseq, criteria, matching_uids) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (account, mailbox, state.get('uidvalidity'), state.get('uidnext'), state.get('last_uid'),
+                 state.get('highest_modseq'), state.get('criteria'), json.dumps(state.get('matching_uids', [])))
+            )
+            conn.commit()
+
+    def reset_mailbox(self, account, mailbox):
+        """Drop all cached messages and state for a mailbox, e.g. after a UIDVALIDITY change."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM messages WHERE account = ? AND mailbox = ?", (account, mailbox))
+            conn.execute("DELETE FROM mailbox_state WHERE account = ? AND mailbox = ?", (account, mailbox))
+            conn.commit()
+
+    def get_cached_uids(self, account, mailbox, uids):
+        """Return the subset of uids that already have a cached message."""
+        if not uids:
+            return set()
+        cached = set()
+        with self._lock:
+            conn = self._connection()
+            uids = list(uids)
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(uids), 500):
+                chunk = uids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = conn.execute(
+                    f"SELECT uid FROM messages WHERE account = ? AND mailbox = ? AND uid IN ({placeholders})",
+                    (account, mailbox, *chunk)
+                ).fetchall()
+                cached.update(row[0] for row in rows)
+        return cached
+
+    def get_messages(self, account, mailbox, uids):
+        """Return cached messages for the given uids, in the order the uids were given."""
+        if not uids:
+            return []
+        found = {}
+        with self._lock:
+            conn = self._connection()
+            uids = list(uids)
+            for start in range(0, len(uids), 500):
+                chunk = uids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = conn.execute(
+                    f"SELECT uid, data FROM messages WHERE account = ? AND mailbox = ? AND uid IN ({placeholders})",
+                    (account, mailbox, *chunk)
+                ).fetchall()
+                found.update((row[0], json.loads(row[1])) for row in rows)
+        return [found[uid] for uid in uids if uid in found]
+
+    def save_messages(self, account, mailbox, messages):
+        """Cache parsed messages; each must carry its UID in the 'id' field."""
+        if not messages:
+            return
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "INSERT OR REPLACE INTO messages (account, mailbox, uid, data) VALUES (?, ?, ?, ?)",
+                [(account, mailbox, int(message['id']), json.dumps(message, ensure_ascii=False)) for message in messages]
+            )
+            conn.commit()
+
+    def save_analysis(self, account, mailbox, uid, analysis):
+        """Store the AI analysis produced for a message."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO analyses (account, mailbox, uid, analyzed_at, data) VALUES (?, ?, ?, ?, ?)",
+                (account, mailbox, int(uid), time.time(), json.dumps(analysis, ensure_ascii=False))
+            )
+            conn.commit()
+
+    def get_recent_analyses(self, limit=50):
+        """Return the most recent analyses, newest first, joined with their cached message headers."""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT a.account, a.mailbox, a.uid, a.analyzed_at, a.data, m.data "
+                "FROM analyses a LEFT JOIN messages m "
+                "ON m.account = a.account AND m.mailbox = a.mailbox AND m.uid = a.uid "
+                "ORDER BY a.analyzed_at DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        results = []
+        for account, mailbox, uid, analyzed_at, analysis, message in rows:
+            message = json.loads(message) if message else {}
+            results.append({
+                'source': f"{account}/{mailbox}",
+                'id': str(uid),
+                'from': message.get('from'),
+                'subject': message.get('subject'),
+                'date': message.get('date'),
+                'analyzed_at': analyzed_at,
+                'analysis': json.loads(analysis),
+            })
+        return results
+
+
+# Global instance
+message_store = MessageStore()
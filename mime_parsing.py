@@ -0,0 +1,85 @@
+"""
+Parses raw RFC822 messages into the email dictionaries used throughout the app.
+
+This module only depends on the standard library and text_preprocessing, so the MIME
+parsing worker processes can import it without loading the configuration or the AI clients.
+"""
+import email
+from email.header import decode_header
+
+from text_preprocessing import clean_email_text
+
+
+def parse_headers(msg, email_id):
+    """Parse the envelope headers of a message into the email dictionary, without a body."""
+    subject, encoding = decode_header(msg['Subject'] or '')[0]
+    if isinstance(subject, bytes):
+        subject = subject.decode(encoding if encoding else 'utf-8', errors='ignore')
+
+    return {
+        'id': email_id,
+        'from': msg.get('From'),
+        'to': msg.get('To'),
+        'cc': msg.get('Cc'),
+        'date': msg.get('Date'),
+        'reply_to': msg.get('Reply-To'),
+        'subject': subject,
+    }
+
+
+def parse_email(msg, email_id):
+    """Parse the email message into a dictionary."""
+    parsed_email = parse_headers(msg, email_id)
+
+    body_plain = ""
+    body_html = ""
+    attachments = []
+
+    if msg.is_multipart():
+        for part in msg.walk():
+            content_type = part.get_content_type()
+            content_disposition = str(part.get('Content-Disposition'))
+
+            if 'attachment' in content_disposition:
+                attachments.append({
+                    'name': part.get_filename(),
+                    'size': len(part.get_payload(decode=True) or b''),
+                    'type': content_type
+                })
+                continue
+
+            charset = part.get_content_charset()
+            payload = part.get_payload(decode=True)
+            if not payload:
+                continue
+
+            try:
+                decoded_payload = payload.decode(charset if charset else 'utf-8', errors='ignore')
+            except (LookupError, UnicodeDecodeError):
+                decoded_payload = payload.decode('latin-1', errors='ignore') # Fallback encoding
+
+            if content_type == 'text/plain' and not body_plain:
+                body_plain = decoded_payload
+            elif content_type == 'text/html' and not body_html:
+                body_html = decoded_payload
+    else:
+        # Not a multipart message, just get the payload
+        charset = msg.get_content_charset()
+        payload = msg.get_payload(decode=True)
+        try:
+            body_plain = payload.decode(charset if charset else 'utf-8', errors='ignore')
+        except (LookupError, UnicodeDecodeError):
+            body_plain = payload.decode('latin-1', errors='ignore')
+
+    # Prioritize HTML, but fall back to plain text for a GUI client
+    parsed_email['body'] = body_html.strip() if body_html else body_plain.strip()
+    # Compact text for AI prompts; 'body' keeps the original for display
+    parsed_email['body_text'] = clean_email_text(body_html, body_plain)
+    parsed_email['attachments'] = attachments
+    return parsed_email
+
+
+def parse_raw_message(item):
+    """Parse one (raw bytes, uid) pair. Module-level so it can run in a worker process."""
+    raw_message, email_id = item
+    return parse_email(email.message_from_bytes(raw_message), email_id)
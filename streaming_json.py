@@ -0,0 +1,140 @@
+"""
+Incremental, tolerant JSON parsing for batch reports streamed by the AI.
+"""
+import json
+import re
+
+TRAILING_COMMA_PATTERN = re.compile(r',\s*([}\]])')
+MISSING_COMMA_PATTERN = re.compile(r'([}\]"])\s*\n\s*([{\["])')
+
+
+def loads_tolerant(text):
+    """
+    json.loads with repairs for the mistakes models commonly make.
+
+    Trailing commas are removed and missing commas between values on separate lines
+    are added. Meant for small fragments, such as one category object.
+
+    Raises:
+        json.JSONDecodeError: If the text cannot be repaired.
+    """
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        repaired = TRAILING_COMMA_PATTERN.sub(r'\1', text)
+        repaired = MISSING_COMMA_PATTERN.sub(r'\1,\n\2', repaired)
+        return json.loads(repaired)
+
+
+class BatchReportStreamParser:
+    """
+    Consumes a batch report as it streams in and yields each category as soon as it closes.
+
+    The text is scanned once, character by character, tracking strings, nesting and
+    object keys, so the cost is linear in the output size. Code fences or prose around
+    the JSON object are ignored. Only complete category objects are decoded, so a
+    report that is cut off (e.g. by max_tokens) still yields every finished category.
+    """
+
+    def __init__(self, array_key='categories'):
+        self.array_key = array_key
+        self.categories = []
+        self._buffer = []
+        self._position = 0
+        self._root_start = None
+        self._root_end = None
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        # One frame per open container: [type, key in parent, start position, current key, pending key]
+        self._stack = []
+
+    def feed(self, text):
+        """
+        Add the next piece of the response.
+
+        Returns:
+            The category objects completed by this piece, in order.
+        """
+        completed = []
+        for char in text:
+            self._buffer.append(char)
+            position = self._position
+            self._position += 1
+
+            if self._root_end is not None:
+                continue
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    frame = self._stack[-1] if self._stack else None
+                    if frame and frame[0] == '{' and frame[3] is None:
+                        frame[4] = ''.join(self._buffer[self._string_start + 1:position])
+                continue
+
+            if self._root_start is None:
+                # Skip anything before the report object, such as a ```json fence
+                if char == '{':
+                    self._root_start = position
+                    self._stack.append(['{', None, position, None, None])
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = position
+            elif char == ':':
+                frame = self._stack[-1]
+                if frame[0] == '{':
+                    frame[3] = frame[4]
+            elif char == ',':
+                frame = self._stack[-1]
+                if frame[0] == '{':
+                    frame[3] = None
+                    frame[4] = None
+            elif char in '{[':
+                parent = self._stack[-1]
+                key = parent[3] if parent[0] == '{' else None
+                self._stack.append([char, key, position, None, None])
+            elif char in '}]':
+                frame = self._stack.pop()
+                if self._is_category(frame, char):
+                    category = self._decode(frame[2], position + 1)
+                    if isinstance(category, dict):
+                        self.categories.append(category)
+                        completed.append(category)
+                if not self._stack:
+                    self._root_end = position + 1
+        return completed
+
+    def _is_category(self, frame, closing_char):
+        # root object -> "categories" array -> this object
+        return (
+            closing_char == '}' and frame[0] == '{' and len(self._stack) == 2
+            and self._stack[1][0] == '[' and self._stack[1][1] == self.array_key
+        )
+
+    def _decode(self, start, end):
+        try:
+            return loads_tolerant(''.join(self._buffer[start:end]))
+        except json.JSONDecodeError:
+            return None
+
+    def result(self):
+        """
+        Return the full report once the stream has ended.
+
+        Returns:
+            The decoded report. If the object is incomplete or cannot be repaired, a
+            report holding the categories parsed so far. None if nothing was parsed.
+        """
+        if self._root_start is not None and self._root_end is not None:
+            report = self._decode(self._root_start, self._root_end)
+            if isinstance(report, dict):
+                return report
+        if self.categories:
+            return {self.array_key: list(self.categories)}
+        return None
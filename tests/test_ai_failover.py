@@ -0,0 +1,68 @@
+import time
+from types import SimpleNamespace
+
+import openai
+import pytest
+
+from ai_failover import AIFailover
+from ai_scheduler import ai_scheduler
+
+REQUEST = {'model': 'primary-model', 'messages': [{'role': 'user', 'content': 'fitted for primary'}], 'max_tokens': 10}
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    settings = {'AI_MAX_CONCURRENCY': 2, 'AI_RATE_LIMIT_RPM': 0, 'AI_RATE_LIMIT_TPM': 0, 'AI_MAX_RETRIES': 1}
+    monkeypatch.setattr('ai_failover.config_manager.get', lambda key, default=None: settings.get(key, default))
+    monkeypatch.setattr(ai_scheduler, '_retry_delay', lambda error, attempt: 0.2)
+    return settings
+
+
+class _FakeCompletions:
+    def __init__(self, errors=(), delay=0.0):
+        self.errors = list(errors)
+        self.delay = delay
+        self.requests = []
+
+    def create(self, **request):
+        self.requests.append(request)
+        if self.errors:
+            raise self.errors.pop(0)
+        time.sleep(self.delay)
+        return 'response'
+
+
+def _candidate(provider, model, completions):
+    return provider, SimpleNamespace(chat=SimpleNamespace(completions=completions)), model
+
+
+def _timeout():
+    return openai.APITimeoutError(request=None)
+
+
+def test_fallback_with_another_model_gets_a_refitted_prompt():
+    primary = _FakeCompletions(errors=[_timeout(), _timeout()])
+    fallback = _FakeCompletions()
+
+    def refit(model):
+        return {'model': model, 'messages': [{'role': 'user', 'content': f'fitted for {model}'}]}
+
+    failover = AIFailover()
+    result = failover.run(
+        [_candidate('openai', 'primary-model', primary), _candidate('custom', 'small-model', fallback)],
+        dict(REQUEST, stream=False), refit
+    )
+    assert result == 'response'
+    assert primary.requests[0]['messages'][0]['content'] == 'fitted for primary'
+    assert fallback.requests == [{
+        'model': 'small-model', 'messages': [{'role': 'user', 'content': 'fitted for small-model'}],
+        'max_tokens': 10, 'stream': False,
+    }]
+
+
+def test_latency_excludes_retry_backoff():
+    completions = _FakeCompletions(errors=[_timeout()], delay=0.05)
+    failover = AIFailover()
+    failover.run([_candidate('openai', 'primary-model', completions)], REQUEST)
+    # The failed attempt and the 0.2s backoff before the retry are not part of the sample
+    assert list(failover._latencies['openai']) == [pytest.approx(0.05, abs=0.04)]
@@ -0,0 +1,126 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from ai_scheduler import AIScheduler, _ModelLimiter
+
+REQUEST = {'model': 'test-model', 'messages': [{'role': 'user', 'content': 'hi'}], 'max_tokens': 10}
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    scheduler = AIScheduler()
+    settings = {'AI_MAX_CONCURRENCY': 2, 'AI_RATE_LIMIT_RPM': 0, 'AI_RATE_LIMIT_TPM': 0, 'AI_MAX_RETRIES': 0}
+    monkeypatch.setattr('ai_scheduler.config_manager.get', lambda key, default=None: settings.get(key, default))
+    return scheduler
+
+
+def in_flight(scheduler):
+    return scheduler._limiters[('openai', 'test-model')].in_flight
+
+
+def test_limiter_gives_out_slots_up_to_the_concurrency_limit():
+    limiter = _ModelLimiter(max_concurrency=2)
+    assert limiter.try_acquire(0) == 0
+    assert limiter.try_acquire(0) == 0
+    # Full: only a release can free a slot
+    assert limiter.try_acquire(0) is None
+    limiter.release(0)
+    assert limiter.try_acquire(0) == 0
+
+
+def test_limiter_waits_for_the_request_bucket():
+    limiter = _ModelLimiter(max_concurrency=5)
+    limiter.configure(requests_per_minute=1, tokens_per_minute=0, max_concurrency=5)
+    assert limiter.try_acquire(0) == 0
+    limiter.release(0)
+    assert limiter.try_acquire(0) == pytest.approx(60, abs=1)
+
+
+def test_slot_is_released_after_the_request(scheduler):
+    assert scheduler.run('openai', REQUEST, lambda: 'done') == 'done'
+    assert in_flight(scheduler) == 0
+
+
+def test_slot_is_released_when_the_request_fails(scheduler):
+    def fail():
+        raise ValueError("bad request")
+    with pytest.raises(ValueError):
+        scheduler.run('openai', REQUEST, fail)
+    assert in_flight(scheduler) == 0
+
+
+def test_waiting_request_wakes_up_when_a_slot_is_released(scheduler):
+    release = threading.Event()
+    running = []
+    max_running = []
+
+    def send():
+        running.append(1)
+        max_running.append(len(running))
+        release.wait(5)
+        running.pop()
+        return 'done'
+
+    threads = [threading.Thread(target=scheduler.run, args=('openai', REQUEST, send)) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    assert len(running) == 2
+    started = time.monotonic()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert max(max_running) == 2
+    assert time.monotonic() - started < 1
+    assert in_flight(scheduler) == 0
+
+
+class FakeStream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+def test_stream_holds_its_slot_until_exhausted(scheduler):
+    stream = scheduler.run('openai', dict(REQUEST, stream=True), lambda: FakeStream(['a', 'b']))
+    assert in_flight(scheduler) == 1
+    assert list(stream) == ['a', 'b']
+    assert in_flight(scheduler) == 0
+
+
+def test_stream_closed_early_releases_its_slot_once(scheduler):
+    underlying = FakeStream(['a', 'b', 'c'])
+    stream = scheduler.run('openai', dict(REQUEST, stream=True), lambda: underlying)
+    for chunk in stream:
+        break
+    stream.close()
+    stream.close()
+    assert underlying.closed
+    assert in_flight(scheduler) == 0
+
+
+def test_async_waiter_wakes_up_when_a_slot_is_released(scheduler):
+    async def main():
+        release = asyncio.Event()
+
+        async def send():
+            await release.wait()
+            return 'done'
+
+        tasks = [asyncio.ensure_future(scheduler.run_async('openai', REQUEST, send)) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        assert in_flight(scheduler) == 2
+        release.set()
+        return await asyncio.wait_for(asyncio.gather(*tasks), 1)
+
+    assert asyncio.run(main()) == ['done'] * 3
+    assert in_flight(scheduler) == 0
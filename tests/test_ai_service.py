@@ -0,0 +1,15 @@
+import ai_service
+from ai_service import prepare_email_for_ai
+
+
+def test_prepared_email_uses_the_cleaned_text(monkeypatch):
+    email_data = {'body': '<p>Hi</p>', 'body_text': 'Hi'}
+    monkeypatch.setattr(ai_service.config_manager, 'get', lambda key, default=None: default)
+    assert prepare_email_for_ai(email_data) == 'Hi'
+
+
+def test_prepared_email_is_raw_when_cleaning_is_off(monkeypatch):
+    email_data = {'body': '<p>Hi</p>', 'body_text': 'Hi'}
+    settings = {'AI_CLEAN_BODY': False}
+    monkeypatch.setattr(ai_service.config_manager, 'get', lambda key, default=None: settings.get(key, default))
+    assert prepare_email_for_ai(email_data) == '<p>Hi</p>'
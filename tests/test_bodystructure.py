@@ -0,0 +1,39 @@
+from bodystructure import parse_bodystructure
+
+
+def test_single_part_message():
+    data = [b'1 (UID 5 BODYSTRUCTURE ("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 42 3 NIL NIL NIL))']
+    (part,) = parse_bodystructure(data)
+    assert part.section == '1'
+    assert part.content_type == 'text/plain'
+    assert part.charset == 'utf-8'
+    assert part.encoding == '7bit'
+    assert part.size == 42
+    assert not part.is_attachment
+
+
+def test_multipart_with_attachment():
+    data = [
+        b'1 (UID 7 BODYSTRUCTURE ((("TEXT" "PLAIN" ("CHARSET" "us-ascii") NIL NIL "QUOTED-PRINTABLE" 100 4 NIL NIL NIL)'
+        b'("TEXT" "HTML" ("CHARSET" "utf-8") NIL NIL "BASE64" 200 3 NIL NIL NIL) "ALTERNATIVE" ("BOUNDARY" "b1") NIL NIL)'
+        b'("APPLICATION" "PDF" ("NAME" "report.pdf") NIL NIL "BASE64" 5000 NIL ("ATTACHMENT" ("FILENAME" "report.pdf")) NIL)'
+        b' "MIXED" ("BOUNDARY" "b0") NIL NIL))'
+    ]
+    parts = parse_bodystructure(data)
+    assert [part.section for part in parts] == ['1.1', '1.2', '2']
+    assert [part.content_type for part in parts] == ['text/plain', 'text/html', 'application/pdf']
+    assert parts[0].encoding == 'quoted-printable'
+    attachment = parts[2]
+    assert attachment.is_attachment
+    assert attachment.disposition == 'attachment'
+    assert attachment.filename == 'report.pdf'
+
+
+def test_literal_strings_are_resolved():
+    data = [(b'1 (UID 9 BODYSTRUCTURE ("TEXT" "PLAIN" ("NAME" {8}', b'notes.tx'), b') NIL NIL "7BIT" 1 1 NIL NIL NIL))']
+    (part,) = parse_bodystructure(data)
+    assert part.params['name'] == 'notes.tx'
+
+
+def test_missing_bodystructure():
+    assert parse_bodystructure([b'1 (UID 9 FLAGS ())']) == []
@@ -0,0 +1,151 @@
+import imaplib
+import socket
+
+import pytest
+
+import email_client
+from email_client import EmailClient
+from message_store import MessageStore
+
+
+def test_uid_sequence_set_compresses_consecutive_uids():
+    assert EmailClient._build_uid_sequence_set([101, 102, 103, 163]) == '101:103,163'
+
+
+def test_uid_sequence_set_sorts_and_deduplicates():
+    assert EmailClient._build_uid_sequence_set([5, 3, 4, 4, 9, 1]) == '1,3:5,9'
+
+
+def test_uid_sequence_set_of_single_and_no_uids():
+    assert EmailClient._build_uid_sequence_set([7]) == '7'
+    assert EmailClient._build_uid_sequence_set([]) == ''
+
+
+def test_split_fetch_response_groups_items_by_uid():
+    msg_data = [
+        (b'1 (UID 101 RFC822.SIZE 10 BODY[HEADER] {5}', b'head1'),
+        b')',
+        (b'2 (BODY[HEADER] {5}', b'head2'),
+        b' UID 102)',
+    ]
+    records = EmailClient._split_fetch_response(msg_data)
+    assert sorted(records) == [101, 102]
+    assert records[101][0][1] == b'head1'
+    assert records[102] == [(b'2 (BODY[HEADER] {5}', b'head2'), b' UID 102)']
+
+
+def test_split_fetch_response_skips_messages_without_uid():
+    assert EmailClient._split_fetch_response([b'3 (FLAGS (\\Seen))', None]) == {}
+
+
+class _FakeIdleConnection:
+    """The parts of imaplib.IMAP4 that EmailClient.idle uses, over a local socket pair."""
+
+    def __init__(self, server_replies):
+        self.sock, self._server = socket.socketpair()
+        self.file = self.sock.makefile('rb')
+        self.sent = []
+        self._server_replies = list(server_replies)
+
+    def _new_tag(self):
+        return b'A001'
+
+    def send(self, data):
+        self.sent.append(data)
+        if self._server_replies:
+            self._server.sendall(self._server_replies.pop(0))
+
+    def readline(self):
+        return self.file.readline()
+
+
+def _idle_client(server_replies):
+    client = EmailClient(use_pool=False)
+    client.mail = _FakeIdleConnection(server_replies)
+    return client
+
+
+def test_idle_sees_exists_sent_together_with_the_continuation():
+    # Both lines arrive in one packet, so the EXISTS is already buffered when IDLE starts
+    client = _idle_client([b'+ idling\r\n* 3 EXISTS\r\n', b'A001 OK IDLE terminated\r\n'])
+    assert client.idle(timeout=5) is True
+    assert client.mail.sent == [b'A001 IDLE\r\n', b'DONE\r\n']
+
+
+def test_idle_times_out_without_new_mail():
+    client = _idle_client([b'+ idling\r\n', b'* 1 RECENT\r\nA001 OK IDLE terminated\r\n'])
+    assert client.idle(timeout=0.2) is False
+
+
+def test_idle_rejected():
+    client = _idle_client([b'A001 BAD unknown command\r\n'])
+    with pytest.raises(imaplib.IMAP4.error):
+        client.idle(timeout=1)
+    assert client.mail.sent == [b'A001 IDLE\r\n']
+
+
+class _FakeSelectConnection:
+    """Answers SELECT with a UIDVALIDITY the test can change between calls."""
+
+    def __init__(self, uidvalidity):
+        self.uidvalidity = uidvalidity
+
+    def select(self, mailbox):
+        return 'OK', [b'3']
+
+    def response(self, code):
+        if code == 'UIDVALIDITY':
+            return code, [str(self.uidvalidity).encode()]
+        return code, [None]
+
+
+def _store_client(monkeypatch, tmp_path, settings=None):
+    settings = {'INCREMENTAL_SYNC': True, 'IMAP_MAILBOX': 'INBOX', **(settings or {})}
+    monkeypatch.setattr(email_client.config_manager, 'get', lambda key, default=None: settings.get(key, default))
+    monkeypatch.setattr(email_client, 'message_store', MessageStore(db_path=str(tmp_path / 'store.db')))
+    client = EmailClient(use_pool=False)
+    client.mail = _FakeSelectConnection(uidvalidity=1)
+    client.fetched = []
+
+    def fetch_and_parse(uids):
+        client.fetched.extend(uids)
+        generation = client.mail.uidvalidity
+        return [{'id': str(uid), 'body': f'body {uid} of {generation}'} for uid in sorted(uids, reverse=True)]
+
+    client._fetch_and_parse = fetch_and_parse
+    return client
+
+
+def test_fetch_email_body_is_cached_until_uidvalidity_changes(monkeypatch, tmp_path):
+    client = _store_client(monkeypatch, tmp_path)
+    assert client.fetch_email_body(7)['body'] == 'body 7 of 1'
+    assert client.fetch_email_body(7)['body'] == 'body 7 of 1'
+    assert client.fetched == [7]
+
+    client.mail.uidvalidity = 2
+    assert client.fetch_email_body(7)['body'] == 'body 7 of 2'
+    assert client.fetched == [7, 7]
+
+
+def test_fetch_email_body_bypasses_store_without_incremental_sync(monkeypatch, tmp_path):
+    client = _store_client(monkeypatch, tmp_path, {'INCREMENTAL_SYNC': False})
+    client.fetch_email_body(7)
+    client.fetch_email_body(7)
+    assert client.fetched == [7, 7]
+    assert email_client.message_store.get_state(client.account_key(), 'INBOX') is None
+
+
+def test_fetch_email_page_discards_cached_pages_when_uidvalidity_changes(monkeypatch, tmp_path):
+    client = _store_client(monkeypatch, tmp_path)
+    client.search_uids = lambda criteria: [1, 2, 3, 4]
+
+    emails, next_cursor = client.fetch_email_page(limit=2)
+    assert [e['body'] for e in emails] == ['body 4 of 1', 'body 3 of 1']
+    assert next_cursor == 3
+    client.fetch_email_page(limit=2)
+    assert client.fetched == [3, 4]
+
+    client.mail.uidvalidity = 2
+    emails, _ = client.fetch_email_page(limit=2)
+    assert [e['body'] for e in emails] == ['body 4 of 2', 'body 3 of 2']
+    assert client.fetched == [3, 4, 3, 4]
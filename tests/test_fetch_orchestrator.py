@@ -0,0 +1,31 @@
+import json
+
+import fetch_orchestrator
+
+
+def _configure(monkeypatch, settings):
+    monkeypatch.setattr(fetch_orchestrator.config_manager, 'get', lambda key, default=None: settings.get(key, default))
+
+
+def test_primary_source_without_email_address_uses_default_name(monkeypatch):
+    _configure(monkeypatch, {'IMAP_MAILBOXES': 'INBOX, Archive, INBOX'})
+    sources = fetch_orchestrator.get_mail_sources()
+    assert [fetch_orchestrator._source_label(source) for source in sources] == ['default/INBOX', 'default/Archive']
+
+
+def test_accounts_without_name_or_with_duplicate_names_are_skipped(monkeypatch, tmp_path):
+    accounts_file = tmp_path / 'accounts.json'
+    accounts_file.write_text(json.dumps([
+        {'NAME': 'work', 'EMAIL_ADDRESS': 'me@work.example', 'IMAP_MAILBOXES': 'INBOX'},
+        {'IMAP_SERVER': 'imap.example', 'IMAP_MAILBOXES': 'INBOX'},
+        {'NAME': 'work', 'EMAIL_ADDRESS': 'other@work.example', 'IMAP_MAILBOXES': 'INBOX'},
+        {'EMAIL_ADDRESS': 'me@home.example'},
+        {'NAME': 'me@example.com'},
+    ]))
+    _configure(monkeypatch, {'EMAIL_ADDRESS': 'me@example.com', 'IMAP_ACCOUNTS_FILE': str(accounts_file)})
+
+    sources = fetch_orchestrator.get_mail_sources()
+    assert [fetch_orchestrator._source_label(source) for source in sources] == [
+        'me@example.com/INBOX', 'work/INBOX', 'me@home.example/INBOX'
+    ]
+    assert sources[1]['account']['EMAIL_ADDRESS'] == 'me@work.example'
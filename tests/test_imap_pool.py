@@ -0,0 +1,110 @@
+import imaplib
+import threading
+
+import pytest
+
+from imap_pool import IMAPConnectionPool, PooledConnection
+
+ACCOUNT = ('imap.example.com', 993, 'me@example.com', 'secret')
+
+
+class FakeMail:
+    def __init__(self):
+        self.state = 'AUTH'
+        self.alive = True
+        self.logged_out = False
+
+    def noop(self):
+        if not self.alive:
+            raise OSError("connection reset")
+        return 'OK', [b'']
+
+    def logout(self):
+        self.logged_out = True
+        self.state = 'LOGOUT'
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = IMAPConnectionPool()
+    settings = {'max_size': 2, 'keepalive': 60, 'max_idle': 600, 'timeout': 0.2}
+    monkeypatch.setattr(pool, '_settings', lambda: settings)
+    monkeypatch.setattr(pool, '_open', lambda key: PooledConnection(key, FakeMail()))
+    monkeypatch.setattr(pool, '_ensure_keepalive_thread', lambda: None)
+    pool.settings = settings
+    return pool
+
+
+def test_checked_in_connection_is_reused(pool):
+    first = pool.checkout(ACCOUNT)
+    pool.checkin(first)
+    assert pool.checkout(ACCOUNT) is first
+
+
+def test_checkout_waits_for_a_free_slot_and_times_out(pool):
+    pool.checkout(ACCOUNT)
+    pool.checkout(ACCOUNT)
+    with pytest.raises(imaplib.IMAP4.error):
+        pool.checkout(ACCOUNT)
+
+
+def test_checkout_gets_a_connection_released_by_another_thread(pool):
+    pool.settings['timeout'] = 5
+    held = [pool.checkout(ACCOUNT), pool.checkout(ACCOUNT)]
+    threading.Timer(0.1, pool.checkin, args=(held[0],)).start()
+    assert pool.checkout(ACCOUNT) is held[0]
+
+
+def test_discarded_connection_frees_its_slot(pool):
+    pooled = pool.checkout(ACCOUNT)
+    pool.checkin(pooled, discard=True)
+    assert pooled.mail.logged_out
+    assert pool.checkout(ACCOUNT) is not pooled
+
+
+def test_failed_open_releases_the_slot(pool, monkeypatch):
+    def fail(key):
+        raise imaplib.IMAP4.error("login failed")
+    monkeypatch.setattr(pool, '_open', fail)
+    for _ in range(3):
+        with pytest.raises(imaplib.IMAP4.error):
+            pool.checkout(ACCOUNT)
+    assert pool._in_use[ACCOUNT] == 0
+
+
+def test_sweep_evicts_dead_connections_and_keeps_live_ones(pool):
+    live, dead = pool.checkout(ACCOUNT), pool.checkout(ACCOUNT)
+    pool.checkin(live)
+    pool.checkin(dead)
+    dead.mail.alive = False
+    pool._sweep_idle()
+    assert dead.mail.logged_out
+    assert pool._idle[ACCOUNT] == [live]
+    assert pool._in_use[ACCOUNT] == 0
+
+
+def test_sweep_counts_connections_under_test_as_checked_out(pool):
+    pool.settings['timeout'] = 5
+    pooled = [pool.checkout(ACCOUNT), pool.checkout(ACCOUNT)]
+    for connection in pooled:
+        pool.checkin(connection)
+
+    in_noop = threading.Event()
+    finish_noop = threading.Event()
+
+    def slow_noop():
+        in_noop.set()
+        finish_noop.wait(5)
+        return 'OK', [b'']
+    pooled[0].mail.noop = slow_noop
+
+    sweep = threading.Thread(target=pool._sweep_idle)
+    sweep.start()
+    in_noop.wait(5)
+    # Both connections are being checked, so a checkout must wait instead of opening a third
+    assert pool._in_use[ACCOUNT] == 2
+    threading.Timer(0.1, finish_noop.set).start()
+    borrowed = pool.checkout(ACCOUNT)
+    sweep.join(5)
+    assert borrowed in pooled
+    assert len(pool._idle[ACCOUNT]) + pool._in_use[ACCOUNT] == 2
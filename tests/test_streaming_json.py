@@ -0,0 +1,65 @@
+import pytest
+
+from streaming_json import BatchReportStreamParser, loads_tolerant
+
+REPORT = (
+    '```json\n'
+    '{"categories": [\n'
+    '  {"name": "Work {urgent}", "emails": [{"id": "1", "summary": "Say \\"hi\\""}]},\n'
+    '  {"name": "Personal", "emails": []}\n'
+    '], "calendar_summary": {"upcoming_meetings": []}}\n'
+    '```'
+)
+
+
+def feed_in_pieces(parser, text, size):
+    completed = []
+    for start in range(0, len(text), size):
+        completed.extend(parser.feed(text[start:start + size]))
+    return completed
+
+
+@pytest.mark.parametrize('size', [1, 7, len(REPORT)])
+def test_categories_are_yielded_as_they_close(size):
+    parser = BatchReportStreamParser()
+    completed = feed_in_pieces(parser, REPORT, size)
+    assert [category['name'] for category in completed] == ['Work {urgent}', 'Personal']
+    assert completed[0]['emails'][0]['summary'] == 'Say "hi"'
+
+
+def test_category_is_yielded_before_the_report_ends():
+    parser = BatchReportStreamParser()
+    first = REPORT.index('},') + 1
+    assert [category['name'] for category in parser.feed(REPORT[:first])] == ['Work {urgent}']
+    assert [category['name'] for category in parser.feed(REPORT[first:])] == ['Personal']
+
+
+def test_result_is_the_full_report():
+    parser = BatchReportStreamParser()
+    parser.feed(REPORT)
+    report = parser.result()
+    assert report['calendar_summary'] == {'upcoming_meetings': []}
+    assert len(report['categories']) == 2
+
+
+def test_truncated_report_keeps_the_finished_categories():
+    parser = BatchReportStreamParser()
+    parser.feed(REPORT[:REPORT.index('"Personal"')])
+    assert parser.result() == {'categories': [parser.categories[0]]}
+
+
+def test_nested_objects_are_not_mistaken_for_categories():
+    parser = BatchReportStreamParser()
+    completed = parser.feed('{"summary": {"categories": [{"x": 1}]}, "categories": [{"name": "A"}]}')
+    assert completed == [{'name': 'A'}]
+
+
+def test_no_report_in_the_response():
+    parser = BatchReportStreamParser()
+    parser.feed('Sorry, I cannot help with that.')
+    assert parser.result() is None
+
+
+def test_tolerant_loads_repairs_commas():
+    assert loads_tolerant('{"a": [1, 2,], "b": 3,}') == {'a': [1, 2], 'b': 3}
+    assert loads_tolerant('[{"a": 1}\n{"b": 2}]') == [{'a': 1}, {'b': 2}]
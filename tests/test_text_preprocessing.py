@@ -0,0 +1,77 @@
+from text_preprocessing import (
+    clean_email_text, collapse_whitespace, html_to_text, strip_quoted_text, strip_signature
+)
+
+
+def test_html_is_converted_to_text_without_styles_or_scripts():
+    html = "<html><head><style>p {color: red}</style></head><body><p>Hello</p><script>x()</script><p>World</p></body></html>"
+    assert clean_email_text(body_html=html) == "Hello\n\nWorld"
+
+
+def test_list_items_become_bullets():
+    assert clean_email_text(body_html="<ul><li>one</li><li>two</li></ul>") == "- one\n- two"
+
+
+def test_reply_header_and_quoted_lines_are_removed():
+    text = "Sounds good.\n\nOn Mon, 1 Jan 2024 at 10:00, Bob <bob@example.com> wrote:\n> earlier message\n> more"
+    assert clean_email_text(body_plain=text) == "Sounds good."
+
+
+def test_outlook_reply_header_block_is_removed():
+    text = "Thanks!\n\nFrom: Bob <bob@example.com>\nSent: Monday, 1 January 2024\nTo: me\n\nold thread"
+    assert clean_email_text(body_plain=text) == "Thanks!"
+
+
+def test_forwarded_message_keeps_its_content():
+    text = (
+        "FYI\n"
+        "---------- Forwarded message ---------\n"
+        "From: Bob <bob@example.com>\n"
+        "Date: Mon, 1 Jan 2024 at 10:00\n"
+        "Subject: Planning\n"
+        "\n"
+        "The meeting moved to 3pm on Friday."
+    )
+    cleaned = clean_email_text(body_plain=text)
+    assert "The meeting moved to 3pm on Friday." in cleaned
+    assert cleaned.startswith("FYI")
+
+
+def test_apple_mail_forward_keeps_its_content():
+    text = "See below\n\nBegin forwarded message:\n\nFrom: Bob <bob@example.com>\nDate: 1 January 2024\n\nInvoice attached."
+    assert "Invoice attached." in strip_quoted_text(text)
+
+
+def test_message_that_is_only_a_quote_is_kept():
+    text = "On Mon, 1 Jan 2024, Bob wrote:\n> the only content"
+    assert strip_quoted_text(text) == "On Mon, 1 Jan 2024, Bob wrote:"
+
+
+def test_signature_is_removed():
+    assert strip_signature("Body text\n-- \nBob\nCEO") == "Body text"
+    assert strip_signature("Body text\nSent from my iPhone") == "Body text"
+
+
+def test_broken_html_does_not_raise():
+    assert "text" in html_to_text("<div><p>text</div></span>")
+
+
+def test_body_without_closing_head_tag_keeps_its_text():
+    html = '<html><head><style>p{}</style><body><p>Hello team</p></body></html>'
+    assert clean_email_text(body_html=html) == 'Hello team'
+
+
+def test_head_title_is_not_part_of_the_text():
+    html = '<html><head><title>Newsletter</title></head><body>Content</body></html>'
+    assert clean_email_text(body_html=html) == 'Content'
+
+
+def test_blockquoted_forward_is_kept():
+    html = '<div>Hi</div><blockquote>Begin forwarded message:<br>The launch moved to May.</blockquote>'
+    cleaned = clean_email_text(body_html=html)
+    assert cleaned.startswith('Hi')
+    assert 'The launch moved to May.' in cleaned
+
+
+def test_invisible_characters_are_removed():
+    assert collapse_whitespace('a\u200bb\u200cc\u200dd\u2060e\ufefff\u00adg') == 'abcdefg'
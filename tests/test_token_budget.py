@@ -0,0 +1,67 @@
+import token_budget
+from token_budget import count_tokens, fit_body, get_context_window, truncate_to_tokens
+
+
+def test_short_text_is_unchanged():
+    assert truncate_to_tokens("Hello there.", 100) == "Hello there."
+
+
+def test_empty_budget_or_text():
+    assert truncate_to_tokens("Hello", 0) == ''
+    assert truncate_to_tokens('', 10) == ''
+
+
+def test_truncated_text_fits_and_is_a_prefix():
+    text = "word " * 500
+    truncated = truncate_to_tokens(text, 50)
+    assert count_tokens(truncated) <= 50
+    assert text.startswith(truncated)
+
+
+def test_cut_prefers_a_paragraph_boundary():
+    first = "First paragraph sentence. " * 10
+    text = first + "\n\n" + "Second paragraph words. " * 50
+    truncated = truncate_to_tokens(text, count_tokens(first) + 10)
+    assert truncated == first.rstrip()
+
+
+def test_cut_falls_back_to_a_sentence_end():
+    text = "This is a sentence that goes on. " * 40
+    truncated = truncate_to_tokens(text, 60)
+    assert truncated.endswith('.')
+    assert count_tokens(truncated) <= 60
+
+
+def test_cjk_text_is_counted_per_character_without_tiktoken(monkeypatch):
+    monkeypatch.setattr(token_budget, 'tiktoken', None)
+    truncated = truncate_to_tokens("你好世界" * 100, 21)
+    assert count_tokens(truncated) <= 21
+    assert len(truncated) >= 15
+
+
+def test_context_window_matches_the_longest_prefix():
+    assert get_context_window('openai/gpt-4o-mini') == 128000
+    assert get_context_window('gpt-4') == 8192
+    assert get_context_window('unknown-model') == token_budget.DEFAULT_CONTEXT_WINDOW
+
+
+def test_fit_body_leaves_room_for_the_prompt():
+    body = "line of text\n" * 2000
+    fitted = fit_body(body, "system " * 100, "Subject: x\n\nBody:\n", 'gpt-4o-mini', 250, allowance=500)
+    assert count_tokens(fitted) <= 500 - count_tokens("system " * 100)
+
+
+def test_encoding_failure_falls_back_to_the_estimate_once(monkeypatch):
+    calls = []
+
+    class BrokenTiktoken:
+        @staticmethod
+        def encoding_for_model(name):
+            calls.append(name)
+            raise ConnectionError("offline")
+
+    monkeypatch.setattr(token_budget, 'tiktoken', BrokenTiktoken)
+    monkeypatch.setattr(token_budget, '_encodings', {})
+    assert count_tokens("abcdefgh", 'some-model') == 3
+    assert count_tokens("abcdefgh", 'some-model') == 3
+    assert calls == ['some-model']
@@ -0,0 +1,146 @@
+"""
+Turns email bodies into compact plain text for AI prompts.
+
+HTML is converted to text, quoted reply history and signatures are removed and
+whitespace is collapsed. The original body is left untouched for display.
+"""
+import re
+from html.parser import HTMLParser
+
+HTML_PATTERN = re.compile(r'<\s*(html|body|div|p|br|table|span|font|a)\b', re.IGNORECASE)
+
+# <head> is handled separately: its end tag is optional, so <body> also ends it
+SKIPPED_TAGS = {'style', 'script', 'title', 'noscript', 'template'}
+BLOCK_TAGS = {
+    'p', 'div', 'br', 'tr', 'table', 'tbody', 'thead', 'section', 'article', 'header', 'footer',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'ul', 'ol', 'pre', 'center', 'dl', 'dt', 'dd'
+}
+CELL_TAGS = {'td', 'th'}
+
+QUOTE_HEADER_PATTERNS = [
+    re.compile(r'^On .{5,200} wrote:\s*$', re.IGNORECASE),
+    re.compile(r'^在.{2,200}写道[:：]\s*$'),
+    re.compile(r'^-{2,}\s*(Original Message|原始邮件)\s*-{2,}', re.IGNORECASE),
+]
+# A header block right after one of these is the forwarded message itself, not quoted history
+FORWARD_MARKER_PATTERN = re.compile(
+    r'^(-{2,}\s*(Forwarded message|Original Message|转发的邮件|原始邮件)\s*-{2,}|Begin forwarded message:?)',
+    re.IGNORECASE
+)
+OUTLOOK_FROM_PATTERN = re.compile(r'^\*?(From|发件人)\s*[:：]', re.IGNORECASE)
+OUTLOOK_SENT_PATTERN = re.compile(r'^\*?(Sent|Date|发送时间|日期)\s*[:：]', re.IGNORECASE)
+SIGNATURE_PATTERNS = [
+    re.compile(r'^--\s?$'),
+    re.compile(r'^(Sent from my|Get Outlook for|发自我的)', re.IGNORECASE),
+]
+# Signatures are only looked for near the end of the message
+SIGNATURE_SEARCH_LINES = 20
+
+INVISIBLE_CHARS = re.compile('[\u200b\u200c\u200d\u2060\ufeff\u00ad]')
+
+
+class _TextExtractor(HTMLParser):
+    """Collects the visible text of an HTML document, keeping block structure as newlines."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip_depth = 0
+        self._in_head = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'head':
+            self._in_head = True
+        elif tag == 'body':
+            self._in_head = False
+        elif tag in SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag == 'li':
+            self.parts.append('\n- ')
+        elif tag in BLOCK_TAGS:
+            self.parts.append('\n')
+        elif tag in CELL_TAGS:
+            self.parts.append(' ')
+
+    def handle_startendtag(self, tag, attrs):
+        # Void elements such as <br/>; never affect the skip depth
+        if tag in BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag == 'head':
+            self._in_head = False
+        elif tag in SKIPPED_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if not self._skip_depth and not self._in_head:
+            self.parts.append(data)
+
+
+def html_to_text(html):
+    """Convert HTML to plain text, dropping the head, styles, scripts and images."""
+    extractor = _TextExtractor()
+    try:
+        extractor.feed(html)
+        extractor.close()
+    except Exception:
+        # Badly broken markup: fall back to removing the tags
+        return re.sub(r'<[^>]+>', ' ', html)
+    return ''.join(extractor.parts)
+
+
+def collapse_whitespace(text):
+    """Normalise spaces, drop invisible characters and squeeze blank lines."""
+    text = INVISIBLE_CHARS.sub('', text.replace('\xa0', ' ').replace('\r\n', '\n').replace('\r', '\n'))
+    lines = [re.sub(r'[ \t\f\v]+', ' ', line).strip() for line in text.split('\n')]
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip()
+
+
+def _follows_forward_marker(lines, index):
+    previous = next((line.strip() for line in reversed(lines[:index]) if line.strip()), '')
+    return bool(FORWARD_MARKER_PATTERN.match(previous))
+
+
+def strip_quoted_text(text):
+    """Remove quoted reply history: '>' lines and everything after a reply header."""
+    lines = [line for line in text.split('\n') if not line.lstrip().startswith('>')]
+    for index, line in enumerate(lines):
+        stripped = line.strip()
+        # "On <date>, <name> wrote:" is often wrapped over two lines
+        joined = f"{stripped} {lines[index + 1].strip()}" if index + 1 < len(lines) else stripped
+        is_header = any(pattern.match(stripped) or pattern.match(joined) for pattern in QUOTE_HEADER_PATTERNS)
+        if not is_header and OUTLOOK_FROM_PATTERN.match(stripped) and not _follows_forward_marker(lines, index):
+            is_header = any(OUTLOOK_SENT_PATTERN.match(following.strip()) for following in lines[index + 1:index + 5])
+        # A message that is nothing but a quote keeps it
+        if is_header and '\n'.join(lines[:index]).strip():
+            return '\n'.join(lines[:index])
+    return '\n'.join(lines)
+
+
+def strip_signature(text):
+    """Remove a trailing signature block ('-- ' delimiter, 'Sent from my ...')."""
+    lines = text.split('\n')
+    start = max(1, len(lines) - SIGNATURE_SEARCH_LINES)
+    for index in range(start, len(lines)):
+        if any(pattern.match(lines[index].strip()) for pattern in SIGNATURE_PATTERNS):
+            return '\n'.join(lines[:index])
+    return text
+
+
+def clean_email_text(body_html='', body_plain=''):
+    """
+    Build the compact text version of an email used in AI prompts.
+
+    Args:
+        body_html: The text/html part, if any. Preferred, as it is usually complete.
+        body_plain: The text/plain part, if any.
+
+    Returns:
+        Plain text without markup, quoted history or signature.
+    """
+    text = html_to_text(body_html) if body_html else (body_plain or '')
+    text = collapse_whitespace(text)
+    return collapse_whitespace(strip_signature(strip_quoted_text(text)))
@@ -0,0 +1,155 @@
+"""
+Token counting and budget-aware truncation for AI prompts.
+"""
+import re
+
+try:
+    import tiktoken
+except ImportError:  # Optional: fall back to an estimate when tiktoken is not installed
+    tiktoken = None
+
+from config_manager import config_manager
+
+# Context windows of common models, matched by longest prefix after any "provider/" part
+MODEL_CONTEXT_WINDOWS = {
+    'gpt-4o': 128000,
+    'gpt-4.1': 1047576,
+    'gpt-4-turbo': 128000,
+    'gpt-4': 8192,
+    'gpt-3.5-turbo': 16385,
+    'o1': 200000,
+    'o3': 200000,
+    'o4-mini': 200000,
+    'claude': 200000,
+    'gemini': 1000000,
+    'deepseek': 64000,
+    'qwen': 32768,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# Tokens the chat format adds around each message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SENTENCE_END_PATTERN = re.compile(r'[.!?。！？](?=\s|$)|[。！？]')
+
+_encodings = {}
+
+
+def _get_encoding(model):
+    if tiktoken is None:
+        return None
+    name = (model or '').split('/')[-1]
+    if name not in _encodings:
+        try:
+            try:
+                _encodings[name] = tiktoken.encoding_for_model(name)
+            except KeyError:
+                _encodings[name] = tiktoken.get_encoding('o200k_base')
+        except Exception as e:
+            # tiktoken downloads encodings on first use, which fails offline; estimate instead
+            print(f"[ERROR] Could not load a tiktoken encoding for '{name}', estimating token counts: {e}")
+            _encodings[name] = None
+    return _encodings[name]
+
+
+def count_tokens(text, model=None):
+    """
+    Count the tokens in text for the given model.
+
+    Uses tiktoken when it is installed. Otherwise estimates about 4 characters per
+    token for ASCII text and one token per character for everything else (CJK).
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return ascii_chars // 4 + (len(text) - ascii_chars) + 1
+
+
+def get_context_window(model):
+    """Return the context window of a model, in tokens."""
+    name = (model or '').split('/')[-1].lower()
+    matches = [prefix for prefix in MODEL_CONTEXT_WINDOWS if name.startswith(prefix)]
+    if not matches:
+        return DEFAULT_CONTEXT_WINDOW
+    return MODEL_CONTEXT_WINDOWS[max(matches, key=len)]
+
+
+def get_input_budget(model, max_output_tokens, allowance=None):
+    """
+    Return how many input tokens a request may use.
+
+    Args:
+        model: The model name.
+        max_output_tokens: The max_tokens requested for the response.
+        allowance: The allowance for this kind of request. Defaults to AI_INPUT_TOKEN_BUDGET.
+
+    Returns:
+        The smaller of the allowance and what the model's context window leaves
+        after the response.
+    """
+    if allowance is None:
+        allowance = config_manager.get('AI_INPUT_TOKEN_BUDGET', 3000)
+    return max(0, min(allowance, get_context_window(model) - max_output_tokens))
+
+
+def truncate_to_tokens(text, max_tokens, model=None):
+    """
+    Shorten text to at most max_tokens, preferring to cut at a paragraph, line or sentence end.
+
+    Returns:
+        The text unchanged if it fits, otherwise a prefix of it.
+    """
+    if max_tokens <= 0 or not text:
+        return ''
+    if count_tokens(text, model) <= max_tokens:
+        return text
+
+    encoding = _get_encoding(model)
+    if encoding is not None:
+        prefix = encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+        # Decoding can end on a split multi-byte character
+        prefix = prefix.rstrip('�')
+    else:
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if count_tokens(text[:middle], model) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        prefix = text[:low]
+
+    # Only back off to a boundary if that keeps most of the allowance
+    minimum_length = len(prefix) * 3 // 4
+    for boundary in ('\n\n', '\n'):
+        cut = prefix.rfind(boundary)
+        if cut >= minimum_length:
+            return prefix[:cut].rstrip()
+    sentence_ends = [match.end() for match in SENTENCE_END_PATTERN.finditer(prefix)]
+    if sentence_ends and sentence_ends[-1] >= minimum_length:
+        return prefix[:sentence_ends[-1]]
+    return prefix
+
+
+def fit_body(body, system_prompt, user_prompt_prefix, model, max_output_tokens, allowance=None):
+    """
+    Truncate an email body so the whole request fits the model's input budget.
+
+    Args:
+        body: The email body.
+        system_prompt: The system message that will be sent.
+        user_prompt_prefix: The part of the user message that precedes the body
+            (sender, subject, labels).
+        model: The model name.
+        max_output_tokens: The max_tokens requested for the response.
+        allowance: Optional input allowance; see get_input_budget.
+
+    Returns:
+        The body, truncated if needed.
+    """
+    budget = get_input_budget(model, max_output_tokens, allowance)
+    fixed_tokens = count_tokens(system_prompt, model) + count_tokens(user_prompt_prefix, model) + 2 * MESSAGE_OVERHEAD_TOKENS
+    return truncate_to_tokens(body, budget - fixed_tokens, model)